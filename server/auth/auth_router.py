@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request
 from fastapi.security import HTTPAuthorizationCredentials
 from datetime import datetime, timedelta
 from typing import Dict, Any
@@ -12,25 +12,42 @@ from auth.models import (
 )
 from main import (
     get_db, get_redis, get_current_user, get_password_hash, 
-    verify_password, create_access_token, create_refresh_token,
+    verify_password, rehash_password_if_needed, create_access_token, create_refresh_token, issue_session_tokens,
+    principal_cache, session_store, token_cache, user_touch_buffer, mail_queue,
     security, limiter, ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from auth.sessions import SessionReplayed, new_session_id
 
 auth_router = APIRouter()
 
+FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+
 async def send_verification_email(email: str, token: str):
-    """Mock email sending function - implement with actual email service"""
-    print(f"📧 Verification email sent to {email} with token {token}")
+    """Queue the account verification email for the mail worker"""
+    link = f"{FRONTEND_URL}/verify-email?token={token}"
+    await mail_queue.enqueue(
+        email,
+        "Verify your Better Being account",
+        f"Welcome to Better Being!\n\nConfirm your email address within 24 hours:\n{link}\n",
+        kind="verification"
+    )
 
 async def send_password_reset_email(email: str, token: str):
-    """Mock email sending function - implement with actual email service"""
-    print(f"🔑 Password reset email sent to {email} with token {token}")
+    """Queue the password reset email for the mail worker"""
+    link = f"{FRONTEND_URL}/reset-password?token={token}"
+    await mail_queue.enqueue(
+        email,
+        "Reset your Better Being password",
+        f"Someone asked to reset your password. This link is valid for 1 hour:\n{link}\n\n"
+        "If it wasn't you, you can ignore this email.\n",
+        kind="password_reset"
+    )
 
 @auth_router.post("/register", response_model=TokenResponse)
 @limiter.limit("5/minute")
 async def register(
+    request: Request,
     user_data: UserRegister,
-    background_tasks: BackgroundTasks,
     db=Depends(get_db),
     redis=Depends(get_redis)
 ):
@@ -47,7 +64,7 @@ async def register(
         )
     
     # Hash password
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash(user_data.password)
     
     # Create user
     user = await db.fetchrow(
@@ -73,18 +90,10 @@ async def register(
     )
     
     # Send verification email
-    background_tasks.add_task(send_verification_email, user["email"], verification_token)
-    
-    # Create tokens
-    access_token = create_access_token(data={"sub": str(user["id"])})
-    refresh_token = create_refresh_token(data={"sub": str(user["id"])})
+    await send_verification_email(user["email"], verification_token)
     
-    # Store refresh token
-    await redis.setex(
-        f"refresh_token:{user['id']}",
-        86400 * 7,  # 7 days
-        refresh_token
-    )
+    # Create tokens bound to a new device session
+    access_token, refresh_token = await issue_session_tokens(user, request)
     
     user_response = UserResponse(**user)
     
@@ -98,7 +107,9 @@ async def register(
 @auth_router.post("/login", response_model=TokenResponse)
 @limiter.limit("10/minute")
 async def login(
+    request: Request,
     credentials: UserLogin,
+    background_tasks: BackgroundTasks,
     db=Depends(get_db),
     redis=Depends(get_redis)
 ):
@@ -112,29 +123,20 @@ async def login(
         credentials.email
     )
     
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    if not user or not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
-    # Create tokens
-    access_token = create_access_token(data={"sub": str(user["id"])})
-    refresh_token = create_refresh_token(data={"sub": str(user["id"])})
+    # Upgrade hashes made under an older cost policy after the response is sent
+    background_tasks.add_task(rehash_password_if_needed, user["id"], credentials.password, user["password_hash"])
     
-    # Store refresh token
-    await redis.setex(
-        f"refresh_token:{user['id']}",
-        86400 * 7,  # 7 days
-        refresh_token
-    )
+    # Create tokens bound to a new device session
+    access_token, refresh_token = await issue_session_tokens(user, request)
     
-    # Update last login
-    await db.execute(
-        "UPDATE users SET last_login = $1 WHERE id = $2",
-        datetime.utcnow(),
-        user["id"]
-    )
+    # Update last login (buffered, flushed in batches)
+    user_touch_buffer.touch(user["id"])
     
     user_response = UserResponse(
         id=user["id"],
@@ -155,6 +157,7 @@ async def login(
 
 @auth_router.post("/refresh", response_model=Dict[str, Any])
 async def refresh_access_token(
+    request: Request,
     refresh_data: RefreshToken,
     redis=Depends(get_redis)
 ):
@@ -176,19 +179,34 @@ async def refresh_access_token(
                 detail="Invalid refresh token"
             )
         
-        # Check if refresh token exists in Redis
-        stored_token = await redis.get(f"refresh_token:{user_id}")
-        if not stored_token or stored_token != refresh_data.refresh_token:
+        # Rotate the refresh token within its device session (one Redis call)
+        session_id = payload.get("sid") or new_session_id()
+        new_access_token = create_access_token(data={"sub": user_id, "sid": session_id})
+        new_refresh_token = create_refresh_token(data={"sub": user_id, "sid": session_id})
+        try:
+            if payload.get("sid"):
+                valid = await session_store.use(
+                    user_id, session_id, refresh_data.refresh_token, rotate_to=new_refresh_token
+                )
+            else:
+                # Token issued before per-device sessions; move it into one
+                valid = await session_store.adopt_legacy(
+                    user_id, refresh_data.refresh_token, session_id, rotate_to=new_refresh_token,
+                    user_agent=request.headers.get("user-agent"),
+                    ip_address=request.client.host if request.client else None
+                )
+        except SessionReplayed:
+            valid = False
+        
+        if not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Refresh token not found or expired"
             )
         
-        # Create new access token
-        new_access_token = create_access_token(data={"sub": user_id})
-        
         return {
             "access_token": new_access_token,
+            "refresh_token": new_refresh_token,
             "token_type": "bearer",
             "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
         }
@@ -201,11 +219,19 @@ async def refresh_access_token(
 
 @auth_router.post("/logout")
 async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
     user=Depends(get_current_user),
     redis=Depends(get_redis)
 ):
-    # Remove refresh token from Redis
-    await redis.delete(f"refresh_token:{user['id']}")
+    # End this device's session only
+    session_id = (await token_cache.decode(credentials.credentials)).get("sid")
+    if session_id:
+        await session_store.revoke(user["id"], session_id)
+    else:
+        await redis.delete(f"refresh_token:{user['id']}")
+    
+    # Stop accepting the access token used for this request
+    await token_cache.revoke(credentials.credentials)
     
     return {"message": "Successfully logged out"}
 
@@ -217,7 +243,6 @@ async def get_current_user_info(user=Depends(get_current_user)):
 @limiter.limit("3/minute")
 async def forgot_password(
     password_reset: PasswordReset,
-    background_tasks: BackgroundTasks,
     db=Depends(get_db),
     redis=Depends(get_redis)
 ):
@@ -238,7 +263,7 @@ async def forgot_password(
         )
         
         # Send password reset email
-        background_tasks.add_task(send_password_reset_email, user["email"], reset_token)
+        await send_password_reset_email(user["email"], reset_token)
     
     return {"message": "If the email exists, a reset link has been sent"}
 
@@ -258,7 +283,7 @@ async def reset_password(
         )
     
     # Hash new password
-    new_password_hash = get_password_hash(reset_data.new_password)
+    new_password_hash = await get_password_hash(reset_data.new_password)
     
     # Update password
     await db.execute(
@@ -271,8 +296,10 @@ async def reset_password(
     # Delete reset token
     await redis.delete(f"password_reset:{reset_data.token}")
     
-    # Invalidate all refresh tokens for this user
-    await redis.delete(f"refresh_token:{user_id}")
+    # Invalidate all sessions for this user
+    await session_store.revoke_all(user_id)
+    await principal_cache.invalidate(int(user_id))
+    await token_cache.revoke_user(user_id)
     
     return {"message": "Password successfully reset"}
 
@@ -292,11 +319,13 @@ async def verify_email(
         )
     
     # Update user verification status
-    await db.execute(
-        "UPDATE users SET email_verified = true, updated_at = $1 WHERE email = $2",
+    user_id = await db.fetchval(
+        "UPDATE users SET email_verified = true, updated_at = $1 WHERE email = $2 RETURNING id",
         datetime.utcnow(),
         email
     )
+    if user_id is not None:
+        await principal_cache.invalidate(user_id)
     
     # Delete verification token
     await redis.delete(f"email_verification:{verification.token}")
@@ -307,7 +336,6 @@ async def verify_email(
 @limiter.limit("3/minute")
 async def resend_verification(
     email_request: EmailVerification,
-    background_tasks: BackgroundTasks,
     db=Depends(get_db),
     redis=Depends(get_redis)
 ):
@@ -338,6 +366,6 @@ async def resend_verification(
     )
     
     # Send verification email
-    background_tasks.add_task(send_verification_email, user["email"], verification_token)
+    await send_verification_email(user["email"], verification_token)
     
     return {"message": "Verification email sent"}
\ No newline at end of file
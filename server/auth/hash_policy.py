@@ -0,0 +1,121 @@
+"""Password hash policy: CryptContext construction and cost calibration.
+
+The cost parameters come from the environment so each deployment can pin
+values measured on its own hardware (see scripts/calibrate_password_hash.py).
+Hashes made under an older policy are flagged by ``needs_update`` and get
+upgraded on the user's next successful login.
+"""
+import logging
+import os
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+from passlib.context import CryptContext
+from passlib.hash import argon2
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BCRYPT_ROUNDS = 12
+MIN_BCRYPT_ROUNDS = 10
+MAX_BCRYPT_ROUNDS = 16
+DEFAULT_ARGON2_MEMORY_KIB = 65536
+MIN_ARGON2_TIME_COST = 2
+
+
+def argon2_available() -> bool:
+    return argon2.has_backend()
+
+
+def build_crypt_context(
+    scheme: Optional[str] = None,
+    bcrypt_rounds: Optional[int] = None,
+    argon2_time_cost: Optional[int] = None,
+    argon2_memory_cost: Optional[int] = None,
+    argon2_parallelism: Optional[int] = None,
+) -> CryptContext:
+    """Build the CryptContext for the configured policy.
+
+    bcrypt stays in the scheme list even when argon2 is primary so existing
+    hashes keep verifying; ``deprecated="auto"`` marks them for upgrade.
+    """
+    scheme = scheme or os.getenv("PASSWORD_HASH_SCHEME", "bcrypt")
+    bcrypt_rounds = bcrypt_rounds or int(os.getenv("BCRYPT_ROUNDS", str(DEFAULT_BCRYPT_ROUNDS)))
+    settings: Dict[str, Any] = {"bcrypt__rounds": bcrypt_rounds}
+
+    if scheme == "argon2" and not argon2_available():
+        logger.warning("PASSWORD_HASH_SCHEME=argon2 but argon2-cffi is not installed; using bcrypt")
+        scheme = "bcrypt"
+
+    schemes = ["bcrypt"]
+    if scheme == "argon2":
+        schemes = ["argon2", "bcrypt"]
+        settings.update({
+            "argon2__time_cost": argon2_time_cost or int(os.getenv("ARGON2_TIME_COST", str(MIN_ARGON2_TIME_COST))),
+            "argon2__memory_cost": argon2_memory_cost or int(os.getenv("ARGON2_MEMORY_COST", str(DEFAULT_ARGON2_MEMORY_KIB))),
+            "argon2__parallelism": argon2_parallelism or int(os.getenv("ARGON2_PARALLELISM", "1")),
+        })
+
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+def measure_hash_ms(context: CryptContext, samples: int = 5, password: str = "Calibrate123!") -> float:
+    """Median wall time of one ``context.hash`` call in milliseconds."""
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.hash(password)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate_bcrypt(target_ms: float, samples: int = 5) -> Dict[str, Any]:
+    """Pick the highest bcrypt cost whose median hash time fits ``target_ms``.
+
+    Each extra round doubles the work, so we stop as soon as a cost overshoots.
+    Never goes below MIN_BCRYPT_ROUNDS, even on slow hardware.
+    """
+    measurements: List[Dict[str, Any]] = []
+    chosen = MIN_BCRYPT_ROUNDS
+    for rounds in range(MIN_BCRYPT_ROUNDS, MAX_BCRYPT_ROUNDS + 1):
+        elapsed = measure_hash_ms(build_crypt_context("bcrypt", bcrypt_rounds=rounds), samples)
+        measurements.append({"rounds": rounds, "median_ms": round(elapsed, 2)})
+        if elapsed > target_ms:
+            break
+        chosen = rounds
+    return {
+        "scheme": "bcrypt",
+        "target_ms": target_ms,
+        "settings": {"BCRYPT_ROUNDS": chosen},
+        "measurements": measurements,
+    }
+
+
+def calibrate_argon2(target_ms: float, memory_cost: int = DEFAULT_ARGON2_MEMORY_KIB,
+                     parallelism: int = 1, samples: int = 5, max_time_cost: int = 10) -> Dict[str, Any]:
+    """Pick the highest argon2 time cost that fits ``target_ms`` at a fixed memory cost."""
+    if not argon2_available():
+        raise RuntimeError("argon2-cffi is not installed")
+
+    measurements: List[Dict[str, Any]] = []
+    chosen = MIN_ARGON2_TIME_COST
+    for time_cost in range(MIN_ARGON2_TIME_COST, max_time_cost + 1):
+        context = build_crypt_context(
+            "argon2", argon2_time_cost=time_cost, argon2_memory_cost=memory_cost, argon2_parallelism=parallelism
+        )
+        elapsed = measure_hash_ms(context, samples)
+        measurements.append({"time_cost": time_cost, "median_ms": round(elapsed, 2)})
+        if elapsed > target_ms:
+            break
+        chosen = time_cost
+    return {
+        "scheme": "argon2",
+        "target_ms": target_ms,
+        "settings": {
+            "PASSWORD_HASH_SCHEME": "argon2",
+            "ARGON2_TIME_COST": chosen,
+            "ARGON2_MEMORY_COST": memory_cost,
+            "ARGON2_PARALLELISM": parallelism,
+        },
+        "measurements": measurements,
+    }
@@ -0,0 +1,106 @@
+"""Async password hashing backed by a bounded worker pool.
+
+bcrypt releases the GIL while it works, so a small thread pool gives real
+parallelism without the pickling overhead of a process pool, and keeps the
+event loop free to serve other requests while a login is being checked.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full and the caller should back off."""
+
+
+def _percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class PasswordHasher:
+    """Run passlib hash/verify calls off the event loop with queue-depth limits.
+
+    At most ``max_workers`` hashes run at once and at most ``max_queue`` more
+    may wait for a worker. Anything beyond that is rejected immediately with
+    ``PasswordHasherBusy`` instead of piling up behind a login burst.
+    """
+
+    def __init__(self, context, max_workers: int = 4, max_queue: int = 64, sample_size: int = 1024):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pwd-hash")
+        self._in_flight = 0
+        self._counts: Dict[str, int] = {"hash": 0, "verify": 0, "rejected": 0, "errors": 0}
+        self._latency_ms: Deque[float] = deque(maxlen=sample_size)
+        self._queue_wait_ms: Deque[float] = deque(maxlen=sample_size)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", self.context.verify, password, hashed_password)
+
+    async def run(self, op: str, fn: Callable[..., Any], *args) -> Any:
+        """Run an arbitrary CPU-bound auth call through the same bounded pool."""
+        return await self._run(op, fn, *args)
+
+    async def _run(self, op: str, fn: Callable[..., Any], *args) -> Any:
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self._counts["rejected"] += 1
+            raise PasswordHasherBusy(f"Password hashing queue full ({self._in_flight} pending)")
+
+        self._in_flight += 1
+        submitted = time.perf_counter()
+
+        def _timed():
+            started = time.perf_counter()
+            return started, fn(*args)
+
+        try:
+            loop = asyncio.get_running_loop()
+            started, result = await loop.run_in_executor(self._executor, _timed)
+        except Exception:
+            self._counts["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+        finished = time.perf_counter()
+        self._counts[op] = self._counts.get(op, 0) + 1
+        self._queue_wait_ms.append((started - submitted) * 1000)
+        self._latency_ms.append((finished - submitted) * 1000)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        latency = list(self._latency_ms)
+        queue_wait = list(self._queue_wait_ms)
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "queued": max(0, self._in_flight - self.max_workers),
+            "counts": dict(self._counts),
+            "latency_ms": {
+                "p50": round(_percentile(latency, 50), 2),
+                "p95": round(_percentile(latency, 95), 2),
+                "max": round(max(latency), 2) if latency else 0.0,
+            },
+            "queue_wait_ms": {
+                "p50": round(_percentile(queue_wait, 50), 2),
+                "p95": round(_percentile(queue_wait, 95), 2),
+            },
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("✅ Password hasher pool shut down")
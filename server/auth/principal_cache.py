@@ -0,0 +1,134 @@
+"""Two-level cache for the principal returned by get_current_user.
+
+Level one is an in-process TTL LRU, level two a JSON snapshot in Redis. Each
+user has a version counter in Redis; invalidation bumps it, drops the
+snapshot and broadcasts the user ID so every worker evicts its local copy. A
+snapshot is only written back if the version has not moved since the loader
+read it, so a slow DB read racing an update can never resurrect stale data.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from cache.ttl_lru import TTLCache
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "principal:invalidate"
+
+# Write the snapshot only if the version counter still matches the one read
+# before the DB lookup (a missing counter counts as version 0).
+_STORE_IF_CURRENT = """
+local current = redis.call('GET', KEYS[1]) or '0'
+if current ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+def _snapshot_key(user_id: int) -> str:
+    return f"principal:{user_id}"
+
+
+def _version_key(user_id: int) -> str:
+    return f"principal:ver:{user_id}"
+
+
+class PrincipalCache:
+    def __init__(self, local_ttl: float = 15.0, redis_ttl: int = 300, max_entries: int = 10000):
+        self.local = TTLCache(max_entries=max_entries, ttl=local_ttl)
+        self.redis_ttl = redis_ttl
+        self.redis = None
+        self._store_script = None
+        self._counts = {"redis_hits": 0, "db_loads": 0, "invalidations": 0, "stale_writes_skipped": 0}
+
+    def bind(self, redis_client):
+        """Attach the shared Redis client (None keeps the cache process-local)."""
+        self.redis = redis_client
+        self._store_script = redis_client.register_script(_STORE_IF_CURRENT) if redis_client else None
+
+    async def load(self, user_id: int, fetch: Callable[[int], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """Return the cached principal for ``user_id``, falling back to ``fetch``."""
+        principal = self.local.get(user_id)
+        if principal is not None:
+            return principal
+
+        version = "0"
+        if self.redis:
+            try:
+                snapshot, version = await self.redis.mget(_snapshot_key(user_id), _version_key(user_id))
+                version = version or "0"
+                if snapshot:
+                    cached = json.loads(snapshot)
+                    if cached.get("version") == version:
+                        self._counts["redis_hits"] += 1
+                        self.local.set(user_id, cached["principal"])
+                        return cached["principal"]
+            except Exception as e:
+                logger.warning(f"Principal cache read failed for user {user_id}: {e}")
+
+        principal = await fetch(user_id)
+        self._counts["db_loads"] += 1
+        if principal is None:
+            return None
+
+        self.local.set(user_id, principal)
+        if self._store_script:
+            try:
+                stored = await self._store_script(
+                    keys=[_version_key(user_id), _snapshot_key(user_id)],
+                    args=[version, json.dumps({"version": version, "principal": principal}), self.redis_ttl],
+                )
+                if not stored:
+                    self._counts["stale_writes_skipped"] += 1
+                    self.local.pop(user_id)
+            except Exception as e:
+                logger.warning(f"Principal cache write failed for user {user_id}: {e}")
+        return principal
+
+    async def invalidate(self, user_id: int):
+        """Drop the cached principal everywhere; call after any change to the user row."""
+        self.local.pop(user_id)
+        self._counts["invalidations"] += 1
+        if not self.redis:
+            return
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.incr(_version_key(user_id))
+                pipe.expire(_version_key(user_id), 86400 * 7)
+                pipe.delete(_snapshot_key(user_id))
+                pipe.publish(INVALIDATION_CHANNEL, str(user_id))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Principal cache invalidation failed for user {user_id}: {e}")
+
+    async def listen_for_invalidations(self):
+        """Evict local entries invalidated by other workers. Runs until cancelled."""
+        if not self.redis:
+            return
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        try:
+                            self.local.pop(int(message["data"]))
+                        except (TypeError, ValueError):
+                            continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Without the channel local entries may outlive a change, so
+                # drop them all and resubscribe.
+                logger.warning(f"Principal invalidation listener error: {e}")
+                self.local.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"local": self.local.stats(), **self._counts}
@@ -0,0 +1,202 @@
+"""Multi-device refresh-token sessions stored in one Redis hash per user.
+
+``sessions:{user_id}`` maps a session ID (one per device/login) to a JSON
+record holding a digest of the current refresh token, its expiry and some
+device details. Every operation a request needs is a single Lua call, so a
+login, refresh or revoke costs one round trip and is atomic with respect to
+concurrent requests for the same user. Refresh tokens rotate on use; a
+presented token that no longer matches its session is treated as replayed
+and the session is revoked.
+"""
+import hashlib
+import json
+import logging
+import secrets
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] sessions hash
+# ARGV: session_id, record json, now, max_sessions, key_ttl
+_CREATE = """
+local entries = redis.call('HGETALL', KEYS[1])
+local now = tonumber(ARGV[3])
+local live = {}
+for i = 1, #entries, 2 do
+    local ok, record = pcall(cjson.decode, entries[i + 1])
+    if not ok or tonumber(record.expires_at) <= now then
+        redis.call('HDEL', KEYS[1], entries[i])
+    else
+        table.insert(live, {entries[i], tonumber(record.last_used_at)})
+    end
+end
+local max_sessions = tonumber(ARGV[4])
+if #live >= max_sessions then
+    table.sort(live, function(a, b) return a[2] < b[2] end)
+    for i = 1, #live - max_sessions + 1 do
+        redis.call('HDEL', KEYS[1], live[i][1])
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+# KEYS[1] sessions hash
+# ARGV: session_id, presented digest, new digest ('' to keep), now, new expires_at, key_ttl
+# Returns 1 ok, 0 unknown/expired, -1 replayed token (session revoked)
+_USE = """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if not raw then
+    return 0
+end
+local record = cjson.decode(raw)
+local now = tonumber(ARGV[4])
+if tonumber(record.expires_at) <= now then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return 0
+end
+if record.token ~= ARGV[2] then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return -1
+end
+if ARGV[3] ~= '' then
+    record.token = ARGV[3]
+    record.expires_at = tonumber(ARGV[5])
+end
+record.last_used_at = now
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(record))
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return 1
+"""
+
+# Move a pre-session `refresh_token:{user_id}` value into the hash.
+# KEYS[1] legacy key, KEYS[2] sessions hash
+# ARGV: presented token, session_id, record json, key_ttl
+_ADOPT_LEGACY = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+
+# KEYS[1] sessions hash; ARGV[1] session to keep
+_REVOKE_OTHERS = """
+local removed = 0
+for _, session_id in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if session_id ~= ARGV[1] then
+        redis.call('HDEL', KEYS[1], session_id)
+        removed = removed + 1
+    end
+end
+return removed
+"""
+
+
+class SessionReplayed(Exception):
+    """A refresh token was presented after it had already been rotated."""
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(12)
+
+
+def _digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _sessions_key(user_id) -> str:
+    return f"sessions:{user_id}"
+
+
+class SessionStore:
+    def __init__(self, session_ttl: int, max_sessions: int = 10):
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.redis = None
+        self._create = self._use = self._adopt = self._revoke_others = None
+
+    def bind(self, redis_client):
+        self.redis = redis_client
+        if redis_client:
+            self._create = redis_client.register_script(_CREATE)
+            self._use = redis_client.register_script(_USE)
+            self._adopt = redis_client.register_script(_ADOPT_LEGACY)
+            self._revoke_others = redis_client.register_script(_REVOKE_OTHERS)
+
+    def _record(self, refresh_token: str, user_agent: Optional[str], ip_address: Optional[str]) -> str:
+        now = int(time.time())
+        return json.dumps({
+            "token": _digest(refresh_token),
+            "created_at": now,
+            "last_used_at": now,
+            "expires_at": now + self.session_ttl,
+            "user_agent": (user_agent or "")[:255],
+            "ip_address": ip_address,
+        })
+
+    async def create(self, user_id, session_id: str, refresh_token: str,
+                     user_agent: Optional[str] = None, ip_address: Optional[str] = None):
+        """Register a new device session, pruning expired ones and evicting the oldest past the cap."""
+        await self._create(
+            keys=[_sessions_key(user_id)],
+            args=[session_id, self._record(refresh_token, user_agent, ip_address),
+                  int(time.time()), self.max_sessions, self.session_ttl],
+        )
+
+    async def use(self, user_id, session_id: str, refresh_token: str, rotate_to: Optional[str] = None) -> bool:
+        """Check a presented refresh token, optionally rotating it to ``rotate_to``.
+
+        Returns False for unknown or expired sessions and raises SessionReplayed
+        (after revoking the session) when the token was already rotated away.
+        """
+        now = int(time.time())
+        result = await self._use(
+            keys=[_sessions_key(user_id)],
+            args=[session_id, _digest(refresh_token), _digest(rotate_to) if rotate_to else "",
+                  now, now + self.session_ttl, self.session_ttl],
+        )
+        if result == -1:
+            logger.warning(f"Refresh token replay detected for user {user_id}, session {session_id} revoked")
+            raise SessionReplayed(session_id)
+        return result == 1
+
+    async def adopt_legacy(self, user_id, refresh_token: str, session_id: str, rotate_to: Optional[str] = None,
+                           user_agent: Optional[str] = None, ip_address: Optional[str] = None) -> bool:
+        """Accept a refresh token issued before sessions existed and file it under ``session_id``."""
+        record = self._record(rotate_to or refresh_token, user_agent, ip_address)
+        result = await self._adopt(
+            keys=[f"refresh_token:{user_id}", _sessions_key(user_id)],
+            args=[refresh_token, session_id, record, self.session_ttl],
+        )
+        return result == 1
+
+    async def list_sessions(self, user_id) -> List[Dict[str, Any]]:
+        entries = await self.redis.hgetall(_sessions_key(user_id))
+        now = int(time.time())
+        sessions = []
+        for session_id, raw in entries.items():
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                continue
+            if record["expires_at"] <= now:
+                continue
+            record.pop("token", None)
+            sessions.append({"session_id": session_id, **record})
+        sessions.sort(key=lambda s: s["last_used_at"], reverse=True)
+        return sessions
+
+    async def revoke(self, user_id, session_id: str) -> bool:
+        return bool(await self.redis.hdel(_sessions_key(user_id), session_id))
+
+    async def revoke_all(self, user_id, except_session: Optional[str] = None) -> int:
+        """Drop every session for ``user_id`` (optionally keeping the caller's)."""
+        if except_session is None:
+            return await self.redis.delete(_sessions_key(user_id), f"refresh_token:{user_id}")
+        return await self._revoke_others(keys=[_sessions_key(user_id)], args=[except_session])
@@ -0,0 +1,235 @@
+"""Verified-JWT cache and switchable JWT backend.
+
+An access token is immutable for its whole lifetime, so once its signature
+and expiry have been checked the decoded claims can be reused until ``exp``.
+Entries are keyed by a digest of the token rather than the token itself.
+
+Revocations are stored in Redis until the token would have expired:
+
+    jwt:revoked:{digest}    a revoked token
+    jwt:cutoff:{user_id}    tokens issued to the user up to this time are revoked
+
+Every claims-cache miss checks both before the claims are cached, so a
+worker that starts after a logout or password reset still rejects the
+token. Revocations are also broadcast so workers that already cached the
+claims evict them; a worker that misses a broadcast drops its whole cache.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from cache.ttl_lru import TTLCache
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_CHANNEL = "jwt:revoke"
+
+
+def _revoked_key(digest: str) -> str:
+    return f"jwt:revoked:{digest}"
+
+
+def _cutoff_key(user_id) -> str:
+    return f"jwt:cutoff:{user_id}"
+
+
+class InvalidToken(Exception):
+    """Raised for tokens that fail signature, expiry or format checks."""
+
+
+def load_jwt_backend(name: str) -> Tuple[str, Callable[..., str], Callable[..., Dict[str, Any]]]:
+    """Return ``(name, encode, decode)`` for the requested backend.
+
+    ``pyjwt`` is noticeably faster than python-jose for HS256. A backend
+    that is unknown or not installed raises RuntimeError, so a misconfigured
+    worker fails at startup instead of quietly running the other backend.
+    """
+    if name not in ("jose", "pyjwt"):
+        raise RuntimeError(f"Unknown JWT_BACKEND {name!r}; use 'jose' or 'pyjwt'")
+    if name == "pyjwt":
+        try:
+            import jwt as pyjwt
+        except ImportError:
+            raise RuntimeError("JWT_BACKEND=pyjwt but PyJWT is not installed")
+
+        def _encode(claims, key, algorithm):
+            return pyjwt.encode(claims, key, algorithm=algorithm)
+
+        def _decode(token, key, algorithms):
+            try:
+                return pyjwt.decode(token, key, algorithms=algorithms)
+            except pyjwt.PyJWTError as e:
+                raise InvalidToken(str(e))
+
+        return "pyjwt", _encode, _decode
+
+    from jose import JWTError, jwt as jose_jwt
+
+    def _encode(claims, key, algorithm):
+        return jose_jwt.encode(claims, key, algorithm=algorithm)
+
+    def _decode(token, key, algorithms):
+        try:
+            return jose_jwt.decode(token, key, algorithms=algorithms)
+        except JWTError as e:
+            raise InvalidToken(str(e))
+
+    return "jose", _encode, _decode
+
+
+def token_digest(token: str) -> str:
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
+class VerifiedTokenCache:
+    def __init__(self, decode: Callable[..., Dict[str, Any]], key: str, algorithms,
+                 max_entries: int = 50000, max_token_lifetime: int = 86400):
+        self._decode = decode
+        self._key = key
+        self._algorithms = algorithms
+        self.claims = TTLCache(max_entries=max_entries)
+        self._revoked = TTLCache(max_entries=max_entries, ttl=max_token_lifetime)
+        self._user_cutoffs = TTLCache(max_entries=max_entries, ttl=max_token_lifetime)
+        self.redis = None
+        self.max_token_lifetime = max_token_lifetime
+        self._counts = {"verified": 0, "rejected": 0, "revoked_hits": 0, "revocation_check_errors": 0}
+
+    def bind(self, redis_client):
+        self.redis = redis_client
+
+    async def decode(self, token: str) -> Dict[str, Any]:
+        """Return verified claims, checking the signature and Redis revocations only on a cache miss."""
+        digest = token_digest(token)
+        if self._revoked.get(digest) is not None:
+            self._counts["revoked_hits"] += 1
+            raise InvalidToken("Token has been revoked")
+
+        claims = self.claims.get(digest)
+        if claims is None:
+            try:
+                claims = self._decode(token, self._key, self._algorithms)
+            except InvalidToken:
+                self._counts["rejected"] += 1
+                raise
+            self._counts["verified"] += 1
+            checked = await self._load_revocations(digest, claims)
+            if checked and isinstance(claims.get("exp"), (int, float)):
+                self.claims.set(digest, claims, expires_at=float(claims["exp"]))
+
+        cutoff = self._user_cutoffs.get(claims.get("sub"))
+        # Sub-second iat and cutoff: a token issued in the same second, but
+        # before the revocation, is still rejected
+        if cutoff is not None and claims.get("iat", 0) <= cutoff:
+            self.claims.pop(digest)
+            self._counts["revoked_hits"] += 1
+            raise InvalidToken("Token has been revoked")
+        return claims
+
+    async def _load_revocations(self, digest: str, claims: Dict[str, Any]) -> bool:
+        """Apply revocations recorded in Redis for a token; returns False if they could not be read.
+
+        A revoked token raises InvalidToken. When Redis is unreachable the
+        token is accepted on local knowledge but not cached, so the next
+        request checks again.
+        """
+        if not self.redis:
+            return True
+        subject = claims.get("sub")
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.exists(_revoked_key(digest))
+                pipe.get(_cutoff_key(subject))
+                revoked, cutoff = await pipe.execute()
+        except Exception as e:
+            self._counts["revocation_check_errors"] += 1
+            logger.warning(f"Token revocation check failed: {e}")
+            return False
+        if cutoff is not None:
+            self._apply_user_revocation(str(subject), float(cutoff))
+        if revoked:
+            expires_at = claims.get("exp")
+            self._apply_token_revocation(
+                digest, float(expires_at) if isinstance(expires_at, (int, float)) else time.time() + self._revoked.ttl
+            )
+            self._counts["revoked_hits"] += 1
+            raise InvalidToken("Token has been revoked")
+        return True
+
+    def _apply_token_revocation(self, digest: str, expires_at: float):
+        self.claims.pop(digest)
+        self._revoked.set(digest, True, expires_at=expires_at)
+
+    def _apply_user_revocation(self, user_id: str, cutoff: float):
+        self._user_cutoffs.set(user_id, cutoff)
+
+    async def revoke(self, token: str, expires_at: Optional[float] = None):
+        """Reject ``token`` from now on, on every worker, until it would have expired."""
+        digest = token_digest(token)
+        if expires_at is None:
+            cached = self.claims.get(digest) or {}
+            expires_at = float(cached.get("exp") or time.time() + self._revoked.ttl)
+        self._apply_token_revocation(digest, expires_at)
+        await self._store(_revoked_key(digest), 1, expires_at - time.time())
+        await self._publish(f"token:{digest}:{expires_at}")
+
+    async def revoke_user(self, user_id):
+        """Reject every token issued to ``user_id`` before now (e.g. after a password change)."""
+        cutoff = time.time()
+        self._apply_user_revocation(str(user_id), cutoff)
+        await self._store(_cutoff_key(user_id), cutoff, self.max_token_lifetime)
+        await self._publish(f"user:{user_id}:{cutoff}")
+
+    async def _store(self, key: str, value, ttl: float):
+        if not self.redis or ttl <= 0:
+            return
+        try:
+            await self.redis.set(key, value, ex=max(1, int(ttl) + 1))
+        except Exception as e:
+            logger.warning(f"Token revocation not stored: {e}")
+
+    async def _publish(self, message: str):
+        if not self.redis:
+            return
+        try:
+            await self.redis.publish(REVOCATION_CHANNEL, message)
+        except Exception as e:
+            logger.warning(f"Token revocation broadcast failed: {e}")
+
+    async def listen_for_revocations(self):
+        """Apply revocations published by other workers. Runs until cancelled."""
+        if not self.redis:
+            return
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(REVOCATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        kind, subject, value = message["data"].split(":", 2)
+                        if kind == "token":
+                            self._apply_token_revocation(subject, float(value))
+                        elif kind == "user":
+                            self._apply_user_revocation(subject, float(value))
+                    except ValueError:
+                        continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # A missed revocation must not leave a token usable from cache.
+                logger.warning(f"Token revocation listener error: {e}")
+                self.claims.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "claims": self.claims.stats(),
+            "revoked_tokens": len(self._revoked),
+            "revoked_users": len(self._user_cutoffs),
+            **self._counts,
+        }
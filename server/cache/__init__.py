@@ -0,0 +1 @@
+"""In-process caching helpers shared by the API routers."""
@@ -0,0 +1,53 @@
+"""Fixed-size Bloom filter for cheap negative lookups."""
+import hashlib
+import math
+from typing import Any, Dict, Iterable
+
+
+class BloomFilter:
+    """Set membership with no false negatives and a bounded false-positive rate.
+
+    Sized for ``capacity`` items at ``error_rate``; adding more items than
+    that raises the false-positive rate rather than failing. Items cannot be
+    removed, so owners rebuild the filter when the underlying set shrinks.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @classmethod
+    def build(cls, items: Iterable[str], error_rate: float = 0.001) -> "BloomFilter":
+        items = list(items)
+        bloom = cls(len(items), error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        # Double hashing: k positions from two independent 64-bit hashes
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def expected_error_rate(self) -> float:
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "items": self.count,
+            "bits": self.size,
+            "hashes": self.hashes,
+            "expected_false_positive_rate": round(self.expected_error_rate(), 6),
+        }
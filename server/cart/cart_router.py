@@ -1,151 +1,184 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from decimal import Decimal
-from datetime import datetime
-from typing import List, Optional, Dict, Any
-
-from cart.models import Cart, CartItem, CartItemCreate, CartItemUpdate, CartSummary, CartDiscount
-from main import get_db, get_current_user, limiter, get_redis
+from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, Tuple
+import logging
+import math
+
+from cart.models import (
+    Cart, CartItem, CartItemCreate, CartItemUpdate, CartSummary, CartDiscount,
+    CartQuote, CartQuoteCandidate, CartQuoteLine, CartQuoteRequest, CartQuoteResponse,
+)
+from cart.pricing import CartPricing, DiscountRule, price_cart
+from cart.store import CartItemMissing, CartLimitExceeded
+from inventory.reservations import Hold
+from ratelimit.limiter import client_ip, parse_rate
+from main import (
+    get_db, get_current_user, limiter, get_redis, cart_store, cart_snapshots, cart_summary, discount_rules,
+    stock_reservations,
+)
+
+logger = logging.getLogger(__name__)
 
 cart_router = APIRouter()
 
-def calculate_estimated_tax(subtotal: Decimal) -> Decimal:
-    """Calculate estimated tax (15% VAT for South Africa)"""
-    return subtotal * Decimal('0.15')
-
-def calculate_estimated_shipping(subtotal: Decimal) -> Decimal:
-    """Calculate estimated shipping costs"""
-    if subtotal >= Decimal('500.00'):  # Free shipping over R500
-        return Decimal('0.00')
-    return Decimal('75.00')  # Standard shipping fee
-
-async def _compute_discount_for_code(db, user_id: int, subtotal: Decimal, estimated_shipping: Decimal, code: Optional[str]) -> Dict[str, Any]:
-    """Validate and compute discount for a given code based on current cart."""
-    if not code:
-        return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": None}
-
-    # Fetch discount code
-    discount = await db.fetchrow(
-        """
-        SELECT id, code, name, type, value, minimum_order_amount, maximum_discount_amount,
-               usage_limit, usage_limit_per_customer, used_count, applies_to,
-               applicable_product_ids, applicable_category_ids,
-               starts_at, ends_at, is_active
-        FROM discount_codes
-        WHERE LOWER(code) = LOWER($1)
-        """,
-        code
+# Quotes are anonymous, so each one that carries a promo code also spends
+# from a per-client budget for code lookups (the same rate as apply-promo)
+PROMO_QUOTE_RATE = parse_rate("20/minute")
+
+MAX_ITEM_QUANTITY = 99
+
+CART_LINES_QUERY = """
+    SELECT 
+        ci.id, ci.user_id, ci.product_id, ci.quantity, ci.created_at, ci.updated_at,
+        p.name as product_name, p.price as product_price, p.slug as product_slug,
+        p.stock_quantity, p.category_id, pi.url as product_image,
+        (ci.quantity * p.price) as subtotal
+    FROM cart_items ci
+    JOIN products p ON ci.product_id = p.id
+    LEFT JOIN product_images pi ON p.id = pi.product_id AND pi.is_primary = true
+    WHERE ci.user_id = $1 AND p.is_active = true
+    ORDER BY ci.created_at DESC
+"""
+
+CART_PRODUCTS_QUERY = """
+    SELECT p.id, p.name, p.price, p.slug, p.stock_quantity, p.category_id, pi.url as image
+    FROM products p
+    LEFT JOIN product_images pi ON p.id = pi.product_id AND pi.is_primary = true
+    WHERE p.id = ANY($1) AND p.is_active = true
+"""
+
+# Add to cart in one round trip: stock check, upsert and the joined item row.
+# Returns no row for an unknown product, and a row with a NULL id when a
+# limit was hit (available/current_quantity explain which). ``inserted`` is
+# true when the line is new rather than a quantity increase.
+ADD_ITEM_QUERY = """
+    WITH product AS (
+        SELECT p.id, p.name, p.price, p.slug, p.stock_quantity, pi.url as image
+        FROM products p
+        LEFT JOIN product_images pi ON p.id = pi.product_id AND pi.is_primary = true
+        WHERE p.id = $2 AND p.is_active = true
+        LIMIT 1
+    ),
+    upsert AS (
+        INSERT INTO cart_items AS ci (user_id, product_id, quantity)
+        SELECT $1::int, product.id, $3::int
+        FROM product
+        WHERE $3::int <= product.stock_quantity
+        ON CONFLICT (user_id, product_id, variant_id) DO UPDATE
+            SET quantity = ci.quantity + EXCLUDED.quantity, updated_at = CURRENT_TIMESTAMP
+            WHERE ci.quantity + EXCLUDED.quantity <= LEAST((SELECT stock_quantity FROM product), $4::int)
+        RETURNING ci.id, ci.user_id, ci.product_id, ci.quantity, ci.created_at, ci.updated_at,
+            (ci.xmax = 0) as inserted
     )
+    SELECT 
+        upsert.id, upsert.user_id, upsert.product_id, upsert.quantity, upsert.created_at, upsert.updated_at,
+        product.name as product_name, product.price as product_price, product.slug as product_slug,
+        product.stock_quantity, product.image as product_image,
+        (upsert.quantity * product.price) as subtotal,
+        upsert.inserted,
+        product.stock_quantity as available,
+        (SELECT quantity FROM cart_items WHERE user_id = $1 AND product_id = $2 AND variant_id IS NULL) as current_quantity
+    FROM product
+    LEFT JOIN upsert ON true
+"""
+
+# Set a line's quantity in one round trip. No row: not the user's item;
+# NULL available: product gone; NULL id: not enough stock. The item is locked
+# first so previous_quantity is the one this update replaced.
+UPDATE_ITEM_QUERY = """
+    WITH item AS (
+        SELECT id, product_id, quantity FROM cart_items WHERE id = $1 AND user_id = $2 FOR UPDATE
+    ),
+    product AS (
+        SELECT p.id, p.name, p.price, p.slug, p.stock_quantity, pi.url as image
+        FROM item
+        JOIN products p ON p.id = item.product_id AND p.is_active = true
+        LEFT JOIN product_images pi ON p.id = pi.product_id AND pi.is_primary = true
+        LIMIT 1
+    ),
+    updated AS (
+        UPDATE cart_items ci
+        SET quantity = $3, updated_at = CURRENT_TIMESTAMP
+        FROM product
+        WHERE ci.id = $1 AND ci.user_id = $2 AND $3 <= product.stock_quantity
+        RETURNING ci.id, ci.user_id, ci.product_id, ci.quantity, ci.created_at, ci.updated_at
+    )
+    SELECT 
+        updated.id, updated.user_id, updated.product_id, updated.quantity, updated.created_at, updated.updated_at,
+        product.name as product_name, product.price as product_price, product.slug as product_slug,
+        product.stock_quantity, product.image as product_image,
+        (updated.quantity * product.price) as subtotal,
+        item.quantity as previous_quantity,
+        product.stock_quantity as available
+    FROM item
+    LEFT JOIN product ON true
+    LEFT JOIN updated ON true
+"""
+
+async def _fetch_cart_products(db, product_ids) -> Dict[int, Any]:
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    rows = await db.fetch(CART_PRODUCTS_QUERY, product_ids)
+    return {row['id']: row for row in rows}
+
+
+def _store_line(user_id: int, product, line: Dict[str, Any]) -> Dict[str, Any]:
+    """Cart line from the Redis store, under its ``cart_items`` id as in Postgres mode."""
+    return {
+        "id": line['id'],
+        "user_id": user_id,
+        "product_id": product['id'],
+        "quantity": line['quantity'],
+        "created_at": line['created_at'],
+        "updated_at": line['updated_at'],
+        "product_name": product['name'],
+        "product_price": product['price'],
+        "product_slug": product['slug'],
+        "stock_quantity": product['stock_quantity'],
+        "category_id": product['category_id'],
+        "product_image": product['image'],
+        "subtotal": line['quantity'] * product['price'],
+    }
 
-    if not discount:
-        return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": None}
-
-    # Validate basic flags
-    from datetime import datetime as _dt
-    now = _dt.utcnow()
-    if not discount["is_active"]:
-        return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": None}
-    if discount["starts_at"] and now < discount["starts_at"]:
-        return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": None}
-    if discount["ends_at"] and now > discount["ends_at"]:
-        return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": None}
-    if discount["usage_limit"] is not None and discount["used_count"] >= discount["usage_limit"]:
-        return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": None}
-
-    # Per-customer limit (based on prior orders usage)
-    if discount["usage_limit_per_customer"] is not None and discount["usage_limit_per_customer"] > 0:
-        used_by_customer = await db.fetchval(
-            "SELECT COUNT(*) FROM discount_code_uses WHERE discount_code_id = $1 AND user_id = $2",
-            discount["id"], user_id
-        )
-        if used_by_customer and used_by_customer >= discount["usage_limit_per_customer"]:
-            return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": None}
-
-    # Min order value
-    if discount["minimum_order_amount"] is not None and subtotal < discount["minimum_order_amount"]:
-        return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": code}
-
-    # Compute eligible subtotal based on applies_to
-    applies_to = (discount["applies_to"] or 'all').lower()
-    eligible_subtotal = subtotal
-    if applies_to == 'specific_products' and discount["applicable_product_ids"]:
-        eligible_subtotal = await db.fetchval(
-            """
-            SELECT COALESCE(SUM(ci.quantity * p.price), 0)
-            FROM cart_items ci
-            JOIN products p ON ci.product_id = p.id
-            WHERE ci.user_id = $1 AND p.is_active = true AND ci.product_id = ANY($2)
-            """,
-            user_id, discount["applicable_product_ids"]
-        ) or Decimal('0.00')
-    elif applies_to == 'specific_categories' and discount["applicable_category_ids"]:
-        eligible_subtotal = await db.fetchval(
-            """
-            SELECT COALESCE(SUM(ci.quantity * p.price), 0)
-            FROM cart_items ci
-            JOIN products p ON ci.product_id = p.id
-            WHERE ci.user_id = $1 AND p.is_active = true AND p.category_id = ANY($2)
-            """,
-            user_id, discount["applicable_category_ids"]
-        ) or Decimal('0.00')
-
-    discount_amount = Decimal('0.00')
-    description = discount["name"] or "Promotion"
-    dtype = (discount["type"] or '').lower()
 
-    if dtype == 'percentage':
-        discount_amount = (eligible_subtotal * (Decimal(discount["value"]) / Decimal('100'))).quantize(Decimal('0.01'))
-    elif dtype == 'fixed_amount':
-        discount_amount = min(Decimal(discount["value"]), eligible_subtotal)
-    elif dtype == 'free_shipping':
-        discount_amount = (Decimal(estimated_shipping) if estimated_shipping else Decimal('0.00')).quantize(Decimal('0.01'))
+async def load_cart_lines(db, user_id: int) -> List[Dict[str, Any]]:
+    """Priced lines of the user's cart (active products only), newest first."""
+    _, cart_lines = await load_cart(db, user_id)
+    return cart_lines
 
-    # Cap by maximum_discount_amount
-    if discount["maximum_discount_amount"] is not None:
-        discount_amount = min(discount_amount, Decimal(discount["maximum_discount_amount"]))
 
-    if discount_amount <= 0:
-        return {"discount_total": Decimal('0.00'), "discounts": [], "applied_code": code}
+async def load_cart(db, user_id: int) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+    """``load_cart_lines`` plus the Redis cart version they were read at (None in Postgres mode)."""
+    if not cart_store.enabled:
+        return None, [dict(row) for row in await db.fetch(CART_LINES_QUERY, user_id)]
 
-    return {
-        "discount_total": discount_amount,
-        "discounts": [
-            {
-                "source": "promotion",
-                "code": discount["code"],
-                "description": description,
-                "amount": discount_amount,
-            }
-        ],
-        "applied_code": discount["code"],
-    }
+    version, lines = await cart_store.load(user_id)
+    products = await _fetch_cart_products(db, lines.keys())
+    cart_lines = [
+        _store_line(user_id, products[product_id], line)
+        for product_id, line in lines.items() if product_id in products
+    ]
+    cart_lines.sort(key=lambda line: line['created_at'], reverse=True)
+    return version, cart_lines
 
 
-async def build_cart_response(user, db, redis) -> Cart:
-    query = """
-        SELECT 
-            ci.id, ci.user_id, ci.product_id, ci.quantity, ci.created_at, ci.updated_at,
-            p.name as product_name, p.price as product_price, p.slug as product_slug,
-            p.stock_quantity, pi.url as product_image,
-            (ci.quantity * p.price) as subtotal
-        FROM cart_items ci
-        JOIN products p ON ci.product_id = p.id
-        LEFT JOIN product_images pi ON p.id = pi.product_id AND pi.is_primary = true
-        WHERE ci.user_id = $1 AND p.is_active = true
-        ORDER BY ci.created_at DESC
-    """
+async def price_cart_lines(db, user_id: int, lines: List[Dict[str, Any]], code: Optional[str]) -> CartPricing:
+    """Price loaded lines; the discount rule and usage count come from the rule cache."""
+    rule = await discount_rules.get(db, code) if code else None
+    customer_uses = await discount_rules.uses_by_customer(db, rule, user_id) if rule else 0
+    return price_cart(lines, code, rule, customer_uses)
 
-    cart_items_data = await db.fetch(query, user['id'])
 
-    cart_items: List[CartItem] = []
-    subtotal = Decimal('0.00')
+async def build_cart_response(user, db, redis) -> Cart:
+    cart, _ = await render_cart(user, db, redis)
+    return cart
 
-    for row in cart_items_data:
-        item_dict = dict(row)
-        cart_items.append(CartItem(**item_dict))
-        subtotal += item_dict['subtotal']
 
-    estimated_tax = calculate_estimated_tax(subtotal)
-    estimated_shipping = calculate_estimated_shipping(subtotal)
+async def render_cart(user, db, redis) -> Tuple[Cart, Optional[datetime]]:
+    """The cart response and when its pricing expires (see ``CartPricing.expires_at``)."""
+    lines = await load_cart_lines(db, user['id'])
 
     # Applied promo code from Redis
     applied_code: Optional[str] = None
@@ -154,35 +187,105 @@ async def build_cart_response(user, db, redis) -> Cart:
     except Exception:
         applied_code = None
 
-    # Compute discount for applied code
-    discount_result = await _compute_discount_for_code(db, user['id'], subtotal, estimated_shipping, applied_code)
-    discount_total = discount_result["discount_total"]
-    discounts_payload = [CartDiscount(**d) for d in discount_result["discounts"]]
-    applied_promo_code = discount_result["applied_code"]
-
-    estimated_total = subtotal + estimated_tax + estimated_shipping - discount_total
-    if estimated_total < 0:
-        estimated_total = Decimal('0.00')
-
-    return Cart(
-        items=cart_items,
-        total_items=len(cart_items),
-        subtotal=subtotal,
-        discount_total=discount_total,
-        applied_promo_code=applied_promo_code,
-        discounts=discounts_payload,
-        estimated_tax=estimated_tax,
-        estimated_shipping=estimated_shipping,
-        estimated_total=estimated_total
+    pricing = await price_cart_lines(db, user['id'], lines, applied_code)
+
+    cart = Cart(
+        items=[CartItem(**item_dict) for item_dict in lines],
+        total_items=len(lines),
+        subtotal=pricing.subtotal,
+        discount_total=pricing.discount_total,
+        applied_promo_code=pricing.applied_code,
+        discounts=[CartDiscount(**d) for d in pricing.discounts],
+        estimated_tax=pricing.estimated_tax,
+        estimated_shipping=pricing.estimated_shipping,
+        estimated_total=pricing.estimated_total
     )
+    return cart, pricing.expires_at
+
+
+async def record_cart_change(user_id: int, items: int = 0, amount: Decimal = Decimal('0.00'), op: str = "delta"):
+    """Apply a mutation to the badge counters and bump the cart version; see ``CartSummaryCounters.record``."""
+    if not await cart_summary.record(user_id, items, amount, op):
+        await cart_snapshots.bump(user_id)
+
+
+async def _store_add_item(user_id: int, item_data: CartItemCreate, db) -> CartItem:
+    product = (await _fetch_cart_products(db, [item_data.product_id])).get(item_data.product_id)
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+
+    if product['stock_quantity'] < item_data.quantity:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Only {product['stock_quantity']} items available in stock"
+        )
+
+    try:
+        line = await cart_store.add(
+            user_id, product['id'], item_data.quantity, min(product['stock_quantity'], MAX_ITEM_QUANTITY)
+        )
+    except CartLimitExceeded as e:
+        if e.current + item_data.quantity > product['stock_quantity']:
+            detail = f"Cannot add {item_data.quantity} more items. Only {product['stock_quantity']} available in stock"
+        else:
+            detail = f"Cannot add more than {MAX_ITEM_QUANTITY} items to cart"
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+    await record_cart_change(user_id, int(line['previous'] == 0), (line['quantity'] - line['previous']) * product['price'])
+    return CartItem(**_store_line(user_id, product, line))
+
+
+async def _store_update_item(user_id: int, product_id: int, item_id: int, update_data: CartItemUpdate,
+                             db) -> CartItem:
+    product = (await _fetch_cart_products(db, [product_id])).get(product_id)
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+
+    try:
+        line = await cart_store.set_quantity(
+            user_id, product_id, item_id, update_data.quantity, product['stock_quantity']
+        )
+    except CartItemMissing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cart item not found"
+        )
+    except CartLimitExceeded:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Only {product['stock_quantity']} items available in stock"
+        )
+
+    await record_cart_change(user_id, 0, (line['quantity'] - line['previous']) * product['price'])
+    return CartItem(**_store_line(user_id, product, line))
 
 
 @cart_router.get("/", response_model=Cart)
-async def get_cart(user=Depends(get_current_user), db=Depends(get_db), redis=Depends(get_redis)):
-    return await build_cart_response(user, db, redis)
+async def get_cart(request: Request, user=Depends(get_current_user), db=Depends(get_db), redis=Depends(get_redis)):
+    # Read the versions before loading, so a concurrent change is never cached under them
+    version = await cart_snapshots.version(user['id'])
+    generation = discount_rules.generation
+    snapshot = cart_snapshots.get(user['id'], version, generation)
+    if snapshot is None:
+        cart, expires_at = await render_cart(user, db, redis)
+        snapshot = cart_snapshots.put(user['id'], version, generation, cart.model_dump_json().encode(), expires_at)
+
+    headers = {"ETag": snapshot.etag, "Cache-Control": "private, no-cache"}
+    if cart_snapshots.not_modified(request.headers.get("if-none-match"), snapshot):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+async def _count_cart(db, user_id: int):
+    if cart_store.enabled:
+        lines = await load_cart_lines(db, user_id)
+        return len(lines), sum((line['subtotal'] for line in lines), Decimal('0.00'))
 
-@cart_router.get("/summary", response_model=CartSummary)
-async def get_cart_summary(user=Depends(get_current_user), db=Depends(get_db)):
     query = """
         SELECT 
             COUNT(ci.id) as item_count,
@@ -192,13 +295,82 @@ async def get_cart_summary(user=Depends(get_current_user), db=Depends(get_db)):
         WHERE ci.user_id = $1 AND p.is_active = true
     """
     
-    result = await db.fetchrow(query, user['id'])
+    result = await db.fetchrow(query, user_id)
+    return result['item_count'], result['subtotal'] or Decimal('0.00')
+
+@cart_router.get("/summary", response_model=CartSummary)
+async def get_cart_summary(user=Depends(get_current_user)):
+    # Served from the badge counters; only a miss needs a database connection
+    counters = await cart_summary.get(user['id'])
+    if counters is not None:
+        return CartSummary(item_count=counters[0], subtotal=counters[1])
+
+    if not cart_summary.pool:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not available"
+        )
+    # Read the version before counting, so counters from a stale count are never stored
+    version = await cart_snapshots.version(user['id'])
+    async with cart_summary.pool.acquire() as db:
+        item_count, subtotal = await _count_cart(db, user['id'])
+    await cart_summary.seed(user['id'], version, item_count, subtotal)
     
     return CartSummary(
-        item_count=result['item_count'],
-        subtotal=result['subtotal'] or Decimal('0.00')
+        item_count=item_count,
+        subtotal=subtotal
     )
 
+async def _line_quantity(db, user_id: int, product_id: int) -> int:
+    if cart_store.enabled:
+        _, lines = await cart_store.load(user_id)
+        return lines[product_id]['quantity'] if product_id in lines else 0
+    quantity = await db.fetchval(
+        "SELECT quantity FROM cart_items WHERE user_id = $1 AND product_id = $2 AND variant_id IS NULL",
+        user_id, product_id
+    )
+    return quantity or 0
+
+
+async def _hold_stock(user_id: int, product_id: int, quantity: int) -> Optional[Hold]:
+    """Reserve stock for a cart line about to hold ``quantity``; 400 if it is not available."""
+    if not stock_reservations.enabled:
+        return None
+    try:
+        hold = await stock_reservations.hold(user_id, product_id, quantity)
+    except Exception as e:
+        # Checkout re-checks stock under row locks, so a Redis outage only loses the early warning
+        logger.warning(f"Stock hold failed for user {user_id}, product {product_id}: {e}")
+        return None
+    if hold is not None and not hold.granted:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Only {hold.available} items available in stock"
+        )
+    return hold
+
+
+async def _undo_hold(user_id: int, product_id: int, hold: Optional[Hold]):
+    if hold is not None:
+        await _release_stock(user_id, product_id, hold.previous)
+
+
+async def _release_stock(user_id: int, product_id: Optional[int] = None, keep: int = 0):
+    """Drop (or shrink to ``keep``) the user's hold on a product, or on everything when no product is given."""
+    if not stock_reservations.enabled:
+        return
+    try:
+        if product_id is None:
+            await stock_reservations.release_all(user_id)
+        elif keep:
+            await stock_reservations.hold(user_id, product_id, keep)
+        else:
+            await stock_reservations.release(user_id, product_id)
+    except Exception as e:
+        # Unreleased holds expire after the hold TTL
+        logger.warning(f"Stock release failed for user {user_id}: {e}")
+
+
 @cart_router.post("/items", response_model=CartItem)
 @limiter.limit("30/minute")
 async def add_to_cart(
@@ -206,88 +378,44 @@ async def add_to_cart(
     user=Depends(get_current_user),
     db=Depends(get_db)
 ):
-    # Check if product exists and is active
-    product = await db.fetchrow(
-        "SELECT id, name, price, slug, stock_quantity FROM products WHERE id = $1 AND is_active = true",
-        item_data.product_id
-    )
+    hold = None
+    if stock_reservations.enabled:
+        current = await _line_quantity(db, user['id'], item_data.product_id)
+        hold = await _hold_stock(user['id'], item_data.product_id, current + item_data.quantity)
+    try:
+        if cart_store.enabled:
+            return await _store_add_item(user['id'], item_data, db)
+        return await _postgres_add_item(user['id'], item_data, db)
+    except HTTPException:
+        await _undo_hold(user['id'], item_data.product_id, hold)
+        raise
+
+
+async def _postgres_add_item(user_id: int, item_data: CartItemCreate, db) -> CartItem:
+    # Stock check, upsert and the joined item row in one statement. Concurrent
+    # adds for the same line serialize on its row lock and re-check the limit
+    # against the latest quantity, so the cart can never exceed stock.
+    row = await db.fetchrow(ADD_ITEM_QUERY, user_id, item_data.product_id, item_data.quantity, MAX_ITEM_QUANTITY)
     
-    if not product:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
         )
     
-    # Check stock availability
-    if product['stock_quantity'] < item_data.quantity:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Only {product['stock_quantity']} items available in stock"
-        )
-    
-    # Check if item already exists in cart
-    existing_item = await db.fetchrow(
-        "SELECT id, quantity FROM cart_items WHERE user_id = $1 AND product_id = $2",
-        user['id'],
-        item_data.product_id
-    )
-    
-    if existing_item:
-        # Update existing item quantity
-        new_quantity = existing_item['quantity'] + item_data.quantity
-        
-        if new_quantity > product['stock_quantity']:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Cannot add {item_data.quantity} more items. Only {product['stock_quantity']} available in stock"
-            )
-        
-        if new_quantity > 99:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Cannot add more than 99 items to cart"
-            )
-        
-        await db.execute(
-            "UPDATE cart_items SET quantity = $1, updated_at = $2 WHERE id = $3",
-            new_quantity,
-            datetime.utcnow(),
-            existing_item['id']
-        )
-        
-        cart_item_id = existing_item['id']
-    else:
-        # Create new cart item
-        cart_item = await db.fetchrow("""
-            INSERT INTO cart_items (user_id, product_id, quantity, created_at, updated_at)
-            VALUES ($1, $2, $3, $4, $5)
-            RETURNING id
-        """,
-            user['id'],
-            item_data.product_id,
-            item_data.quantity,
-            datetime.utcnow(),
-            datetime.utcnow()
-        )
-        
-        cart_item_id = cart_item['id']
-    
-    # Fetch the complete cart item data
-    query = """
-        SELECT 
-            ci.id, ci.user_id, ci.product_id, ci.quantity, ci.created_at, ci.updated_at,
-            p.name as product_name, p.price as product_price, p.slug as product_slug,
-            p.stock_quantity, pi.url as product_image,
-            (ci.quantity * p.price) as subtotal
-        FROM cart_items ci
-        JOIN products p ON ci.product_id = p.id
-        LEFT JOIN product_images pi ON p.id = pi.product_id AND pi.is_primary = true
-        WHERE ci.id = $1
-    """
-    
-    cart_item_data = await db.fetchrow(query, cart_item_id)
+    if row['id'] is None:
+        available = row['available']
+        if available < item_data.quantity:
+            detail = f"Only {available} items available in stock"
+        elif (row['current_quantity'] or 0) + item_data.quantity > available:
+            detail = f"Cannot add {item_data.quantity} more items. Only {available} available in stock"
+        else:
+            detail = f"Cannot add more than {MAX_ITEM_QUANTITY} items to cart"
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
     
-    return CartItem(**dict(cart_item_data))
+    # The upsert added exactly the requested quantity
+    await record_cart_change(user_id, int(row['inserted']), item_data.quantity * row['product_price'])
+    return CartItem(**dict(row))
 
 @cart_router.put("/items/{item_id}", response_model=CartItem)
 async def update_cart_item(
@@ -296,61 +424,52 @@ async def update_cart_item(
     user=Depends(get_current_user),
     db=Depends(get_db)
 ):
-    # Check if cart item exists and belongs to user
-    cart_item = await db.fetchrow(
-        "SELECT id, product_id FROM cart_items WHERE id = $1 AND user_id = $2",
-        item_id,
-        user['id']
-    )
+    hold, product_id = None, None
+    if cart_store.enabled:
+        product_id = await cart_store.product_for_item(user['id'], item_id)
+        if product_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Cart item not found"
+            )
+    elif stock_reservations.enabled:
+        product_id = await db.fetchval(
+            "SELECT product_id FROM cart_items WHERE id = $1 AND user_id = $2", item_id, user['id']
+        )
+    if stock_reservations.enabled and product_id is not None:
+        hold = await _hold_stock(user['id'], product_id, update_data.quantity)
+    try:
+        if cart_store.enabled:
+            return await _store_update_item(user['id'], product_id, item_id, update_data, db)
+        return await _postgres_update_item(user['id'], item_id, update_data, db)
+    except HTTPException:
+        await _undo_hold(user['id'], product_id, hold)
+        raise
+
+
+async def _postgres_update_item(user_id: int, item_id: int, update_data: CartItemUpdate, db) -> CartItem:
+    row = await db.fetchrow(UPDATE_ITEM_QUERY, item_id, user_id, update_data.quantity)
     
-    if not cart_item:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Cart item not found"
         )
     
-    # Check product stock
-    product = await db.fetchrow(
-        "SELECT stock_quantity FROM products WHERE id = $1 AND is_active = true",
-        cart_item['product_id']
-    )
-    
-    if not product:
+    if row['available'] is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
         )
     
-    if product['stock_quantity'] < update_data.quantity:
+    if row['id'] is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Only {product['stock_quantity']} items available in stock"
+            detail=f"Only {row['available']} items available in stock"
         )
     
-    # Update cart item
-    await db.execute(
-        "UPDATE cart_items SET quantity = $1, updated_at = $2 WHERE id = $3",
-        update_data.quantity,
-        datetime.utcnow(),
-        item_id
-    )
-    
-    # Fetch updated cart item data
-    query = """
-        SELECT 
-            ci.id, ci.user_id, ci.product_id, ci.quantity, ci.created_at, ci.updated_at,
-            p.name as product_name, p.price as product_price, p.slug as product_slug,
-            p.stock_quantity, pi.url as product_image,
-            (ci.quantity * p.price) as subtotal
-        FROM cart_items ci
-        JOIN products p ON ci.product_id = p.id
-        LEFT JOIN product_images pi ON p.id = pi.product_id AND pi.is_primary = true
-        WHERE ci.id = $1
-    """
-    
-    cart_item_data = await db.fetchrow(query, item_id)
-    
-    return CartItem(**dict(cart_item_data))
+    await record_cart_change(user_id, 0, (row['quantity'] - row['previous_quantity']) * row['product_price'])
+    return CartItem(**dict(row))
 
 @cart_router.delete("/items/{item_id}")
 async def remove_cart_item(
@@ -358,76 +477,233 @@ async def remove_cart_item(
     user=Depends(get_current_user),
     db=Depends(get_db)
 ):
-    # Check if cart item exists and belongs to user
-    result = await db.execute(
-        "DELETE FROM cart_items WHERE id = $1 AND user_id = $2",
-        item_id,
-        user['id']
-    )
+    if cart_store.enabled:
+        product_id = await cart_store.product_for_item(user['id'], item_id)
+        quantity = await cart_store.remove(user['id'], product_id, item_id) if product_id is not None else 0
+        product = (await _fetch_cart_products(db, [product_id])).get(product_id) if quantity else None
+        price, counted = (product['price'], True) if product else (None, False)
+    else:
+        # Check if cart item exists and belongs to user
+        row = await db.fetchrow(
+            """
+            DELETE FROM cart_items ci USING products p
+            WHERE ci.id = $1 AND ci.user_id = $2 AND p.id = ci.product_id
+            RETURNING ci.product_id, ci.quantity, p.price, p.is_active
+            """,
+            item_id,
+            user['id']
+        )
+        product_id = row['product_id'] if row else None
+        quantity = row['quantity'] if row else 0
+        price, counted = (row['price'], row['is_active']) if row else (None, False)
     
-    if result == "DELETE 0":
+    if not quantity:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Cart item not found"
         )
     
+    await _release_stock(user['id'], product_id)
+    # Lines of inactive products are not in the badge counts
+    if counted:
+        await record_cart_change(user['id'], -1, -quantity * price)
+    else:
+        await record_cart_change(user['id'])
     return {"message": "Item removed from cart"}
 
 @cart_router.delete("/")
 async def clear_cart(user=Depends(get_current_user), db=Depends(get_db)):
-    await db.execute(
-        "DELETE FROM cart_items WHERE user_id = $1",
-        user['id']
-    )
+    if cart_store.enabled:
+        await cart_store.replace(user['id'], {})
+    else:
+        await db.execute(
+            "DELETE FROM cart_items WHERE user_id = $1",
+            user['id']
+        )
     
+    await _release_stock(user['id'])
+    await record_cart_change(user['id'], op="reset")
     return {"message": "Cart cleared"}
 
+def _quote_candidate(candidate: CartQuoteCandidate, products: Dict[int, Any],
+                     rules: Dict[str, Optional[DiscountRule]], now: datetime) -> CartQuote:
+    quantities: Dict[int, int] = {}
+    for item in candidate.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    lines = []
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is not None:
+            lines.append({
+                "product_id": product_id,
+                "category_id": product['category_id'],
+                "quantity": quantity,
+                "product_price": product['price'],
+                "subtotal": quantity * product['price'],
+                "in_stock": quantity <= product['stock_quantity'],
+            })
+
+    code = (candidate.promo_code or '').strip() or None
+    pricing = price_cart(lines, code, rules.get(code.lower()) if code else None, now=now)
+    return CartQuote(
+        items=[CartQuoteLine(**line) for line in lines],
+        unavailable_product_ids=[product_id for product_id in quantities if product_id not in products],
+        total_items=len(lines),
+        subtotal=pricing.subtotal,
+        discount_total=pricing.discount_total,
+        applied_promo_code=pricing.applied_code,
+        discounts=[CartDiscount(**d) for d in pricing.discounts],
+        estimated_tax=pricing.estimated_tax,
+        estimated_shipping=pricing.estimated_shipping,
+        estimated_total=pricing.estimated_total
+    )
+
+
+@cart_router.post("/quote", response_model=CartQuoteResponse)
+@limiter.limit("60/minute")
+async def quote_carts(quote: CartQuoteRequest, request: Request, db=Depends(get_db)):
+    """Price hypothetical carts without touching any stored cart (e.g. "add X and save Y" previews).
+
+    Products for every candidate are loaded in one query and the promo code
+    (at most one per request) is resolved once; pricing then runs in memory
+    per candidate. Quotes are anonymous, so per-customer code limits are not
+    applied, and requests with a code are limited separately so the endpoint
+    cannot be used to guess codes.
+    """
+    if any((candidate.promo_code or '').strip() for candidate in quote.candidates):
+        retry_after = await limiter.hit("promo_code_quotes", client_ip(request), PROMO_QUOTE_RATE)
+        if retry_after is not None:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Rate limit exceeded for promo code quotes: {PROMO_QUOTE_RATE}",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    product_ids = {item.product_id for candidate in quote.candidates for item in candidate.items}
+    products = await _fetch_cart_products(db, product_ids)
+
+    rules: Dict[str, Optional[DiscountRule]] = {}
+    for candidate in quote.candidates:
+        code = (candidate.promo_code or '').strip()
+        if code and code.lower() not in rules:
+            rules[code.lower()] = await discount_rules.get(db, code)
+
+    now = datetime.now(timezone.utc)
+    return CartQuoteResponse(quotes=[_quote_candidate(candidate, products, rules, now) for candidate in quote.candidates])
+
+
+def _sync_result(product_id: int, requested: int, in_cart: int, final: Optional[int]) -> Dict[str, Any]:
+    """Describe what a sync did with one requested line."""
+    result = {"product_id": product_id, "requested": requested, "quantity": final or 0, "status": "added"}
+    if final is None:
+        result.update(status="skipped", reason="product_unavailable")
+    elif final == 0:
+        result.update(status="skipped", reason="out_of_stock")
+    elif final <= in_cart:
+        result.update(status="unchanged", reason="at_limit")
+    elif final < in_cart + requested:
+        result.update(status="adjusted", reason="quantity_limited")
+    return result
+
+
 @cart_router.post("/sync")
 @limiter.limit("10/minute")
 async def sync_cart(
     cart_items: List[CartItemCreate],
+    mode: str = Query("replace", pattern="^(replace|merge)$"),
     user=Depends(get_current_user),
     db=Depends(get_db)
 ):
-    """Sync local cart with server cart (for guest to authenticated user transition)"""
-    
-    # Clear existing cart
-    await db.execute("DELETE FROM cart_items WHERE user_id = $1", user['id'])
-    
-    added_items = []
-    
+    """Sync local cart with server cart (for guest to authenticated user transition).
+
+    ``replace`` makes the server cart exactly the synced items; ``merge`` adds
+    them to what is already there. Quantities are capped by stock and the
+    per-line maximum, and every requested item is reported back.
+    """
+    requested: Dict[int, int] = {}
     for item_data in cart_items:
-        try:
-            # Check if product exists and is active
-            product = await db.fetchrow(
-                "SELECT id, stock_quantity FROM products WHERE id = $1 AND is_active = true",
-                item_data.product_id
+        requested[item_data.product_id] = requested.get(item_data.product_id, 0) + item_data.quantity
+
+    if cart_store.enabled:
+        stock = {
+            product_id: product['stock_quantity']
+            for product_id, product in (await _fetch_cart_products(db, requested)).items()
+        }
+        limits = {product_id: min(stock[product_id], MAX_ITEM_QUANTITY) for product_id in requested if product_id in stock}
+        if mode == "merge":
+            merged = await cart_store.merge(
+                user['id'], {product_id: (requested[product_id], limit) for product_id, limit in limits.items()}
             )
-            
-            if not product:
-                continue  # Skip invalid products
-            
-            # Adjust quantity if stock is insufficient
-            quantity = min(item_data.quantity, product['stock_quantity'])
-            if quantity <= 0:
-                continue
-            
-            # Add item to cart
-            cart_item = await db.fetchrow("""
-                INSERT INTO cart_items (user_id, product_id, quantity, created_at, updated_at)
-                VALUES ($1, $2, $3, $4, $5)
-                RETURNING id
-            """,
-                user['id'],
-                item_data.product_id,
-                quantity,
-                datetime.utcnow(),
-                datetime.utcnow()
-            )
-            
-            added_items.append(cart_item['id'])
-            
-        except Exception:
-            continue  # Skip items that cause errors
-    
-    return {"message": f"Cart synced. {len(added_items)} items added."}
+            in_cart = {product_id: previous for product_id, (previous, _) in merged.items()}
+            final = {product_id: quantity for product_id, (_, quantity) in merged.items()}
+        else:
+            in_cart = {}
+            final = {product_id: min(requested[product_id], limit) for product_id, limit in limits.items()}
+            await cart_store.replace(user['id'], {product_id: quantity for product_id, quantity in final.items() if quantity > 0})
+    else:
+        async with db.transaction():
+            # One lookup validates every product and its stock
+            stock = {
+                row['id']: row['stock_quantity']
+                for row in await db.fetch(
+                    "SELECT id, stock_quantity FROM products WHERE id = ANY($1::int[]) AND is_active = true",
+                    list(requested)
+                )
+            }
+
+            in_cart = {}
+            if mode == "merge":
+                in_cart = {
+                    row['product_id']: row['quantity']
+                    for row in await db.fetch(
+                        """
+                        SELECT product_id, quantity FROM cart_items
+                        WHERE user_id = $1 AND variant_id IS NULL AND product_id = ANY($2::int[])
+                        FOR UPDATE
+                        """,
+                        user['id'], list(stock)
+                    )
+                }
+            else:
+                await db.execute("DELETE FROM cart_items WHERE user_id = $1", user['id'])
+
+            final = {}
+            for product_id, available in stock.items():
+                current = in_cart.get(product_id, 0)
+                final[product_id] = max(current, min(current + requested[product_id], available, MAX_ITEM_QUANTITY))
+
+            writes = {product_id: quantity for product_id, quantity in final.items() if quantity > in_cart.get(product_id, 0)}
+            if writes:
+                await db.execute(
+                    """
+                    INSERT INTO cart_items (user_id, product_id, quantity)
+                    SELECT $1, v.product_id, v.quantity
+                    FROM unnest($2::int[], $3::int[]) AS v(product_id, quantity)
+                    ON CONFLICT (user_id, product_id, variant_id) DO UPDATE
+                        SET quantity = EXCLUDED.quantity, updated_at = CURRENT_TIMESTAMP
+                    """,
+                    user['id'], list(writes), list(writes.values())
+                )
+
+    items = [
+        _sync_result(product_id, quantity, in_cart.get(product_id, 0), final.get(product_id))
+        for product_id, quantity in requested.items()
+    ]
+    synced = sum(1 for item in items if item["status"] in ("added", "adjusted"))
+    if stock_reservations.enabled:
+        if mode == "replace":
+            await _release_stock(user['id'])
+        # Best effort: lines were already capped at stock, so a denied hold only means contention
+        for product_id, quantity in final.items():
+            if quantity > 0:
+                try:
+                    await stock_reservations.hold(user['id'], product_id, quantity)
+                except Exception as e:
+                    logger.warning(f"Stock hold failed for user {user['id']}, product {product_id}: {e}")
+    await record_cart_change(user['id'], op="drop")
+    return {
+        "message": f"Cart synced. {synced} items added.",
+        "mode": mode,
+        "items": items,
+    }
@@ -64,3 +64,50 @@ class Cart(BaseModel):
 class CartSummary(BaseModel):
     item_count: int
     subtotal: Decimal
+
+class CartQuoteCandidate(BaseModel):
+    items: List[CartItemBase]
+    promo_code: Optional[str] = None
+
+    @validator('items')
+    def validate_items(cls, v):
+        if len(v) > 50:
+            raise ValueError('A candidate cart cannot have more than 50 lines')
+        return v
+
+class CartQuoteRequest(BaseModel):
+    candidates: List[CartQuoteCandidate]
+
+    @validator('candidates')
+    def validate_candidates(cls, v):
+        if not v:
+            raise ValueError('At least one candidate cart is required')
+        if len(v) > 25:
+            raise ValueError('Cannot quote more than 25 carts at once')
+        codes = {(c.promo_code or '').strip().lower() for c in v} - {''}
+        if len(codes) > 1:
+            raise ValueError('All candidate carts must use the same promo code')
+        return v
+
+class CartQuoteLine(BaseModel):
+    product_id: int
+    quantity: int
+    product_price: Decimal
+    subtotal: Decimal
+    in_stock: bool
+
+class CartQuote(BaseModel):
+    items: List[CartQuoteLine]
+    # Requested products that are unknown or inactive; they are not priced
+    unavailable_product_ids: List[int] = []
+    total_items: int
+    subtotal: Decimal
+    discount_total: Decimal = Decimal('0.00')
+    applied_promo_code: Optional[str] = None
+    discounts: List[CartDiscount] = []
+    estimated_tax: Decimal
+    estimated_shipping: Decimal
+    estimated_total: Decimal
+
+class CartQuoteResponse(BaseModel):
+    quotes: List[CartQuote]
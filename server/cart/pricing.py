@@ -0,0 +1,349 @@
+"""Cart pricing engine: totals, VAT, shipping and discounts with no I/O.
+
+``price_cart`` works only from cart lines that are already loaded and a
+compiled ``DiscountRule``. Rules come from ``DiscountRuleCache``, an
+in-process index of every ``discount_codes`` row that is loaded at startup
+and kept current by a ``discount_code_changed`` trigger, so a cart view or
+promo check costs no discount queries at all. The arithmetic matches the
+SQL-backed code it replaced, Decimal for Decimal.
+"""
+import logging
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional
+
+from cache.bloom import BloomFilter
+from cache.ttl_lru import TTLCache
+from database.notify import listen
+
+logger = logging.getLogger(__name__)
+
+VAT_RATE = Decimal('0.15')  # South African VAT
+FREE_SHIPPING_THRESHOLD = Decimal('500.00')
+STANDARD_SHIPPING = Decimal('75.00')
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+DISCOUNT_CODE_CHANGED_CHANNEL = "discount_code_changed"
+
+_DISCOUNT_CODE_COLUMNS = """
+    SELECT id, code, name, type, value, minimum_order_amount, maximum_discount_amount,
+           usage_limit, usage_limit_per_customer, used_count, applies_to,
+           applicable_product_ids, applicable_category_ids,
+           starts_at, ends_at, is_active
+    FROM discount_codes
+"""
+DISCOUNT_CODE_QUERY = _DISCOUNT_CODE_COLUMNS + "    WHERE LOWER(code) = LOWER($1)\n"
+_DISCOUNT_CODE_BY_ID_QUERY = _DISCOUNT_CODE_COLUMNS + "    WHERE id = $1\n"
+
+
+def estimated_tax(subtotal: Decimal) -> Decimal:
+    return subtotal * VAT_RATE
+
+
+def estimated_shipping(subtotal: Decimal) -> Decimal:
+    if subtotal >= FREE_SHIPPING_THRESHOLD:
+        return ZERO
+    return STANDARD_SHIPPING
+
+
+def _aware(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class DiscountRule:
+    """A ``discount_codes`` row compiled for repeated evaluation."""
+
+    __slots__ = (
+        "id", "code", "name", "type", "value", "minimum_order_amount", "maximum_discount_amount",
+        "usage_limit", "usage_limit_per_customer", "used_count", "starts_at", "ends_at", "is_active",
+        "applies_to", "product_ids", "category_ids", "_line_filter",
+    )
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.code = row["code"]
+        self.name = row["name"] or "Promotion"
+        self.type = (row["type"] or '').lower()
+        self.value = Decimal(row["value"])
+        self.minimum_order_amount = row["minimum_order_amount"]
+        self.maximum_discount_amount = row["maximum_discount_amount"]
+        self.usage_limit = row["usage_limit"]
+        self.usage_limit_per_customer = row["usage_limit_per_customer"]
+        self.used_count = row["used_count"] or 0
+        self.starts_at = _aware(row["starts_at"])
+        self.ends_at = _aware(row["ends_at"])
+        self.is_active = bool(row["is_active"])
+        self.applies_to = (row["applies_to"] or 'all').lower()
+        self.product_ids: FrozenSet[int] = frozenset(row["applicable_product_ids"] or ())
+        self.category_ids: FrozenSet[int] = frozenset(row["applicable_category_ids"] or ())
+        self._line_filter = self._compile_filter()
+
+    def _compile_filter(self) -> Optional[Callable[[Dict[str, Any]], bool]]:
+        if self.applies_to == 'specific_products' and self.product_ids:
+            products = self.product_ids
+            return lambda line: line['product_id'] in products
+        if self.applies_to == 'specific_categories' and self.category_ids:
+            categories = self.category_ids
+            return lambda line: line.get('category_id') in categories
+        return None
+
+    @property
+    def limits_per_customer(self) -> bool:
+        return self.usage_limit_per_customer is not None and self.usage_limit_per_customer > 0
+
+    def is_available(self, now: datetime, customer_uses: int = 0) -> bool:
+        """Active, inside its time window and under its usage limits."""
+        if not self.is_active:
+            return False
+        if self.starts_at and now < self.starts_at:
+            return False
+        if self.ends_at and now > self.ends_at:
+            return False
+        if self.usage_limit is not None and self.used_count >= self.usage_limit:
+            return False
+        if self.limits_per_customer and customer_uses >= self.usage_limit_per_customer:
+            return False
+        return True
+
+    def next_boundary(self, now: datetime) -> Optional[datetime]:
+        """The first ``starts_at``/``ends_at`` after ``now``: when ``is_available`` can next change."""
+        for boundary in (self.starts_at, self.ends_at):
+            if boundary is not None and boundary > now:
+                return boundary
+        return None
+
+    def eligible_subtotal(self, lines: Iterable[Dict[str, Any]], subtotal: Decimal) -> Decimal:
+        if self._line_filter is None:
+            return subtotal
+        return sum((line['subtotal'] for line in lines if self._line_filter(line)), ZERO)
+
+    def amount(self, eligible_subtotal: Decimal, shipping: Decimal) -> Decimal:
+        if self.type == 'percentage':
+            amount = (eligible_subtotal * (self.value / Decimal('100'))).quantize(CENT)
+        elif self.type == 'fixed_amount':
+            amount = min(self.value, eligible_subtotal)
+        elif self.type == 'free_shipping':
+            amount = (Decimal(shipping) if shipping else ZERO).quantize(CENT)
+        else:
+            amount = ZERO
+        if self.maximum_discount_amount is not None:
+            amount = min(amount, Decimal(self.maximum_discount_amount))
+        return amount
+
+
+class CartPricing(NamedTuple):
+    subtotal: Decimal
+    discount_total: Decimal
+    discounts: List[Dict[str, Any]]
+    applied_code: Optional[str]
+    estimated_tax: Decimal
+    estimated_shipping: Decimal
+    estimated_total: Decimal
+    # When the price may change with nothing edited: the code's next start or end
+    expires_at: Optional[datetime] = None
+
+
+def apply_discount(lines: List[Dict[str, Any]], subtotal: Decimal, shipping: Decimal, code: Optional[str],
+                   rule: Optional[DiscountRule], customer_uses: int = 0,
+                   now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Discount for ``code`` on a cart, in the shape the cart API returns."""
+    none_applied = {"discount_total": ZERO, "discounts": [], "applied_code": None}
+    if not code or rule is None:
+        return none_applied
+    if not rule.is_available(now or datetime.now(timezone.utc), customer_uses):
+        return none_applied
+
+    # Below the minimum the code stays applied but is worth nothing yet
+    if rule.minimum_order_amount is not None and subtotal < rule.minimum_order_amount:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": code}
+
+    amount = rule.amount(rule.eligible_subtotal(lines, subtotal), shipping)
+    if amount <= 0:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": code}
+
+    return {
+        "discount_total": amount,
+        "discounts": [{"source": "promotion", "code": rule.code, "description": rule.name, "amount": amount}],
+        "applied_code": rule.code,
+    }
+
+
+def price_cart(lines: List[Dict[str, Any]], code: Optional[str] = None, rule: Optional[DiscountRule] = None,
+               customer_uses: int = 0, now: Optional[datetime] = None) -> CartPricing:
+    """Price loaded cart lines (dicts with ``subtotal``, ``product_id``, ``category_id``)."""
+    now = now or datetime.now(timezone.utc)
+    subtotal = sum((line['subtotal'] for line in lines), ZERO)
+    tax = estimated_tax(subtotal)
+    shipping = estimated_shipping(subtotal)
+    discount = apply_discount(lines, subtotal, shipping, code, rule, customer_uses, now)
+
+    total = subtotal + tax + shipping - discount["discount_total"]
+    if total < 0:
+        total = ZERO
+
+    return CartPricing(
+        subtotal=subtotal,
+        discount_total=discount["discount_total"],
+        discounts=discount["discounts"],
+        applied_code=discount["applied_code"],
+        estimated_tax=tax,
+        estimated_shipping=shipping,
+        estimated_total=total,
+        expires_at=rule.next_boundary(now) if code and rule is not None else None,
+    )
+
+
+_MISSING = object()
+
+
+class DiscountRuleCache:
+    """Compiled discount rules keyed by case-folded code, plus per-customer usage counts.
+
+    Once ``load`` has run (``listen_for_changes`` does it on every connect),
+    every code lives in the index and lookups never query the database;
+    the trigger on ``discount_codes`` reloads single rows as they change,
+    including ``used_count``. Before that, rules are fetched on demand and
+    cached for ``ttl`` seconds, behind a Bloom filter of every code (rebuilt
+    every ``ttl`` seconds) so guessed codes are turned away without a query.
+    Customer usage counts always lag by up to ``ttl``; checkout must
+    re-check limits against the database.
+
+    ``generation`` changes whenever the index or the cached rules do, so
+    caches derived from ``discount_codes`` can tell they are out of date.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 1000):
+        self.pool = None
+        self.index: Optional[Dict[str, DiscountRule]] = None
+        self._codes_by_id: Dict[int, str] = {}
+        self.rules = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.customer_uses = TTLCache(max_entries=max_entries * 20, ttl=ttl)
+        self.code_filter: Optional[BloomFilter] = None
+        self._filter_expires_at = 0.0
+        self.generation = 0
+        self._counts = {
+            "loads": 0, "changes": 0, "unknown_codes": 0,
+            "filter_builds": 0, "filter_rejects": 0, "filter_false_positives": 0,
+        }
+
+    def bind(self, pool):
+        self.pool = pool
+
+    async def get(self, db, code: str) -> Optional[DiscountRule]:
+        key = code.lower()
+        if self.index is not None:
+            rule = self.index.get(key)
+            if rule is None:
+                self._counts["unknown_codes"] += 1
+            return rule
+        rule = self.rules.get(key)
+        if rule is None:
+            if key not in await self._code_filter(db):
+                # Not cached either, so a stream of guesses cannot evict real codes
+                self._counts["unknown_codes"] += 1
+                self._counts["filter_rejects"] += 1
+                return None
+            row = await db.fetchrow(DISCOUNT_CODE_QUERY, code)
+            if row is None:
+                self._counts["unknown_codes"] += 1
+                self._counts["filter_false_positives"] += 1
+            rule = DiscountRule(row) if row else _MISSING
+            self.rules.set(key, rule)
+        return None if rule is _MISSING else rule
+
+    async def _code_filter(self, db) -> BloomFilter:
+        if self.code_filter is None or time.time() >= self._filter_expires_at:
+            codes = [row["code"].lower() for row in await db.fetch("SELECT code FROM discount_codes")]
+            self.code_filter = BloomFilter.build(codes)
+            self._filter_expires_at = time.time() + self.rules.ttl
+            self._counts["filter_builds"] += 1
+        return self.code_filter
+
+    async def uses_by_customer(self, db, rule: DiscountRule, user_id: int) -> int:
+        if not rule.limits_per_customer:
+            return 0
+        key = (rule.id, user_id)
+        uses = self.customer_uses.get(key)
+        if uses is None:
+            uses = await db.fetchval(
+                "SELECT COUNT(*) FROM discount_code_uses WHERE discount_code_id = $1 AND user_id = $2",
+                rule.id, user_id
+            ) or 0
+            self.customer_uses.set(key, uses)
+        return uses
+
+    async def load(self, db):
+        """Replace the index with every row of ``discount_codes``."""
+        index: Dict[str, DiscountRule] = {}
+        codes_by_id: Dict[int, str] = {}
+        for row in await db.fetch(_DISCOUNT_CODE_COLUMNS):
+            rule = DiscountRule(row)
+            index[rule.code.lower()] = rule
+            codes_by_id[rule.id] = rule.code.lower()
+        self.index, self._codes_by_id = index, codes_by_id
+        self.rules.clear()
+        self.code_filter = None
+        self.generation += 1
+        self._counts["loads"] += 1
+        logger.info(f"Discount code index loaded ({len(index)} codes)")
+
+    async def reload(self, db, discount_id: int):
+        """Re-read one code after an insert, update or delete."""
+        if self.index is None:
+            return
+        row = await db.fetchrow(_DISCOUNT_CODE_BY_ID_QUERY, discount_id)
+        # Drop the old entry first in case the code itself was renamed
+        previous = self._codes_by_id.pop(discount_id, None)
+        if previous is not None and getattr(self.index.get(previous), "id", None) == discount_id:
+            del self.index[previous]
+        if row:
+            rule = DiscountRule(row)
+            self.index[rule.code.lower()] = rule
+            self._codes_by_id[rule.id] = rule.code.lower()
+        self.code_filter = None
+        self.generation += 1
+        self._counts["changes"] += 1
+
+    async def _on_change(self, connection, payload: str):
+        try:
+            discount_id = int(payload)
+        except ValueError:
+            return
+        await self.reload(connection, discount_id)
+
+    async def listen_for_changes(self):
+        """Load the index and apply ``discount_code_changed`` notifications. Runs until cancelled."""
+        if not self.pool:
+            return
+        try:
+            # Reloaded on every (re)connect, as notifications in between are lost
+            await listen(self.pool, DISCOUNT_CODE_CHANGED_CHANNEL, self._on_change, on_connect=self.load)
+        finally:
+            self.index = None
+            self.generation += 1
+
+    def invalidate(self, code: Optional[str] = None):
+        """Forget one cached code (or every code and usage count) after it changes."""
+        if code is None:
+            self.rules.clear()
+            self.customer_uses.clear()
+        else:
+            self.rules.pop(code.lower())
+        self.code_filter = None
+        self.generation += 1
+
+    def stats(self) -> Dict[str, Any]:
+        fp, rejects = self._counts["filter_false_positives"], self._counts["filter_rejects"]
+        return {
+            "indexed_codes": len(self.index) if self.index is not None else None,
+            "rules": self.rules.stats(),
+            "customer_uses": self.customer_uses.stats(),
+            "code_filter": self.code_filter.stats() if self.code_filter is not None else None,
+            # Share of unknown codes that got past the filter to a query
+            "observed_false_positive_rate": round(fp / (fp + rejects), 6) if fp + rejects else 0.0,
+            **self._counts,
+        }
@@ -0,0 +1,112 @@
+"""Versioned cache of serialized cart responses.
+
+Every cart or promo mutation bumps ``cart:ver:{user_id}`` in Redis, which is
+shared by all workers. ``GET /api/cart`` reads that version (one GET) and,
+if this worker already rendered the cart at that version, returns the
+stored JSON body and its ETag without loading or pricing anything. A
+matching ``If-None-Match`` gets a 304.
+
+Product price and availability changes bump the version of every cart
+holding the product (``cart.summary``). A snapshot also records the
+``DiscountRuleCache.generation`` it was priced at, so an edited discount
+code is picked up on the next request, and it expires at the applied code's
+next ``starts_at``/``ends_at``, so a promotion opening or closing is never
+served stale. Anything else is picked up after at most ``ttl`` seconds.
+"""
+import hashlib
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional
+
+from cache.ttl_lru import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class CartSnapshot(NamedTuple):
+    version: int
+    generation: int
+    etag: str
+    body: bytes
+
+
+def version_key(user_id) -> str:
+    """Redis key of the user's cart version, also bumped by ``cart.summary``."""
+    return f"cart:ver:{user_id}"
+
+
+class CartSnapshotCache:
+    def __init__(self, ttl: float = 60.0, max_entries: int = 20000, version_ttl: int = 30 * 86400):
+        self.version_ttl = version_ttl
+        self.redis = None
+        self.snapshots = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._counts = {"bumps": 0, "not_modified": 0}
+
+    def bind(self, redis_client):
+        self.redis = redis_client
+        self.snapshots.clear()
+
+    async def bump(self, user_id: int):
+        """Invalidate the user's cached cart; call after every cart or promo change."""
+        if not self.redis:
+            return
+        # A missing version restarts from the clock rather than from 1, so a
+        # Redis reset can never make an old snapshot's version current again.
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.set(version_key(user_id), int(time.time() * 1000), nx=True)
+                pipe.incr(version_key(user_id))
+                pipe.expire(version_key(user_id), self.version_ttl)
+                await pipe.execute()
+            self._counts["bumps"] += 1
+        except Exception as e:
+            self.snapshots.pop(user_id)
+            logger.warning(f"Cart version bump failed for user {user_id}: {e}")
+
+    async def version(self, user_id: int) -> Optional[int]:
+        """Current cart version, or None when versions are unavailable (no caching)."""
+        if not self.redis:
+            return None
+        try:
+            version = await self.redis.get(version_key(user_id))
+            if version is None:
+                await self.bump(user_id)
+                version = await self.redis.get(version_key(user_id))
+            return int(version) if version is not None else None
+        except Exception as e:
+            logger.warning(f"Cart version lookup failed for user {user_id}: {e}")
+            return None
+
+    def get(self, user_id: int, version: Optional[int], generation: int) -> Optional[CartSnapshot]:
+        if version is None:
+            return None
+        snapshot = self.snapshots.get(user_id)
+        if snapshot is None or snapshot.version != version or snapshot.generation != generation:
+            return None
+        return snapshot
+
+    def put(self, user_id: int, version: Optional[int], generation: int, body: bytes,
+            expires_at: Optional[datetime] = None) -> CartSnapshot:
+        """Store a cart rendered at ``version`` and discount ``generation``, until ``expires_at`` at the latest."""
+        etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        snapshot = CartSnapshot(version if version is not None else -1, generation, etag, body)
+        if version is not None:
+            ttl_expiry = time.time() + self.snapshots.ttl
+            self.snapshots.set(
+                user_id, snapshot,
+                expires_at=min(ttl_expiry, expires_at.timestamp()) if expires_at is not None else ttl_expiry
+            )
+        return snapshot
+
+    def not_modified(self, if_none_match: Optional[str], snapshot: CartSnapshot) -> bool:
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if snapshot.etag in tags or "*" in tags:
+            self._counts["not_modified"] += 1
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.snapshots.stats(), **self._counts}
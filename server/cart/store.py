@@ -0,0 +1,598 @@
+"""Redis-primary cart store with write-behind persistence to ``cart_items``.
+
+Each user's cart lives in one Redis hash, ``cart:{user_id}``:
+
+    _v          cart version, bumped by every mutation
+    q:{pid}     quantity of product ``pid``
+    i:{pid}     the line's ``cart_items.id``
+    c:{pid}     when the product was first added (epoch seconds)
+    u:{pid}     when its quantity last changed
+
+Line ids come from the ``cart_items`` id sequence when a line is created
+and are written behind with it, so an item id means the same line whether
+``CART_STORE`` is ``redis`` or ``postgres``, and across a switch between
+them. Lines for product variants cannot be represented: a cart holding one
+is not loaded into Redis (``CartUnsupported``), though it can still be
+cleared or replaced, which removes those rows as it does in Postgres mode.
+
+Every mutation is a single Lua call that also adds the user to the
+``cart:dirty`` set. A background loop drains that set in batches and
+rewrites the affected users' rows in ``cart_items`` in one transaction, so
+Postgres stays at most one flush interval behind for durability and
+analytics.
+
+Reconciliation on Redis loss: a missing hash is never treated as an empty
+cart. It is rebuilt from ``cart_items`` on first access, which covers key
+expiry, eviction and a Redis restart. The loop also watches the
+``cart:epoch`` sentinel; when it disappears, Redis lost its dataset and any
+writes still in the dirty set are gone (at most one flush interval). Run
+Redis with AOF persistence to close that window.
+
+Checkout holds ``cart:checkout:{user_id}`` for the whole order, so two
+checkouts of one cart cannot both read it, and afterwards removes only what
+was ordered: the cart is emptied if it is still at the version checkout
+loaded, otherwise the ordered quantities are subtracted so lines added
+meanwhile stay.
+"""
+import asyncio
+import logging
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DIRTY_SET = "cart:dirty"
+EPOCH_KEY = "cart:epoch"
+
+# KEYS[1] cart hash
+# ARGV: initial version, key_ttl, then product_id, quantity, created_at, updated_at, item id per line
+_HYDRATE = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], '_v', ARGV[1])
+for i = 3, #ARGV, 5 do
+    redis.call('HSET', KEYS[1], 'q:' .. ARGV[i], ARGV[i + 1], 'c:' .. ARGV[i], ARGV[i + 2], 'u:' .. ARGV[i], ARGV[i + 3],
+               'i:' .. ARGV[i], ARGV[i + 4])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# KEYS[1] cart hash, KEYS[2] dirty set
+# ARGV: user_id, product_id, quantity, mode ('add' | 'set'), limit, now, key_ttl, item id
+# The item id is the line to change for 'set', and the id a new line gets for 'add'
+# Returns {status, quantity, version, created_at, previous, item id}; status 0 ok,
+# 1 not loaded, 2 item not in cart, 3 over limit (quantity is then the current
+# one), 4 the line is new and needs an item id
+_MUTATE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {1}
+end
+local pid = ARGV[2]
+local current = tonumber(redis.call('HGET', KEYS[1], 'q:' .. pid) or '0')
+local id = redis.call('HGET', KEYS[1], 'i:' .. pid)
+local quantity = tonumber(ARGV[3])
+if ARGV[4] == 'add' then
+    if current == 0 or not id then
+        if ARGV[8] == '' then
+            return {4}
+        end
+        id = ARGV[8]
+    end
+    quantity = current + quantity
+elseif current == 0 or id ~= ARGV[8] then
+    return {2}
+end
+if quantity > tonumber(ARGV[5]) then
+    return {3, current}
+end
+local created = redis.call('HGET', KEYS[1], 'c:' .. pid) or ARGV[6]
+redis.call('HSET', KEYS[1], 'q:' .. pid, quantity, 'c:' .. pid, created, 'u:' .. pid, ARGV[6], 'i:' .. pid, id)
+local version = redis.call('HINCRBY', KEYS[1], '_v', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[7])
+redis.call('SADD', KEYS[2], ARGV[1])
+return {0, quantity, version, created, current, id}
+"""
+
+# KEYS[1] cart hash, KEYS[2] dirty set; ARGV: user_id, product_id, key_ttl, item id
+# Returns -1 not loaded, 0 not in cart, otherwise the removed quantity
+_REMOVE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local pid = ARGV[2]
+local quantity = tonumber(redis.call('HGET', KEYS[1], 'q:' .. pid) or '0')
+if quantity == 0 or redis.call('HGET', KEYS[1], 'i:' .. pid) ~= ARGV[4] then
+    return 0
+end
+redis.call('HDEL', KEYS[1], 'q:' .. pid, 'c:' .. pid, 'u:' .. pid, 'i:' .. pid)
+redis.call('HINCRBY', KEYS[1], '_v', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[1])
+return quantity
+"""
+
+# Replace the whole cart (clear, sync). Needs no hydration: the result does
+# not depend on what was there before.
+# KEYS[1] cart hash, KEYS[2] dirty set
+# ARGV: user_id, initial version, now, key_ttl, then product_id, quantity, item id per line
+_REPLACE = """
+local version = tonumber(redis.call('HGET', KEYS[1], '_v') or ARGV[2]) + 1
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '_v', version)
+for i = 5, #ARGV, 3 do
+    redis.call('HSET', KEYS[1], 'q:' .. ARGV[i], ARGV[i + 1], 'c:' .. ARGV[i], ARGV[3], 'u:' .. ARGV[i], ARGV[3],
+               'i:' .. ARGV[i], ARGV[i + 2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('SADD', KEYS[2], ARGV[1])
+return version
+"""
+
+# Merge lines into the cart, capping each at its limit; existing lines never shrink.
+# KEYS[1] cart hash, KEYS[2] dirty set
+# ARGV: user_id, now, key_ttl, then product_id, quantity, limit, item id for a new line per line
+# Returns {status, previous, final, previous, final, ...}; status 1 means not loaded
+_MERGE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {1}
+end
+local result = {0}
+local changed = false
+for i = 4, #ARGV, 4 do
+    local pid = ARGV[i]
+    local current = tonumber(redis.call('HGET', KEYS[1], 'q:' .. pid) or '0')
+    local quantity = math.min(current + tonumber(ARGV[i + 1]), tonumber(ARGV[i + 2]))
+    if quantity > current then
+        if current == 0 then
+            redis.call('HSET', KEYS[1], 'c:' .. pid, ARGV[2], 'i:' .. pid, ARGV[i + 3])
+        end
+        redis.call('HSET', KEYS[1], 'q:' .. pid, quantity, 'u:' .. pid, ARGV[2])
+        changed = true
+    else
+        quantity = current
+    end
+    table.insert(result, current)
+    table.insert(result, quantity)
+end
+if changed then
+    redis.call('HINCRBY', KEYS[1], '_v', 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('SADD', KEYS[2], ARGV[1])
+end
+return result
+"""
+
+# Remove what an order bought from the cart (see module docstring)
+# KEYS[1] cart hash, KEYS[2] dirty set
+# ARGV: user_id, version checkout loaded, now, key_ttl, then product_id, quantity per ordered line
+# Returns the new version, or 0 if the cart is not loaded
+_CLEAR_ORDERED = """
+local version = redis.call('HGET', KEYS[1], '_v')
+if not version then
+    return 0
+end
+if version == ARGV[2] then
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[1], '_v', version)
+else
+    for i = 5, #ARGV, 2 do
+        local pid = ARGV[i]
+        local remaining = tonumber(redis.call('HGET', KEYS[1], 'q:' .. pid) or '0') - tonumber(ARGV[i + 1])
+        if remaining > 0 then
+            redis.call('HSET', KEYS[1], 'q:' .. pid, remaining, 'u:' .. pid, ARGV[3])
+        else
+            redis.call('HDEL', KEYS[1], 'q:' .. pid, 'c:' .. pid, 'u:' .. pid, 'i:' .. pid)
+        end
+    end
+end
+version = redis.call('HINCRBY', KEYS[1], '_v', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('SADD', KEYS[2], ARGV[1])
+return version
+"""
+
+# Give ids to lines stored before carts kept them; KEYS[1] cart hash
+# ARGV: product_id, item id per line
+_ASSIGN_IDS = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], 'q:' .. ARGV[i]) == 1 then
+        redis.call('HSETNX', KEYS[1], 'i:' .. ARGV[i], ARGV[i + 1])
+    end
+end
+return 1
+"""
+
+# KEYS[1] checkout lock; ARGV: token
+_UNLOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Drop a cart hash unless it has changes waiting to be written behind
+# KEYS[1] cart hash, KEYS[2] dirty set; ARGV: user_id
+_EVICT = """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+    return 0
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+_HYDRATE_SQL = """
+    SELECT id, product_id, variant_id, quantity, created_at, updated_at
+    FROM cart_items
+    WHERE user_id = $1
+"""
+
+_NEW_IDS_SQL = "SELECT nextval(pg_get_serial_sequence('cart_items', 'id')) FROM generate_series(1, $1)"
+
+_DELETE_SQL = "DELETE FROM cart_items WHERE user_id = ANY($1::int[])"
+
+# Lines for products deleted in the meantime are dropped rather than failing the batch
+_INSERT_SQL = """
+    INSERT INTO cart_items (id, user_id, product_id, quantity, created_at, updated_at)
+    SELECT COALESCE(v.id, nextval(pg_get_serial_sequence('cart_items', 'id'))),
+           v.user_id, v.product_id, v.quantity, v.created_at, v.updated_at
+    FROM unnest($1::int[], $2::int[], $3::int[], $4::int[], $5::timestamptz[], $6::timestamptz[])
+        AS v(id, user_id, product_id, quantity, created_at, updated_at)
+    JOIN products p ON p.id = v.product_id
+"""
+
+
+class CartNotLoaded(Exception):
+    """Internal: the cart hash is missing and must be rebuilt from Postgres."""
+
+
+class CartItemMissing(Exception):
+    """The product is not in the user's cart."""
+
+
+class CartUnsupported(Exception):
+    """The user's cart has lines the Redis store cannot hold (product variants)."""
+
+
+class CartLimitExceeded(Exception):
+    """The requested quantity is over the caller's limit; ``current`` is what the cart holds."""
+
+    def __init__(self, current: int):
+        super().__init__(current)
+        self.current = current
+
+
+def _cart_key(user_id) -> str:
+    return f"cart:{user_id}"
+
+
+def _checkout_key(user_id) -> str:
+    return f"cart:checkout:{user_id}"
+
+
+def _timestamp(value: str) -> datetime:
+    return datetime.fromtimestamp(float(value), tz=timezone.utc)
+
+
+def _initial_version() -> int:
+    # Versions restart from the clock after a rebuild, so they keep increasing
+    # across Redis data loss.
+    return int(time.time() * 1000)
+
+
+def parse_cart(fields: Dict[str, str]) -> Tuple[int, Dict[int, Dict[str, Any]]]:
+    """Turn a cart hash into ``(version, {product_id: line})``."""
+    version = int(fields.get("_v", 0))
+    lines: Dict[int, Dict[str, Any]] = {}
+    for field, value in fields.items():
+        if not field.startswith("q:"):
+            continue
+        product_id = field[2:]
+        item_id = fields.get(f"i:{product_id}")
+        lines[int(product_id)] = {
+            "id": int(item_id) if item_id is not None else None,
+            "quantity": int(value),
+            "created_at": _timestamp(fields.get(f"c:{product_id}", "0")),
+            "updated_at": _timestamp(fields.get(f"u:{product_id}", "0")),
+        }
+    return version, lines
+
+
+class CartStore:
+    def __init__(self, mode: str = "postgres", key_ttl: int = 30 * 86400, flush_interval: float = 2.0,
+                 batch_size: int = 500, checkout_lock_ttl: float = 60.0):
+        self.mode = mode
+        self.key_ttl = key_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.checkout_lock_ttl = checkout_lock_ttl
+        self.redis = None
+        self.pool = None
+        self._hydrate = self._mutate = self._remove = self._replace = self._merge = self._evict = None
+        self._clear_ordered = self._unlock = self._assign_ids = None
+        self._flush_lock = asyncio.Lock()
+        self._counts = {
+            "hydrations": 0, "mutations": 0, "flushes": 0, "carts_flushed": 0,
+            "flush_errors": 0, "redis_resets": 0, "checkout_conflicts": 0, "unsupported_carts": 0,
+        }
+        self._last_flush_ms = 0.0
+        self._epoch_seen = False
+
+    def bind(self, redis_client, pool):
+        self.redis = redis_client
+        self.pool = pool
+        if redis_client:
+            self._hydrate = redis_client.register_script(_HYDRATE)
+            self._mutate = redis_client.register_script(_MUTATE)
+            self._remove = redis_client.register_script(_REMOVE)
+            self._replace = redis_client.register_script(_REPLACE)
+            self._merge = redis_client.register_script(_MERGE)
+            self._evict = redis_client.register_script(_EVICT)
+            self._clear_ordered = redis_client.register_script(_CLEAR_ORDERED)
+            self._unlock = redis_client.register_script(_UNLOCK)
+            self._assign_ids = redis_client.register_script(_ASSIGN_IDS)
+
+    @property
+    def enabled(self) -> bool:
+        """True when carts are served from Redis rather than straight from Postgres."""
+        return self.mode == "redis" and self.redis is not None and self.pool is not None
+
+    async def _new_ids(self, count: int) -> List[int]:
+        """Reserve ``count`` ids from the ``cart_items`` sequence for new lines."""
+        if not count:
+            return []
+        async with self.pool.acquire() as connection:
+            return [row[0] for row in await connection.fetch(_NEW_IDS_SQL, count)]
+
+    async def _load_from_postgres(self, user_id: int):
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch(_HYDRATE_SQL, user_id)
+        if any(row["variant_id"] is not None for row in rows):
+            self._counts["unsupported_carts"] += 1
+            raise CartUnsupported(user_id)
+        args: List[Any] = [_initial_version(), self.key_ttl]
+        for row in rows:
+            args.extend([row["product_id"], row["quantity"],
+                         row["created_at"].timestamp(), row["updated_at"].timestamp(), row["id"]])
+        if await self._hydrate(keys=[_cart_key(user_id)], args=args):
+            self._counts["hydrations"] += 1
+
+    async def _with_hydration(self, user_id: int, operation):
+        try:
+            return await operation()
+        except CartNotLoaded:
+            await self._load_from_postgres(user_id)
+            return await operation()
+
+    async def load(self, user_id: int) -> Tuple[int, Dict[int, Dict[str, Any]]]:
+        """Return ``(version, {product_id: line})`` for the user's cart."""
+        async def read():
+            fields = await self.redis.hgetall(_cart_key(user_id))
+            if not fields:
+                raise CartNotLoaded()
+            return parse_cart(fields)
+
+        version, lines = await self._with_hydration(user_id, read)
+        missing = [product_id for product_id, line in lines.items() if line["id"] is None]
+        if missing:
+            args: List[Any] = []
+            for product_id, item_id in zip(missing, await self._new_ids(len(missing))):
+                args.extend([product_id, item_id])
+            await self._assign_ids(keys=[_cart_key(user_id)], args=args)
+            version, lines = await self._with_hydration(user_id, read)
+        return version, lines
+
+    async def product_for_item(self, user_id: int, item_id: int) -> Optional[int]:
+        """The product of the user's cart line ``item_id``, or None if there is no such line."""
+        _, lines = await self.load(user_id)
+        for product_id, line in lines.items():
+            if line["id"] == item_id:
+                return product_id
+        return None
+
+    async def _set(self, user_id: int, product_id: int, quantity: int, mode: str, limit: int,
+                   item_id: Optional[int] = None) -> Dict[str, Any]:
+        now = repr(time.time())
+        args: List[Any] = [user_id, product_id, quantity, mode, limit, now, self.key_ttl, item_id or ""]
+
+        async def mutate():
+            result = await self._mutate(keys=[_cart_key(user_id), DIRTY_SET], args=args)
+            status = int(result[0])
+            if status == 1:
+                raise CartNotLoaded()
+            if status == 2:
+                raise CartItemMissing(product_id)
+            if status == 3:
+                raise CartLimitExceeded(int(result[1]))
+            if status == 4:
+                # A new line: reserve its id, then try again
+                args[7] = (await self._new_ids(1))[0]
+                return await mutate()
+            self._counts["mutations"] += 1
+            return {
+                "id": int(result[5]),
+                "quantity": int(result[1]),
+                "previous": int(result[4]),
+                "version": int(result[2]),
+                "created_at": _timestamp(result[3]),
+                "updated_at": _timestamp(now),
+            }
+
+        return await self._with_hydration(user_id, mutate)
+
+    async def add(self, user_id: int, product_id: int, quantity: int, limit: int) -> Dict[str, Any]:
+        """Add ``quantity`` of a product; raises CartLimitExceeded if the total would pass ``limit``."""
+        return await self._set(user_id, product_id, quantity, "add", limit)
+
+    async def set_quantity(self, user_id: int, product_id: int, item_id: int, quantity: int,
+                           limit: int) -> Dict[str, Any]:
+        """Change the quantity of cart line ``item_id`` (for ``product_id``)."""
+        return await self._set(user_id, product_id, quantity, "set", limit, item_id)
+
+    async def remove(self, user_id: int, product_id: int, item_id: int) -> int:
+        """Remove cart line ``item_id`` (for ``product_id``); returns the quantity removed (0 if it was not there)."""
+        async def remove():
+            result = await self._remove(
+                keys=[_cart_key(user_id), DIRTY_SET], args=[user_id, product_id, self.key_ttl, item_id]
+            )
+            if result == -1:
+                raise CartNotLoaded()
+            return int(result)
+
+        removed = await self._with_hydration(user_id, remove)
+        if removed:
+            self._counts["mutations"] += 1
+        return removed
+
+    async def replace(self, user_id: int, quantities: Dict[int, int]) -> int:
+        """Overwrite the cart with ``{product_id: quantity}``; returns the new version."""
+        args: List[Any] = [user_id, _initial_version(), repr(time.time()), self.key_ttl]
+        for (product_id, quantity), item_id in zip(quantities.items(), await self._new_ids(len(quantities))):
+            args.extend([product_id, quantity, item_id])
+        version = await self._replace(keys=[_cart_key(user_id), DIRTY_SET], args=args)
+        self._counts["mutations"] += 1
+        return int(version)
+
+    async def merge(self, user_id: int, lines: Dict[int, Tuple[int, int]]) -> Dict[int, Tuple[int, int]]:
+        """Add ``{product_id: (quantity, limit)}`` to the cart, capping each line at its limit.
+
+        Returns ``{product_id: (previous, final)}`` quantities.
+        """
+        product_ids = list(lines)
+        args: List[Any] = [user_id, repr(time.time()), self.key_ttl]
+        # Ids for lines that turn out to be new; the others' go unused
+        for product_id, item_id in zip(product_ids, await self._new_ids(len(product_ids))):
+            args.extend([product_id, *lines[product_id], item_id])
+
+        async def merge():
+            result = await self._merge(keys=[_cart_key(user_id), DIRTY_SET], args=args)
+            if int(result[0]) == 1:
+                raise CartNotLoaded()
+            return result[1:]
+
+        result = await self._with_hydration(user_id, merge)
+        self._counts["mutations"] += 1
+        return {
+            product_id: (int(result[2 * i]), int(result[2 * i + 1]))
+            for i, product_id in enumerate(product_ids)
+        }
+
+    async def lock_checkout(self, user_id: int) -> Optional[str]:
+        """Take the user's checkout lock; returns its token, or None if another checkout holds it."""
+        token = secrets.token_hex(16)
+        if await self.redis.set(_checkout_key(user_id), token, nx=True, px=int(self.checkout_lock_ttl * 1000)):
+            return token
+        self._counts["checkout_conflicts"] += 1
+        return None
+
+    async def unlock_checkout(self, user_id: int, token: str):
+        await self._unlock(keys=[_checkout_key(user_id)], args=[token])
+
+    async def clear_ordered(self, user_id: int, version: int, quantities: Dict[int, int]) -> int:
+        """Remove an order's lines from the cart loaded at ``version``; returns the new version."""
+        args: List[Any] = [user_id, version, repr(time.time()), self.key_ttl]
+        for product_id, quantity in quantities.items():
+            args.extend([product_id, quantity])
+        version = await self._clear_ordered(keys=[_cart_key(user_id), DIRTY_SET], args=args)
+        self._counts["mutations"] += 1
+        return int(version)
+
+    async def evict(self, user_ids: List[int]) -> int:
+        """Drop cached carts whose ``cart_items`` rows were removed behind the store's back."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                await self._evict(keys=[_cart_key(user_id), DIRTY_SET], args=[user_id], client=pipe)
+            results = await pipe.execute()
+        return sum(int(result) for result in results)
+
+    async def _write_batch(self, user_ids: List[str]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(_cart_key(user_id))
+            snapshots = await pipe.execute()
+
+        users, item_ids, line_users, product_ids, quantities, created, updated = [], [], [], [], [], [], []
+        for user_id, fields in zip(user_ids, snapshots):
+            if not fields:
+                continue  # Expired or lost; Postgres keeps what it has
+            users.append(int(user_id))
+            for product_id, line in parse_cart(fields)[1].items():
+                item_ids.append(line["id"])
+                line_users.append(int(user_id))
+                product_ids.append(product_id)
+                quantities.append(line["quantity"])
+                created.append(line["created_at"])
+                updated.append(line["updated_at"])
+        if not users:
+            return 0
+
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(_DELETE_SQL, users)
+                if line_users:
+                    await connection.execute(
+                        _INSERT_SQL, item_ids, line_users, product_ids, quantities, created, updated
+                    )
+        return len(users)
+
+    async def flush(self) -> int:
+        """Persist every dirty cart to ``cart_items``; failed batches stay dirty."""
+        if not self.enabled:
+            return 0
+        async with self._flush_lock:
+            started = time.perf_counter()
+            written = 0
+            while True:
+                user_ids = await self.redis.spop(DIRTY_SET, self.batch_size)
+                if not user_ids:
+                    break
+                try:
+                    written += await self._write_batch(user_ids)
+                except Exception as e:
+                    self._counts["flush_errors"] += 1
+                    logger.error(f"Cart write-behind failed for {len(user_ids)} carts: {e}")
+                    await self.redis.sadd(DIRTY_SET, *user_ids)
+                    break
+            if written:
+                self._counts["flushes"] += 1
+                self._counts["carts_flushed"] += written
+                self._last_flush_ms = (time.perf_counter() - started) * 1000
+            return written
+
+    async def check_epoch(self) -> bool:
+        """Detect a Redis dataset loss; returns True if one happened since the last check."""
+        created = await self.redis.set(EPOCH_KEY, int(time.time()), nx=True)
+        lost, self._epoch_seen = bool(created) and self._epoch_seen, True
+        if lost:
+            self._counts["redis_resets"] += 1
+            logger.warning("Cart store lost its Redis data; carts will be rebuilt from cart_items "
+                           "and unflushed changes since the last write-behind are gone")
+            return True
+        return False
+
+    async def run(self):
+        """Write dirty carts behind every ``flush_interval`` seconds until cancelled."""
+        while True:
+            try:
+                await self.check_epoch()
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Cart write-behind loop error: {e}")
+            await asyncio.sleep(self.flush_interval)
+
+    async def stats(self) -> Dict[str, Any]:
+        dirty: Any = None
+        if self.enabled:
+            try:
+                dirty = await self.redis.scard(DIRTY_SET)
+            except Exception as e:
+                dirty = {"error": str(e)}
+        return {
+            "mode": "redis" if self.enabled else "postgres",
+            "dirty_carts": dirty,
+            "flush_interval_s": self.flush_interval,
+            "last_flush_ms": round(self._last_flush_ms, 2),
+            **self._counts,
+        }
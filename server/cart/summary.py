@@ -0,0 +1,168 @@
+"""Per-user cart badge counters in Redis.
+
+``cart:summary:{user_id}`` is a hash of ``items`` (cart lines) and ``cents``
+(subtotal in cents), so the header badge is one ``HMGET``. Cart mutations
+apply their delta in the same Lua call that bumps the cart version (see
+``cart.snapshots``), and deltas only touch counters that already exist.
+Missing counters are rebuilt from the full cart and written back only if
+the cart version has not moved in the meantime.
+
+Product price and availability changes arrive as ``product_changed``
+notifications from a Postgres trigger; the counters of every cart holding
+that product are dropped and rebuilt on next read. Counters are never kept
+alive by deltas, so any drift (a lost notification, a race between a
+rebuild and a mutation) is gone after ``ttl`` seconds.
+"""
+import logging
+import time
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+from cart.snapshots import version_key
+from database.notify import listen
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_CHANGED_CHANNEL = "product_changed"
+
+# KEYS[1] cart version, KEYS[2] summary hash
+# ARGV: initial version, version_ttl, op ('delta' | 'reset' | 'drop'), item delta, cents delta, ttl
+_RECORD = """
+redis.call('SET', KEYS[1], ARGV[1], 'NX')
+local version = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if ARGV[3] == 'reset' then
+    redis.call('HSET', KEYS[2], 'items', 0, 'cents', 0)
+    redis.call('EXPIRE', KEYS[2], ARGV[6])
+elseif ARGV[3] == 'drop' then
+    redis.call('DEL', KEYS[2])
+elseif redis.call('EXISTS', KEYS[2]) == 1 then
+    local items = redis.call('HINCRBY', KEYS[2], 'items', ARGV[4])
+    local cents = redis.call('HINCRBY', KEYS[2], 'cents', ARGV[5])
+    -- Below zero means the counters drifted; recount on next read
+    if items < 0 or cents < 0 then
+        redis.call('DEL', KEYS[2])
+    end
+end
+return version
+"""
+
+# KEYS[1] cart version, KEYS[2] summary hash; ARGV: version read before counting, items, cents, ttl
+_SEED = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[2], 'items', ARGV[2], 'cents', ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+_CARTS_WITH_PRODUCT_SQL = "SELECT DISTINCT user_id FROM cart_items WHERE product_id = $1"
+
+
+def _summary_key(user_id) -> str:
+    return f"cart:summary:{user_id}"
+
+
+def to_cents(amount: Decimal) -> int:
+    return int((amount * 100).to_integral_value())
+
+
+class CartSummaryCounters:
+    def __init__(self, ttl: int = 600, version_ttl: int = 30 * 86400, drop_batch_size: int = 500):
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.drop_batch_size = drop_batch_size
+        self.redis = None
+        self.pool = None
+        self._record = self._seed = None
+        self._counts = {"hits": 0, "misses": 0, "seeds": 0, "stale_seeds": 0, "price_drops": 0}
+
+    def bind(self, redis_client, pool):
+        self.redis = redis_client
+        self.pool = pool
+        if redis_client:
+            self._record = redis_client.register_script(_RECORD)
+            self._seed = redis_client.register_script(_SEED)
+
+    async def get(self, user_id: int) -> Optional[Tuple[int, Decimal]]:
+        """``(item_count, subtotal)`` from the counters, or None when they must be rebuilt."""
+        if not self.redis:
+            return None
+        try:
+            items, cents = await self.redis.hmget(_summary_key(user_id), "items", "cents")
+        except Exception as e:
+            logger.warning(f"Cart summary read failed for user {user_id}: {e}")
+            return None
+        if items is None or cents is None:
+            self._counts["misses"] += 1
+            return None
+        self._counts["hits"] += 1
+        return int(items), Decimal(int(cents)).scaleb(-2)
+
+    async def seed(self, user_id: int, version: Optional[int], item_count: int, subtotal: Decimal):
+        """Store counters computed from the whole cart as it was at ``version``."""
+        if not self.redis or version is None:
+            return
+        try:
+            stored = await self._seed(
+                keys=[version_key(user_id), _summary_key(user_id)],
+                args=[version, item_count, to_cents(subtotal), self.ttl],
+            )
+        except Exception as e:
+            logger.warning(f"Cart summary seed failed for user {user_id}: {e}")
+            return
+        self._counts["seeds" if stored else "stale_seeds"] += 1
+
+    async def record(self, user_id: int, items: int = 0, amount: Decimal = Decimal('0.00'),
+                     op: str = "delta") -> bool:
+        """Bump the cart version and apply a change to the counters in one step.
+
+        ``op`` is ``delta`` (add ``items`` lines and ``amount`` to the subtotal),
+        ``reset`` (the cart is now empty) or ``drop`` (recount on next read).
+        Returns False if Redis could not be updated.
+        """
+        if not self.redis:
+            return False
+        try:
+            await self._record(
+                keys=[version_key(user_id), _summary_key(user_id)],
+                args=[int(time.time() * 1000), self.version_ttl, op, items, to_cents(amount), self.ttl],
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"Cart summary update failed for user {user_id}: {e}")
+            return False
+
+    async def product_changed(self, db, product_id: int) -> int:
+        """Drop the counters (and cached carts) of every cart holding ``product_id``."""
+        user_ids = [row["user_id"] for row in await db.fetch(_CARTS_WITH_PRODUCT_SQL, product_id)]
+        now_ms = int(time.time() * 1000)
+        for start in range(0, len(user_ids), self.drop_batch_size):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids[start:start + self.drop_batch_size]:
+                    await self._record(
+                        keys=[version_key(user_id), _summary_key(user_id)],
+                        args=[now_ms, self.version_ttl, "drop", 0, 0, self.ttl],
+                        client=pipe,
+                    )
+                await pipe.execute()
+        self._counts["price_drops"] += len(user_ids)
+        return len(user_ids)
+
+    async def _on_product_changed(self, connection, payload: str):
+        try:
+            product_id = int(payload)
+        except ValueError:
+            return
+        await self.product_changed(connection, product_id)
+
+    async def listen_for_product_changes(self):
+        """Apply ``product_changed`` notifications from Postgres. Runs until cancelled."""
+        if not self.redis or not self.pool:
+            return
+        # Changes missed while reconnecting are bounded by the counter TTL
+        await listen(self.pool, PRODUCT_CHANGED_CHANNEL, self._on_product_changed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ttl_s": self.ttl, **self._counts}
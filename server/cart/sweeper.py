@@ -0,0 +1,173 @@
+"""Background sweeper for abandoned carts.
+
+A cart is abandoned once none of its lines changed for ``idle_days``. The
+sweeper removes such carts from ``cart_items`` a batch of carts at a time;
+each batch is one statement that deletes the lines and writes one
+``cart_abandoned`` row per cart to ``analytics_events`` (lines, item count,
+subtotal at current prices, last activity) for marketing follow-ups, so a
+cart is never dropped without its event. Batches are paced to at most
+``max_rows_per_second`` deleted lines, and a large run ends with a
+``VACUUM (ANALYZE)`` so the freed space and index entries are reused
+instead of the table growing further.
+
+Each swept cart gets its version bumped and its badge counters dropped, as
+a cart mutation would, so cached carts and summaries never show the lines.
+
+Only one worker sweeps at a time (a session advisory lock); the others skip
+the run. A line changed while its cart is being swept is kept.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+ABANDONED_EVENT = "cart_abandoned"
+
+_LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext('cart_sweeper'))"
+_UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext('cart_sweeper'))"
+
+_IDLE_CARTS_SQL = """
+    SELECT DISTINCT ci.user_id
+    FROM cart_items ci
+    WHERE ci.updated_at < $1
+      AND NOT EXISTS (
+          SELECT 1 FROM cart_items recent WHERE recent.user_id = ci.user_id AND recent.updated_at >= $1
+      )
+    LIMIT $2
+"""
+
+# Returns one row per swept cart with the number of lines deleted
+_SWEEP_SQL = """
+    WITH swept AS (
+        DELETE FROM cart_items ci
+        WHERE ci.user_id = ANY($1::int[])
+          AND ci.updated_at < $2
+          AND NOT EXISTS (
+              SELECT 1 FROM cart_items recent WHERE recent.user_id = ci.user_id AND recent.updated_at >= $2
+          )
+        RETURNING ci.user_id, ci.product_id, ci.quantity, ci.created_at, ci.updated_at
+    )
+    INSERT INTO analytics_events (event_type, user_id, event_data)
+    SELECT $3, s.user_id, jsonb_build_object(
+        'line_count', COUNT(*),
+        'item_count', SUM(s.quantity),
+        'subtotal', COALESCE(SUM(s.quantity * p.price), 0),
+        'created_at', MIN(s.created_at),
+        'last_activity', MAX(s.updated_at),
+        'lines', jsonb_agg(
+            jsonb_build_object('product_id', s.product_id, 'quantity', s.quantity, 'price', p.price)
+            ORDER BY s.product_id
+        )
+    )
+    FROM swept s
+    LEFT JOIN products p ON p.id = s.product_id
+    GROUP BY s.user_id
+    RETURNING user_id, (event_data->>'line_count')::int AS line_count
+"""
+
+
+class AbandonedCartSweeper:
+    def __init__(self, idle_days: float = 30, interval: float = 3600, batch_size: int = 500,
+                 max_rows_per_second: float = 2000, vacuum_after: int = 10000):
+        self.idle_days = idle_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+        self.vacuum_after = vacuum_after
+        self.pool = None
+        self.cart_store = None
+        self.cart_summary = None
+        self.cart_snapshots = None
+        self._counts = {"runs": 0, "skipped_runs": 0, "carts_swept": 0, "rows_deleted": 0, "vacuums": 0, "errors": 0}
+        self._last_run: Dict[str, Any] = {}
+
+    def bind(self, pool, cart_store=None, cart_summary=None, cart_snapshots=None):
+        self.pool = pool
+        self.cart_store = cart_store
+        self.cart_summary = cart_summary
+        self.cart_snapshots = cart_snapshots
+
+    async def _invalidate(self, user_ids: List[int]):
+        # Same as cart_router.record_cart_change(user_id, op="drop")
+        for user_id in user_ids:
+            if self.cart_summary is not None and await self.cart_summary.record(user_id, op="drop"):
+                continue
+            if self.cart_snapshots is not None:
+                await self.cart_snapshots.bump(user_id)
+
+    async def _sweep_batch(self, connection, cutoff: datetime) -> List[Any]:
+        user_ids = [row["user_id"] for row in await connection.fetch(_IDLE_CARTS_SQL, cutoff, self.batch_size)]
+        if not user_ids:
+            return []
+        return await connection.fetch(_SWEEP_SQL, user_ids, cutoff, ABANDONED_EVENT)
+
+    async def sweep(self) -> Dict[str, Any]:
+        """Sweep every cart idle past the threshold; returns what this run did."""
+        if not self.pool:
+            return {}
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.idle_days)
+        async with self.pool.acquire() as connection:
+            if not await connection.fetchval(_LOCK_SQL):
+                self._counts["skipped_runs"] += 1
+                return {}
+            try:
+                started = time.perf_counter()
+                carts = rows = 0
+                while True:
+                    batch_started = time.perf_counter()
+                    swept = await self._sweep_batch(connection, cutoff)
+                    if not swept:
+                        break
+                    batch_rows = sum(row["line_count"] for row in swept)
+                    carts += len(swept)
+                    rows += batch_rows
+                    swept_ids = [row["user_id"] for row in swept]
+                    if self.cart_store is not None and self.cart_store.enabled:
+                        await self.cart_store.evict(swept_ids)
+                    await self._invalidate(swept_ids)
+                    # Pace the deletes so autovacuum and replicas keep up
+                    pause = batch_rows / self.max_rows_per_second - (time.perf_counter() - batch_started)
+                    if pause > 0:
+                        await asyncio.sleep(pause)
+                elapsed = time.perf_counter() - started
+                if rows >= self.vacuum_after:
+                    await connection.execute("VACUUM (ANALYZE) cart_items")
+                    self._counts["vacuums"] += 1
+            finally:
+                await connection.fetchval(_UNLOCK_SQL)
+
+        self._counts["runs"] += 1
+        self._counts["carts_swept"] += carts
+        self._counts["rows_deleted"] += rows
+        self._last_run = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "carts": carts,
+            "rows": rows,
+            "seconds": round(elapsed, 2),
+            "rows_per_second": round(rows / elapsed, 1) if elapsed else 0.0,
+        }
+        if carts:
+            logger.info(f"Swept {carts} abandoned carts ({rows} rows) in {elapsed:.1f}s "
+                        f"({self._last_run['rows_per_second']} rows/s)")
+        return self._last_run
+
+    async def run(self):
+        """Sweep every ``interval`` seconds until cancelled."""
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                self._counts["errors"] += 1
+                logger.error(f"Abandoned cart sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "idle_days": self.idle_days,
+            "interval_s": self.interval,
+            "last_run": self._last_run,
+            **self._counts,
+        }
@@ -0,0 +1,46 @@
+"""Postgres ``LISTEN`` loop for in-process caches kept current by triggers.
+
+Each listener holds one pool connection for as long as it runs. Handlers run
+one at a time, in notification order, and may query on the listening
+connection. Notifications sent while no listener is attached are lost, so
+``on_connect`` runs after every (re)subscribe to let the caller resynchronise.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[object, str], Awaitable[None]]
+
+
+async def listen(pool, channel: str, handler: Handler, on_connect: Optional[Callable[[object], Awaitable[None]]] = None,
+                 poll_interval: float = 5.0):
+    """Call ``handler(connection, payload)`` for every notification on ``channel``. Runs until cancelled."""
+    while True:
+        try:
+            async with pool.acquire() as connection:
+                received: asyncio.Queue = asyncio.Queue()
+
+                def on_notify(_connection, _pid, _channel, payload):
+                    received.put_nowait(payload)
+
+                await connection.add_listener(channel, on_notify)
+                try:
+                    if on_connect is not None:
+                        await on_connect(connection)
+                    # A dropped connection delivers nothing, so check it between waits
+                    while not connection.is_closed():
+                        try:
+                            payload = await asyncio.wait_for(received.get(), timeout=poll_interval)
+                        except asyncio.TimeoutError:
+                            continue
+                        await handler(connection, payload)
+                finally:
+                    if not connection.is_closed():
+                        await connection.remove_listener(channel, on_notify)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Listener on '{channel}' failed, reconnecting: {e}")
+            await asyncio.sleep(1)
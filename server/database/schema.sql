@@ -254,6 +254,16 @@ CREATE TABLE IF NOT EXISTS payments (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Checkout retries: one row per Idempotency-Key, written in the order's transaction
+CREATE TABLE IF NOT EXISTS order_idempotency_keys (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    order_id INTEGER REFERENCES orders(id) ON DELETE CASCADE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
 -- Shipping zones
 CREATE TABLE IF NOT EXISTS shipping_zones (
     id SERIAL PRIMARY KEY,
@@ -385,9 +395,13 @@ CREATE TABLE IF NOT EXISTS seo_metadata (
     UNIQUE(entity_type, entity_id)
 );
 
--- Analytics events
+-- Analytics events, partitioned by UTC day on created_at. Daily partitions
+-- (analytics_events_pYYYYMMDD) are created ahead and dropped after the
+-- retention period by the API (events/partitions.py); the default partition
+-- only catches rows no daily partition covers yet. Convert an existing
+-- unpartitioned table with scripts/partition_analytics_events.py.
 CREATE TABLE IF NOT EXISTS analytics_events (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     event_type VARCHAR(100) NOT NULL,
     user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
     session_id VARCHAR(255),
@@ -397,7 +411,29 @@ CREATE TABLE IF NOT EXISTS analytics_events (
     event_data JSONB,
     user_agent TEXT,
     ip_address INET,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS analytics_events_default PARTITION OF analytics_events DEFAULT;
+
+-- Hourly event counts by event type, product and category for dashboards,
+-- folded in from analytics_events incrementally (events/rollups.py). Product
+-- events without a category are counted under the product's category.
+CREATE TABLE IF NOT EXISTS analytics_hourly_rollups (
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    event_type VARCHAR(100) NOT NULL,
+    product_id INTEGER,
+    category_id INTEGER,
+    events BIGINT NOT NULL DEFAULT 0,
+    UNIQUE NULLS NOT DISTINCT (hour, event_type, product_id, category_id)
+);
+
+-- Last analytics_events id counted by each rollup
+CREATE TABLE IF NOT EXISTS analytics_rollup_state (
+    name VARCHAR(100) PRIMARY KEY,
+    last_event_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Indexes for performance
@@ -411,13 +447,19 @@ CREATE INDEX IF NOT EXISTS idx_products_is_featured ON products(is_featured);
 CREATE INDEX IF NOT EXISTS idx_product_images_product_id ON product_images(product_id);
 CREATE INDEX IF NOT EXISTS idx_product_reviews_product_id ON product_reviews(product_id);
 CREATE INDEX IF NOT EXISTS idx_cart_items_user_id ON cart_items(user_id);
+CREATE INDEX IF NOT EXISTS idx_cart_items_updated_at ON cart_items(updated_at);
 CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
 CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
 CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
 CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id);
 CREATE INDEX IF NOT EXISTS idx_payments_order_id ON payments(order_id);
+CREATE INDEX IF NOT EXISTS idx_order_idempotency_keys_created_at ON order_idempotency_keys(created_at);
+CREATE INDEX IF NOT EXISTS idx_inventory_movements_product ON inventory_movements(product_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_inventory_movements_product_id ON inventory_movements(product_id, id);
 CREATE INDEX IF NOT EXISTS idx_analytics_events_event_type ON analytics_events(event_type);
 CREATE INDEX IF NOT EXISTS idx_analytics_events_created_at ON analytics_events(created_at);
+CREATE INDEX IF NOT EXISTS idx_analytics_hourly_rollups_product ON analytics_hourly_rollups(product_id, hour);
+CREATE INDEX IF NOT EXISTS idx_analytics_hourly_rollups_category ON analytics_hourly_rollups(category_id, hour);
 
 -- Full-text search indexes
 CREATE INDEX IF NOT EXISTS idx_products_name_gin ON products USING gin(to_tsvector('english', name));
@@ -428,6 +470,11 @@ CREATE INDEX IF NOT EXISTS idx_products_tags_gin ON products USING gin(tags);
 CREATE INDEX IF NOT EXISTS idx_products_active_category ON products(is_active, category_id);
 CREATE INDEX IF NOT EXISTS idx_products_active_featured ON products(is_active, is_featured);
 CREATE INDEX IF NOT EXISTS idx_cart_items_user_product ON cart_items(user_id, product_id);
+CREATE INDEX IF NOT EXISTS idx_discount_codes_lower_code ON discount_codes(LOWER(code));
+-- Lines without a variant are unique per product too, so cart upserts can
+-- target ON CONFLICT (user_id, product_id, variant_id) (PostgreSQL 15+)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_items_user_product_variant_unique
+    ON cart_items(user_id, product_id, variant_id) NULLS NOT DISTINCT;
 
 -- Triggers for updated_at timestamps
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -461,4 +508,30 @@ CREATE TRIGGER update_discount_codes_updated_at BEFORE UPDATE ON discount_codes
 CREATE TRIGGER update_support_tickets_updated_at BEFORE UPDATE ON support_tickets 
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_seo_metadata_updated_at BEFORE UPDATE ON seo_metadata 
-    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
\ No newline at end of file
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Price and availability changes invalidate the cart badge counters held in
+-- Redis; the API listens on this channel (payload: product id)
+CREATE OR REPLACE FUNCTION notify_product_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('product_changed', NEW.id::text);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER notify_products_changed AFTER UPDATE OF price, is_active ON products
+    FOR EACH ROW WHEN (OLD.price IS DISTINCT FROM NEW.price OR OLD.is_active IS DISTINCT FROM NEW.is_active)
+    EXECUTE FUNCTION notify_product_changed();
+
+-- Keeps the API's in-process discount code index current (payload: code id)
+CREATE OR REPLACE FUNCTION notify_discount_code_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('discount_code_changed', COALESCE(NEW.id, OLD.id)::text);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER notify_discount_codes_changed AFTER INSERT OR UPDATE OR DELETE ON discount_codes
+    FOR EACH ROW EXECUTE FUNCTION notify_discount_code_changed();
@@ -0,0 +1,101 @@
+"""Write-behind buffer for hot timestamp columns on ``users``.
+
+Requests record "user X did Y at T" in memory and return immediately; a
+background loop coalesces those into one ``UPDATE ... FROM unnest(...)`` per
+column every ``flush_interval`` seconds (sooner if the buffer fills). Only
+the newest timestamp per user survives, so a user logging in ten times in a
+window costs one row update. Anything still buffered is flushed on shutdown;
+a hard crash loses at most one interval of updates.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Column name -> SQL; only whitelisted columns can be written.
+_FLUSH_SQL = {
+    "last_login": """
+        UPDATE users AS u
+        SET last_login = v.at
+        FROM unnest($1::int[], $2::timestamptz[]) AS v(id, at)
+        WHERE u.id = v.id AND (u.last_login IS NULL OR u.last_login < v.at)
+    """,
+}
+
+
+class UserTouchBuffer:
+    def __init__(self, flush_interval: float = 5.0, max_pending: int = 5000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pool = None
+        self._pending: Dict[str, Dict[int, datetime]] = {column: {} for column in _FLUSH_SQL}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._counts = {"touches": 0, "rows_flushed": 0, "flushes": 0, "errors": 0}
+        self._last_flush_ms = 0.0
+
+    def bind(self, pool):
+        self.pool = pool
+
+    def touch(self, user_id: int, column: str = "last_login", at: Optional[datetime] = None):
+        """Record a timestamp update; it reaches the database on the next flush."""
+        if column not in _FLUSH_SQL:
+            raise ValueError(f"Unsupported write-behind column: {column}")
+        at = at or datetime.utcnow()
+        pending = self._pending[column]
+        if user_id not in pending or pending[user_id] < at:
+            pending[user_id] = at
+        self._counts["touches"] += 1
+        if self.pending_count() >= self.max_pending:
+            self._wakeup.set()
+
+    def pending_count(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    async def flush(self) -> int:
+        """Write all buffered updates; failed batches are put back for the next try."""
+        if not self.pool or not self.pending_count():
+            return 0
+        async with self._flush_lock:
+            batches, self._pending = self._pending, {column: {} for column in _FLUSH_SQL}
+            started = time.perf_counter()
+            written = 0
+            for column, updates in batches.items():
+                if not updates:
+                    continue
+                try:
+                    async with self.pool.acquire() as connection:
+                        await connection.execute(_FLUSH_SQL[column], list(updates.keys()), list(updates.values()))
+                    written += len(updates)
+                except Exception as e:
+                    self._counts["errors"] += 1
+                    logger.error(f"Write-behind flush of {column} failed for {len(updates)} users: {e}")
+                    pending = self._pending[column]
+                    for user_id, at in updates.items():
+                        if user_id not in pending or pending[user_id] < at:
+                            pending[user_id] = at
+            self._counts["flushes"] += 1
+            self._counts["rows_flushed"] += written
+            self._last_flush_ms = (time.perf_counter() - started) * 1000
+            return written
+
+    async def run(self):
+        """Flush every ``flush_interval`` seconds, or early when the buffer fills."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending_count(),
+            "flush_interval_s": self.flush_interval,
+            "last_flush_ms": round(self._last_flush_ms, 2),
+            **self._counts,
+        }
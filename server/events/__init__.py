@@ -0,0 +1 @@
+"""Analytics event ingestion."""
@@ -0,0 +1,235 @@
+"""In-process buffer for ``analytics_events``, written with ``COPY``.
+
+``POST /api/events`` hands parsed events to ``EventBuffer.add`` and returns
+at once; a background loop writes them with ``copy_records_to_table`` in
+batches of up to ``batch_size`` rows, every ``flush_interval`` seconds or as
+soon as a full batch is waiting. A batch whose ``user_id``, ``product_id``,
+``category_id`` or ``order_id`` points at a row that no longer exists is
+retried as one ``INSERT ... SELECT`` that nulls the dangling references.
+
+Load shedding: above ``sample_above`` of ``max_pending``, incoming events
+are kept with a probability that falls linearly to zero at ``max_pending``;
+a batch that does not fit at all is refused so the client can back off and
+retry. Each worker has its own buffer; a crash loses at most what is
+pending (one interval under normal load).
+
+A batch the database rejects for its contents (bad encoding, a value out
+of range) is written again one row at a time and the rows that still fail
+are dropped and logged, so one bad event cannot stall ingestion. Any other
+failure is retried up to ``max_retries`` times before the batch gets the
+same treatment; a row that fails because the connection did is never
+dropped.
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    "event_type", "user_id", "session_id", "product_id", "category_id", "order_id",
+    "event_data", "user_agent", "ip_address", "created_at",
+)
+
+EventRecord = Tuple[Any, ...]
+
+# The database or the driver rejected the values themselves; retrying as is cannot succeed
+_BAD_DATA_ERRORS = (asyncpg.DataError, ValueError, TypeError, OverflowError)
+
+# Server errors that say nothing about the row being written
+_CONNECTION_ERRORS = (asyncpg.PostgresConnectionError, asyncpg.OperatorInterventionError,
+                      asyncpg.InsufficientResourcesError)
+
+# Same rows as the COPY, with references to deleted rows set to NULL
+_INSERT_CHECKED_SQL = """
+    INSERT INTO analytics_events (event_type, user_id, session_id, product_id, category_id, order_id,
+                                  event_data, user_agent, ip_address, created_at)
+    SELECT v.event_type, u.id, v.session_id, p.id, c.id, o.id, v.event_data, v.user_agent, v.ip_address, v.created_at
+    FROM unnest($1::text[], $2::int[], $3::text[], $4::int[], $5::int[], $6::int[],
+                $7::jsonb[], $8::text[], $9::inet[], $10::timestamptz[])
+        AS v(event_type, user_id, session_id, product_id, category_id, order_id,
+             event_data, user_agent, ip_address, created_at)
+    LEFT JOIN users u ON u.id = v.user_id
+    LEFT JOIN products p ON p.id = v.product_id
+    LEFT JOIN categories c ON c.id = v.category_id
+    LEFT JOIN orders o ON o.id = v.order_id
+"""
+
+
+class BufferFull(Exception):
+    """The buffer cannot take the batch; ``retry_after`` is a hint in seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+def event_record(event_type: str, user_id: Optional[int] = None, session_id: Optional[str] = None,
+                 product_id: Optional[int] = None, category_id: Optional[int] = None,
+                 order_id: Optional[int] = None, data: Optional[Dict[str, Any]] = None,
+                 user_agent: Optional[str] = None, ip_address: Optional[str] = None,
+                 created_at=None) -> EventRecord:
+    """One row for ``analytics_events`` in ``COLUMNS`` order.
+
+    ``created_at`` defaults to now: it is the partition key, and COPY writes
+    an explicit NULL rather than the column default.
+    """
+    return (
+        event_type, user_id, session_id, product_id, category_id, order_id,
+        json.dumps(data) if data is not None else None, user_agent, ip_address,
+        created_at or datetime.now(timezone.utc),
+    )
+
+
+class EventBuffer:
+    def __init__(self, batch_size: int = 5000, flush_interval: float = 1.0, max_pending: int = 100000,
+                 sample_above: float = 0.75, max_retries: int = 3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.sample_above = sample_above
+        self.max_retries = max_retries
+        self.pool = None
+        self._pending: Deque[EventRecord] = deque()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._counts = {
+            "received": 0, "accepted": 0, "sampled_out": 0, "refused": 0,
+            "rows_written": 0, "copies": 0, "checked_inserts": 0, "errors": 0, "isolated_batches": 0,
+            "rows_dropped": 0,
+        }
+        self._failures = 0
+        self._last_copy_ms = 0.0
+        self._last_rate = 0.0
+
+    def bind(self, pool):
+        self.pool = pool
+
+    def add(self, records: Sequence[EventRecord]) -> int:
+        """Queue events for the next flush; returns how many were kept.
+
+        Raises ``BufferFull`` when the batch does not fit.
+        """
+        self._counts["received"] += len(records)
+        pending = len(self._pending)
+        if pending + len(records) > self.max_pending:
+            self._counts["refused"] += len(records)
+            # Roughly the time the writer needs to make room for this batch
+            raise BufferFull(max(self.flush_interval, len(records) / self._last_rate if self._last_rate else 1.0))
+        high_water = self.max_pending * self.sample_above
+        if pending > high_water:
+            keep = (self.max_pending - pending) / (self.max_pending - high_water)
+            kept = [record for record in records if random.random() < keep]
+            self._counts["sampled_out"] += len(records) - len(kept)
+            records = kept
+        self._pending.extend(records)
+        self._counts["accepted"] += len(records)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return len(records)
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def _write(self, connection, batch: List[EventRecord]):
+        try:
+            await connection.copy_records_to_table("analytics_events", records=batch, columns=COLUMNS)
+            self._counts["copies"] += 1
+        except asyncpg.ForeignKeyViolationError:
+            await connection.execute(_INSERT_CHECKED_SQL, *(list(column) for column in zip(*batch)))
+            self._counts["checked_inserts"] += 1
+
+    async def _write_rows(self, connection, batch: List[EventRecord]) -> int:
+        """Write a rejected batch one row at a time, dropping the rows that fail.
+
+        Returns how many rows were written; if the connection itself fails,
+        the rows not yet tried go back to the front of the buffer.
+        """
+        self._counts["isolated_batches"] += 1
+        written = 0
+        for index, record in enumerate(batch):
+            try:
+                await self._write(connection, [record])
+            except _CONNECTION_ERRORS:
+                self._pending.extendleft(reversed(batch[index:]))
+                raise
+            except (asyncpg.PostgresError, *_BAD_DATA_ERRORS) as e:
+                self._counts["rows_dropped"] += 1
+                logger.warning(f"Dropped analytics event {record[0]!r}: {e}")
+                continue
+            except BaseException:
+                self._pending.extendleft(reversed(batch[index:]))
+                raise
+            written += 1
+        return written
+
+    async def flush(self) -> int:
+        """Write what is pending now; a failed batch goes back to the front of the buffer."""
+        if not self.pool or not self._pending:
+            return 0
+        async with self._flush_lock:
+            # Events that arrive meanwhile wait for the next flush, so one call cannot run forever
+            target = len(self._pending)
+            done = written = 0
+            async with self.pool.acquire() as connection:
+                while done < target and self._pending:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                    done += len(batch)
+                    started = time.perf_counter()
+                    try:
+                        await self._write(connection, batch)
+                    except BaseException as e:
+                        if not isinstance(e, Exception):
+                            self._pending.extendleft(reversed(batch))
+                            raise  # Cancelled mid-write (shutdown); the final flush retries it
+                        self._counts["errors"] += 1
+                        self._failures += 1
+                        if isinstance(e, _BAD_DATA_ERRORS) or self._failures > self.max_retries:
+                            logger.warning(f"Analytics event batch of {len(batch)} rejected ({e}); "
+                                           "writing it row by row")
+                            self._failures = 0
+                            rows = await self._write_rows(connection, batch)
+                            written += rows
+                            self._counts["rows_written"] += rows
+                            continue
+                        self._pending.extendleft(reversed(batch))
+                        logger.error(f"Analytics event flush failed for {len(batch)} events: {e}")
+                        break
+                    self._failures = 0
+                    elapsed = time.perf_counter() - started
+                    written += len(batch)
+                    self._counts["rows_written"] += len(batch)
+                    self._last_copy_ms = elapsed * 1000
+                    self._last_rate = len(batch) / elapsed if elapsed else 0.0
+            return written
+
+    async def run(self):
+        """Flush every ``flush_interval`` seconds, or early when a full batch is waiting."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Analytics event loop error: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "flush_interval_s": self.flush_interval,
+            "last_copy_ms": round(self._last_copy_ms, 2),
+            "last_copy_rows_per_s": round(self._last_rate, 1),
+            **self._counts,
+        }
@@ -0,0 +1,65 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+import math
+from datetime import datetime, timedelta, timezone
+
+from events.buffer import BufferFull, event_record
+from events.models import AnalyticsEventAck, AnalyticsEventBatch
+from main import get_optional_user_id, limiter, event_buffer
+from ratelimit.limiter import client_ip
+
+events_router = APIRouter()
+
+# Client timestamps are kept within this window of the time the batch arrived
+MAX_EVENT_AGE = timedelta(days=7)
+
+
+@events_router.post("", response_model=AnalyticsEventAck, status_code=status.HTTP_202_ACCEPTED)
+@limiter.limit("120/minute")
+async def ingest_events(
+    batch: AnalyticsEventBatch,
+    request: Request,
+    user_id=Depends(get_optional_user_id)
+):
+    """Queue a batch of analytics events; they are written to the database in bulk shortly after.
+
+    Under heavy load some events may be sampled out (``accepted`` is lower
+    than ``received``) and a batch that cannot be buffered gets a 503 with
+    ``Retry-After``.
+    """
+    if event_buffer.pool is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not available"
+        )
+    now = datetime.now(timezone.utc)
+    oldest = now - MAX_EVENT_AGE
+    user_agent = request.headers.get("user-agent")
+    ip_address = client_ip(request)
+
+    records = []
+    for event in batch.events:
+        occurred_at = event.occurred_at or now
+        if occurred_at.tzinfo is None:
+            occurred_at = occurred_at.replace(tzinfo=timezone.utc)
+        records.append(event_record(
+            event.event_type,
+            user_id=user_id,
+            session_id=event.session_id,
+            product_id=event.product_id,
+            category_id=event.category_id,
+            order_id=event.order_id,
+            data=event.data,
+            user_agent=user_agent,
+            ip_address=ip_address,
+            created_at=min(max(occurred_at, oldest), now),
+        ))
+
+    try:
+        accepted = event_buffer.add(records)
+    except BufferFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many events queued, retry later",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    return AnalyticsEventAck(received=len(records), accepted=accepted)
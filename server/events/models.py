@@ -0,0 +1,68 @@
+from pydantic import BaseModel, validator
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+
+# Upper bound of the int4 id columns in analytics_events
+MAX_ID = 2**31 - 1
+
+def _has_nul(value: Any) -> bool:
+    """Whether a string anywhere in ``value`` contains NUL, which text and jsonb columns reject."""
+    if isinstance(value, str):
+        return "\x00" in value
+    if isinstance(value, dict):
+        return any(_has_nul(k) or _has_nul(v) for k, v in value.items())
+    if isinstance(value, list):
+        return any(_has_nul(item) for item in value)
+    return False
+
+class AnalyticsEvent(BaseModel):
+    event_type: str
+    session_id: Optional[str] = None
+    product_id: Optional[int] = None
+    category_id: Optional[int] = None
+    order_id: Optional[int] = None
+    data: Optional[Dict[str, Any]] = None
+    occurred_at: Optional[datetime] = None
+
+    @validator('event_type')
+    def validate_event_type(cls, v):
+        if not v or len(v) > 100:
+            raise ValueError('Event type must be 1 to 100 characters')
+        if _has_nul(v):
+            raise ValueError('Event type cannot contain NUL characters')
+        return v
+
+    @validator('session_id')
+    def validate_session_id(cls, v):
+        if v is not None and len(v) > 255:
+            raise ValueError('Session ID cannot be longer than 255 characters')
+        if _has_nul(v):
+            raise ValueError('Session ID cannot contain NUL characters')
+        return v
+
+    @validator('product_id', 'category_id', 'order_id')
+    def validate_ids(cls, v):
+        if v is not None and not 1 <= v <= MAX_ID:
+            raise ValueError(f'IDs must be between 1 and {MAX_ID}')
+        return v
+
+    @validator('data')
+    def validate_data(cls, v):
+        if v is not None and _has_nul(v):
+            raise ValueError('Event data cannot contain NUL characters')
+        return v
+
+class AnalyticsEventBatch(BaseModel):
+    events: List[AnalyticsEvent]
+
+    @validator('events')
+    def validate_events(cls, v):
+        if not v:
+            raise ValueError('At least one event is required')
+        if len(v) > 500:
+            raise ValueError('Cannot send more than 500 events at once')
+        return v
+
+class AnalyticsEventAck(BaseModel):
+    received: int
+    accepted: int
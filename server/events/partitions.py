@@ -0,0 +1,205 @@
+"""Daily partition maintenance for ``analytics_events``.
+
+``analytics_events`` is range-partitioned on ``created_at`` (see
+database/schema.sql). ``EventPartitions.maintain`` keeps one partition per
+UTC day from ``days_behind`` days ago (client timestamps are accepted up to
+a week old) to ``days_ahead`` days ahead, so writes do not fall through to
+the default partition. Rows that did land in the default partition are
+moved into the daily partition when it is created.
+
+Partitions that ended more than ``retention_days`` ago are dropped, which
+is a catalog change instead of a large ``DELETE``; with rollups bound, a
+partition is only dropped once every row in it has been counted into the
+hourly rollups. DDL waits at most ``lock_timeout`` seconds for its lock so a
+long report cannot stall event writes queued behind it; a timed-out step is
+retried on the next run.
+
+Only one worker maintains partitions at a time (a session advisory lock).
+"""
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PARENT = "analytics_events"
+DEFAULT_PARTITION = "analytics_events_default"
+PARTITION_PREFIX = "analytics_events_p"
+
+_LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext('analytics_partitions'))"
+_UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext('analytics_partitions'))"
+
+_IS_PARTITIONED_SQL = "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('analytics_events')"
+
+_PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'analytics_events'::regclass
+"""
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def partition_day(name: str) -> Optional[date]:
+    """The day a daily partition covers, or None for other partitions."""
+    if not name.startswith(PARTITION_PREFIX):
+        return None
+    try:
+        return datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def day_bounds(day: date):
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+class EventPartitions:
+    def __init__(self, days_ahead: int = 7, days_behind: int = 7, retention_days: int = 90,
+                 interval: float = 3600, lock_timeout: float = 5.0):
+        self.days_ahead = days_ahead
+        self.days_behind = days_behind
+        # Never drop a partition that is still inside the window being created
+        self.retention_days = max(retention_days, days_behind + 1)
+        self.interval = interval
+        self.lock_timeout = lock_timeout
+        self.pool = None
+        self.rollups = None
+        self._warned = False
+        self._counts = {
+            "runs": 0, "skipped_runs": 0, "partitions_created": 0, "partitions_dropped": 0,
+            "rows_moved": 0, "waiting_for_rollup": 0, "errors": 0,
+        }
+        self._last_run: Dict[str, Any] = {}
+
+    def bind(self, pool, rollups=None):
+        self.pool = pool
+        self.rollups = rollups
+
+    async def _set_lock_timeout(self, connection):
+        await connection.execute(f"SET LOCAL lock_timeout = '{int(self.lock_timeout * 1000)}ms'")
+
+    async def ensure_partition(self, connection, day: date) -> bool:
+        """Create the partition for ``day`` if it is missing; returns whether it was created."""
+        name = partition_name(day)
+        start, end = day_bounds(day)
+        bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        async with connection.transaction():
+            if await connection.fetchval("SELECT to_regclass($1) IS NOT NULL", name):
+                return False
+            await self._set_lock_timeout(connection)
+            stray = await connection.fetchval(
+                f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= $1 AND created_at < $2)",
+                start, end
+            )
+            if not stray:
+                await connection.execute(f"CREATE TABLE {name} PARTITION OF {PARENT} FOR VALUES {bounds}")
+                return True
+            # The default partition holds rows for this day: build the partition
+            # standalone with those rows, then attach it
+            await connection.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS)")
+            moved = await connection.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= $1 AND created_at < $2 RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            """, start, end)
+            await connection.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES {bounds}")
+        rows = int(moved.split()[-1])
+        self._counts["rows_moved"] += rows
+        logger.info(f"Moved {rows} analytics events from the default partition into {name}")
+        return True
+
+    async def ensure_range(self, connection, first: date, last: date) -> List[str]:
+        """Create every missing daily partition from ``first`` to ``last`` inclusive."""
+        created = []
+        day = first
+        while day <= last:
+            if await self.ensure_partition(connection, day):
+                created.append(partition_name(day))
+            day += timedelta(days=1)
+        return created
+
+    async def _drop_expired(self, connection, today: date) -> List[str]:
+        cutoff = today - timedelta(days=self.retention_days)
+        watermark = await self.rollups.watermark(connection) if self.rollups is not None else None
+        dropped = []
+        for row in await connection.fetch(_PARTITIONS_SQL):
+            name = row["relname"]
+            day = partition_day(name)
+            if day is None or day >= cutoff:
+                continue
+            if watermark is not None:
+                last_id = await connection.fetchval(f"SELECT MAX(id) FROM {name}")
+                if last_id is not None and last_id > watermark:
+                    self._counts["waiting_for_rollup"] += 1
+                    continue
+            async with connection.transaction():
+                await self._set_lock_timeout(connection)
+                await connection.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+
+        start, _ = day_bounds(cutoff)
+        if watermark is None:
+            await connection.execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at < $1", start)
+        else:
+            await connection.execute(
+                f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at < $1 AND id <= $2", start, watermark
+            )
+        return dropped
+
+    async def maintain(self) -> Dict[str, Any]:
+        """Create upcoming partitions and drop expired ones; returns what this run did."""
+        if not self.pool:
+            return {}
+        async with self.pool.acquire() as connection:
+            if not await connection.fetchval(_IS_PARTITIONED_SQL):
+                if not self._warned:
+                    logger.warning("analytics_events is not partitioned; "
+                                   "run scripts/partition_analytics_events.py to convert it")
+                    self._warned = True
+                self._counts["skipped_runs"] += 1
+                return {}
+            if not await connection.fetchval(_LOCK_SQL):
+                self._counts["skipped_runs"] += 1
+                return {}
+            try:
+                today = datetime.now(timezone.utc).date()
+                created = await self.ensure_range(
+                    connection, today - timedelta(days=self.days_behind), today + timedelta(days=self.days_ahead)
+                )
+                dropped = await self._drop_expired(connection, today)
+            finally:
+                await connection.fetchval(_UNLOCK_SQL)
+
+        self._counts["runs"] += 1
+        self._counts["partitions_created"] += len(created)
+        self._counts["partitions_dropped"] += len(dropped)
+        self._last_run = {"at": datetime.now(timezone.utc).isoformat(), "created": created, "dropped": dropped}
+        if created or dropped:
+            logger.info(f"Analytics partitions: created {len(created)}, dropped {len(dropped)}")
+        return self._last_run
+
+    async def run(self):
+        """Maintain partitions every ``interval`` seconds until cancelled."""
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                self._counts["errors"] += 1
+                logger.error(f"Analytics partition maintenance failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "days_ahead": self.days_ahead,
+            "retention_days": self.retention_days,
+            "interval_s": self.interval,
+            "last_run": self._last_run,
+            **self._counts,
+        }
@@ -0,0 +1,158 @@
+"""Incremental hourly rollups of ``analytics_events``.
+
+``analytics_hourly_rollups`` holds event counts per UTC hour, event type,
+product and category, which is what dashboards read instead of scanning
+raw events. ``HourlyRollups.refresh`` only folds in events added since its
+last run: ``analytics_rollup_state`` records the last event id counted, and
+the next run reads ids above it through each partition's ``(id,
+created_at)`` primary key, so partitions without new rows cost one index
+probe. A late event (client timestamps may be up to a week old) is added to
+the hour it happened in.
+
+Ids come from a sequence, so a write still in progress can commit a lower
+id after a higher one is visible. The upper bound of a run is therefore
+read under a brief ``EXCLUSIVE`` lock on ``analytics_events``, which waits
+for in-flight writes to finish (reads are not blocked); every id at or
+below it is committed. If the lock is not granted within ``lock_timeout``
+seconds the run is skipped rather than holding up the writers queued
+behind it.
+
+Only one worker refreshes at a time (a session advisory lock).
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = "hourly"
+
+_LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext('analytics_rollups'))"
+_UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext('analytics_rollups'))"
+
+_STATE_SQL = """
+    INSERT INTO analytics_rollup_state (name) VALUES ($1)
+    ON CONFLICT (name) DO NOTHING
+"""
+
+_WATERMARK_SQL = "SELECT last_event_id FROM analytics_rollup_state WHERE name = $1"
+
+_UPPER_BOUND_SQL = """
+    SELECT COALESCE(pg_sequence_last_value(pg_get_serial_sequence('analytics_events', 'id')::regclass), 0)
+"""
+
+# Ids are sparse (rolled back writes, cleanups), so batches end at the
+# batch_size-th id rather than a fixed id range
+_BATCH_END_SQL = """
+    SELECT id FROM analytics_events WHERE id > $1 AND id <= $2 ORDER BY id OFFSET $3 - 1 LIMIT 1
+"""
+
+# Folds events with $1 < id <= $2 into the rollup; returns events and rollup rows touched
+_ROLLUP_SQL = """
+    WITH counts AS (
+        SELECT date_trunc('hour', e.created_at, 'UTC') AS hour, e.event_type, e.product_id,
+               COALESCE(e.category_id, p.category_id) AS category_id, COUNT(*) AS events
+        FROM analytics_events e
+        LEFT JOIN products p ON p.id = e.product_id
+        WHERE e.id > $1 AND e.id <= $2
+        GROUP BY 1, 2, 3, 4
+    ), merged AS (
+        INSERT INTO analytics_hourly_rollups AS r (hour, event_type, product_id, category_id, events)
+        SELECT hour, event_type, product_id, category_id, events FROM counts
+        ON CONFLICT (hour, event_type, product_id, category_id)
+        DO UPDATE SET events = r.events + EXCLUDED.events
+        RETURNING 1
+    )
+    SELECT (SELECT COALESCE(SUM(events), 0)::bigint FROM counts) AS events, (SELECT COUNT(*) FROM merged) AS rows
+"""
+
+_ADVANCE_SQL = """
+    UPDATE analytics_rollup_state SET last_event_id = $2, updated_at = CURRENT_TIMESTAMP
+    WHERE name = $1
+"""
+
+
+class HourlyRollups:
+    def __init__(self, interval: float = 60, batch_size: int = 100000, lock_timeout: float = 1.0):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock_timeout = lock_timeout
+        self.pool = None
+        self._counts = {
+            "runs": 0, "skipped_runs": 0, "lock_timeouts": 0, "events_counted": 0, "rollup_rows": 0, "errors": 0,
+        }
+        self._last_run: Dict[str, Any] = {}
+
+    def bind(self, pool):
+        self.pool = pool
+
+    async def watermark(self, connection) -> int:
+        """Highest event id already counted."""
+        return await connection.fetchval(_WATERMARK_SQL, ROLLUP_NAME) or 0
+
+    async def _upper_bound(self, connection) -> Optional[int]:
+        try:
+            async with connection.transaction():
+                await connection.execute(f"SET LOCAL lock_timeout = '{int(self.lock_timeout * 1000)}ms'")
+                await connection.execute("LOCK TABLE analytics_events IN EXCLUSIVE MODE")
+                return await connection.fetchval(_UPPER_BOUND_SQL)
+        except asyncpg.LockNotAvailableError:
+            self._counts["lock_timeouts"] += 1
+            return None
+
+    async def refresh(self) -> Dict[str, Any]:
+        """Count every event committed since the last run; returns what this run did."""
+        if not self.pool:
+            return {}
+        async with self.pool.acquire() as connection:
+            if not await connection.fetchval(_LOCK_SQL):
+                self._counts["skipped_runs"] += 1
+                return {}
+            try:
+                await connection.execute(_STATE_SQL, ROLLUP_NAME)
+                last_id = await self.watermark(connection)
+                upper = await self._upper_bound(connection)
+                if upper is None:
+                    return {}
+                events = rows = 0
+                while last_id < upper:
+                    stop = await connection.fetchval(_BATCH_END_SQL, last_id, upper, self.batch_size) or upper
+                    async with connection.transaction():
+                        batch = await connection.fetchrow(_ROLLUP_SQL, last_id, stop)
+                        await connection.execute(_ADVANCE_SQL, ROLLUP_NAME, stop)
+                    events += batch["events"]
+                    rows += batch["rows"]
+                    last_id = stop
+            finally:
+                await connection.fetchval(_UNLOCK_SQL)
+
+        self._counts["runs"] += 1
+        self._counts["events_counted"] += events
+        self._counts["rollup_rows"] += rows
+        self._last_run = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "events": events,
+            "rollup_rows": rows,
+            "last_event_id": last_id,
+        }
+        return self._last_run
+
+    async def run(self):
+        """Refresh every ``interval`` seconds until cancelled."""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self._counts["errors"] += 1
+                logger.error(f"Analytics rollup failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_s": self.interval,
+            "last_run": self._last_run,
+            **self._counts,
+        }
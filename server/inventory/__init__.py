@@ -0,0 +1 @@
+"""Stock reservations for carts."""
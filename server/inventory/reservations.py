@@ -0,0 +1,346 @@
+"""Redis stock reservations: short holds on stock for items sitting in carts.
+
+Per product, Redis keeps the stock level mirrored from Postgres and the total
+currently held; each cart line holds its quantity for ``hold_ttl`` seconds:
+
+    inv:stock:{pid}     stock_quantity (-1 when the product does not track stock)
+    inv:reserved:{pid}  sum of active holds
+    inv:held:{pid}      hash user_id -> quantity held
+    inv:version:{pid}   id of the latest inventory_movements row the level reflects
+    inv:user:{uid}      set of product IDs the user holds
+    inv:expiry          zset "{pid}:{uid}" -> hold expiry (ms)
+
+Holding, releasing and committing are single Lua calls, so availability
+checks are atomic across workers and never lock a Postgres row. Holds are
+admission control for carts; checkout still re-checks stock under its row
+locks.
+
+Reconciliation: a checkout stores the stock level it left behind once it
+commits. A background loop releases expired holds and re-reads
+``stock_quantity`` for products with new ``inventory_movements`` rows and,
+every few cycles, for every product loaded in Redis. Both writes carry the
+product's latest movement id (read in the same snapshot as the level, and
+increasing per product because sales hold the product row lock), and a
+level older than the one stored is ignored. So a re-read that raced a
+checkout can neither undo its sale nor count it twice.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_KEY = "inv:expiry"
+LOADED_KEY = "inv:loaded"
+
+# KEYS[1] stock, KEYS[2] reserved, KEYS[3] held hash, KEYS[4] expiry zset, KEYS[5] user set
+# ARGV: user_id, product_id, quantity to hold, expires_at (ms)
+# Returns {status, available, previous}; status -1 stock not loaded, 0 denied
+# (available is then the most this user could hold), 1 held
+_HOLD = """
+local stock = redis.call('GET', KEYS[1])
+if not stock then
+    return {-1, 0, 0}
+end
+stock = tonumber(stock)
+local member = ARGV[2] .. ':' .. ARGV[1]
+local current = tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0')
+local reserved = tonumber(redis.call('GET', KEYS[2]) or '0')
+local target = tonumber(ARGV[3])
+local delta = target - current
+if stock >= 0 and delta > 0 and reserved + delta > stock then
+    return {0, math.max(stock - reserved + current, 0), current}
+end
+if target > 0 then
+    redis.call('HSET', KEYS[3], ARGV[1], target)
+    redis.call('ZADD', KEYS[4], ARGV[4], member)
+    redis.call('SADD', KEYS[5], ARGV[2])
+else
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    redis.call('ZREM', KEYS[4], member)
+    redis.call('SREM', KEYS[5], ARGV[2])
+end
+redis.call('INCRBY', KEYS[2], delta)
+return {1, stock - reserved - delta, current}
+"""
+
+# KEYS[1] reserved, KEYS[2] held hash, KEYS[3] expiry zset, KEYS[4] user set
+# ARGV: user_id, product_id, expired_before (ms; empty releases unconditionally)
+# Returns the quantity released
+_RELEASE = """
+local member = ARGV[2] .. ':' .. ARGV[1]
+if ARGV[3] ~= '' then
+    local expires = redis.call('ZSCORE', KEYS[3], member)
+    if expires and tonumber(expires) > tonumber(ARGV[3]) then
+        return 0
+    end
+end
+local held = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+if held > 0 then
+    redis.call('DECRBY', KEYS[1], held)
+end
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], member)
+redis.call('SREM', KEYS[4], ARGV[2])
+return held
+"""
+
+# A checkout committed: store the stock it left (if newer) and take the sold
+# quantity off the user's hold; a line that grew during checkout keeps the rest.
+# KEYS[1] stock, KEYS[2] version, then as _RELEASE
+# ARGV: user_id, product_id, stock after the sale, its movement id ('' when stock is not tracked), quantity sold
+_COMMIT = """
+if ARGV[4] ~= '' and tonumber(redis.call('GET', KEYS[2]) or '0') < tonumber(ARGV[4]) then
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('SET', KEYS[1], math.max(tonumber(ARGV[3]), 0))
+    end
+    redis.call('SET', KEYS[2], ARGV[4])
+end
+local member = ARGV[2] .. ':' .. ARGV[1]
+local held = tonumber(redis.call('HGET', KEYS[4], ARGV[1]) or '0')
+local released = math.min(held, tonumber(ARGV[5]))
+if released > 0 then
+    redis.call('DECRBY', KEYS[3], released)
+end
+if held > released then
+    redis.call('HSET', KEYS[4], ARGV[1], held - released)
+else
+    redis.call('HDEL', KEYS[4], ARGV[1])
+    redis.call('ZREM', KEYS[5], member)
+    redis.call('SREM', KEYS[6], ARGV[2])
+end
+return released
+"""
+
+# KEYS[1] stock, KEYS[2] version, KEYS[3] loaded set
+# ARGV: latest movement id when the stock was read, stock_quantity, product_id
+# Returns 1 if stored, 0 if a newer level is already mirrored
+_REFRESH = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2])
+redis.call('SET', KEYS[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[3])
+return 1
+"""
+
+# The level and the latest movement come from one snapshot
+_STOCK_SQL = """
+    SELECT p.id, CASE WHEN p.track_stock THEN p.stock_quantity ELSE -1 END AS stock,
+           COALESCE((SELECT MAX(m.id) FROM inventory_movements m WHERE m.product_id = p.id), 0) AS version
+    FROM products p
+    WHERE p.id = ANY($1::int[])
+"""
+
+_MOVED_SQL = """
+    SELECT COALESCE(MAX(id), $1) AS last_id, COALESCE(array_agg(DISTINCT product_id), '{}') AS product_ids
+    FROM inventory_movements
+    WHERE id > $1
+"""
+
+
+def _stock_key(product_id) -> str:
+    return f"inv:stock:{product_id}"
+
+
+def _reserved_key(product_id) -> str:
+    return f"inv:reserved:{product_id}"
+
+
+def _held_key(product_id) -> str:
+    return f"inv:held:{product_id}"
+
+
+def _version_key(product_id) -> str:
+    return f"inv:version:{product_id}"
+
+
+def _user_key(user_id) -> str:
+    return f"inv:user:{user_id}"
+
+
+class Hold(NamedTuple):
+    granted: bool
+    available: int  # stock left after the hold (if granted) or the most this user could hold
+    previous: int   # quantity the user held before
+
+
+class InventoryReservations:
+    def __init__(self, enabled: bool = False, hold_ttl: int = 900, reconcile_interval: float = 10.0,
+                 full_reconcile_every: int = 6, batch_size: int = 500):
+        self.configured = enabled
+        self.hold_ttl = hold_ttl
+        self.reconcile_interval = reconcile_interval
+        self.full_reconcile_every = full_reconcile_every
+        self.batch_size = batch_size
+        self.redis = None
+        self.pool = None
+        self._hold = self._release = self._commit = self._refresh = None
+        self._last_movement_id: Optional[int] = None
+        self._cycles = 0
+        self._counts = {
+            "granted": 0, "denied": 0, "released": 0, "expired": 0, "committed": 0,
+            "refreshed": 0, "corrections": 0, "stale_refreshes": 0,
+        }
+
+    def bind(self, redis_client, pool):
+        self.redis = redis_client
+        self.pool = pool
+        if redis_client:
+            self._hold = redis_client.register_script(_HOLD)
+            self._release = redis_client.register_script(_RELEASE)
+            self._commit = redis_client.register_script(_COMMIT)
+            self._refresh = redis_client.register_script(_REFRESH)
+
+    @property
+    def enabled(self) -> bool:
+        return self.configured and self.redis is not None and self.pool is not None
+
+    async def _load(self, product_ids: List[int]) -> Dict[int, int]:
+        """Mirror ``stock_quantity`` for ``product_ids``; returns {product_id: stock} as read."""
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch(_STOCK_SQL, product_ids)
+        stock = {row["id"]: row["stock"] for row in rows}
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for row in rows:
+                pipe.get(_stock_key(row["id"]))
+                await self._refresh(
+                    keys=[_stock_key(row["id"]), _version_key(row["id"]), LOADED_KEY],
+                    args=[row["version"], row["stock"], row["id"]],
+                    client=pipe,
+                )
+            results = await pipe.execute()
+
+        loaded = [row["id"] for row in rows]
+        for product_id, mirrored, stored in zip(loaded, results[0::2], results[1::2]):
+            if not stored:
+                self._counts["stale_refreshes"] += 1
+                continue
+            self._counts["refreshed"] += 1
+            if mirrored is not None and int(mirrored) != stock[product_id]:
+                self._counts["corrections"] += 1
+        return stock
+
+    async def hold(self, user_id: int, product_id: int, quantity: int) -> Optional[Hold]:
+        """Set the user's hold on a product to ``quantity`` (0 releases it).
+
+        Returns None for an unknown product.
+        """
+        keys = [_stock_key(product_id), _reserved_key(product_id), _held_key(product_id), EXPIRY_KEY, _user_key(user_id)]
+        args = [user_id, product_id, quantity, int((time.time() + self.hold_ttl) * 1000)]
+        for _ in range(3):
+            result = await self._hold(keys=keys, args=args)
+            if int(result[0]) != -1:
+                break
+            # Not mirrored yet; a refresh older than a concurrent checkout is skipped, so retry
+            if product_id not in await self._load([product_id]):
+                return None
+        status, available, previous = (int(value) for value in result)
+        if status == -1:
+            return None
+        self._counts["granted" if status == 1 else "denied"] += 1
+        return Hold(status == 1, available, previous)
+
+    async def release(self, user_id: int, product_id: int) -> int:
+        released = await self._release(
+            keys=[_reserved_key(product_id), _held_key(product_id), EXPIRY_KEY, _user_key(user_id)],
+            args=[user_id, product_id, ""],
+        )
+        self._counts["released"] += 1 if released else 0
+        return int(released)
+
+    async def release_all(self, user_id: int) -> int:
+        """Release every hold the user has (cart cleared or replaced)."""
+        product_ids = await self.redis.smembers(_user_key(user_id))
+        for product_id in product_ids:
+            await self.release(user_id, int(product_id))
+        return len(product_ids)
+
+    async def commit(self, user_id: int, sold: Dict[int, int], levels: Dict[int, Tuple[int, int]]):
+        """Record a committed checkout: mirror the stock it left and release the sold quantities.
+
+        Holds on products that were not in the order are left alone.
+        ``levels`` is ``{product_id: (stock_quantity, movement_id)}`` as written
+        by the checkout; products that do not track stock are absent.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for product_id, quantity in sold.items():
+                stock, movement_id = levels.get(product_id, ("", ""))
+                await self._commit(
+                    keys=[_stock_key(product_id), _version_key(product_id), _reserved_key(product_id),
+                          _held_key(product_id), EXPIRY_KEY, _user_key(user_id)],
+                    args=[user_id, product_id, stock, movement_id, quantity],
+                    client=pipe,
+                )
+            await pipe.execute()
+        self._counts["committed"] += len(sold)
+
+    async def release_expired(self) -> int:
+        """Release holds past their expiry, one batch at a time."""
+        released = 0
+        while True:
+            now_ms = int(time.time() * 1000)
+            members = await self.redis.zrangebyscore(EXPIRY_KEY, "-inf", now_ms, start=0, num=self.batch_size)
+            if not members:
+                break
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for member in members:
+                    product_id, user_id = member.split(":", 1)
+                    await self._release(
+                        keys=[_reserved_key(product_id), _held_key(product_id), EXPIRY_KEY, _user_key(user_id)],
+                        args=[user_id, product_id, now_ms],
+                        client=pipe,
+                    )
+                await pipe.execute()
+            released += len(members)
+            if len(members) < self.batch_size:
+                break
+        self._counts["expired"] += released
+        return released
+
+    async def _moved_products(self) -> List[int]:
+        """Products with new ``inventory_movements`` since the last check."""
+        async with self.pool.acquire() as connection:
+            if self._last_movement_id is None:
+                self._last_movement_id = await connection.fetchval("SELECT COALESCE(MAX(id), 0) FROM inventory_movements")
+                return []
+            row = await connection.fetchrow(_MOVED_SQL, self._last_movement_id)
+        self._last_movement_id = row["last_id"]
+        return list(row["product_ids"])
+
+    async def reconcile(self, full: bool = False) -> int:
+        """Re-read stock for moved products, or for every loaded product when ``full``."""
+        loaded = {int(product_id) for product_id in await self.redis.smembers(LOADED_KEY)}
+        moved = await self._moved_products()
+        product_ids = sorted(loaded if full else loaded.intersection(moved))
+        for start in range(0, len(product_ids), self.batch_size):
+            await self._load(product_ids[start:start + self.batch_size])
+        return len(product_ids)
+
+    async def run(self):
+        """Expire holds and reconcile stock every ``reconcile_interval`` seconds until cancelled."""
+        while True:
+            try:
+                await self.release_expired()
+                self._cycles += 1
+                await self.reconcile(full=self._cycles % self.full_reconcile_every == 0)
+            except Exception as e:
+                logger.error(f"Inventory reservation loop error: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    async def stats(self) -> Dict[str, Any]:
+        holds: Any = None
+        if self.enabled:
+            try:
+                holds = await self.redis.zcard(EXPIRY_KEY)
+            except Exception as e:
+                holds = {"error": str(e)}
+        return {
+            "enabled": self.enabled,
+            "active_holds": holds,
+            "hold_ttl_s": self.hold_ttl,
+            **self._counts,
+        }
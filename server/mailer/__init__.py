@@ -0,0 +1 @@
+"""Outbound email: durable queue and SMTP delivery."""
@@ -0,0 +1,158 @@
+"""Durable outbound mail queue on a Redis stream.
+
+Request handlers only ``XADD`` to ``mail:outbox`` and return. A worker loop
+reads batches through a consumer group, hands each batch to the sender (one
+SMTP connection per batch, reused across batches), then acknowledges it.
+Failed messages are rescheduled on ``mail:retry`` (a sorted set scored by
+due time) with exponential backoff and moved to the ``mail:dead`` stream
+after ``max_attempts``. Entries left pending by a crashed worker are
+reclaimed with XAUTOCLAIM, so nothing is lost on restart.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_STREAM = "mail:outbox"
+RETRY_SET = "mail:retry"
+DEAD_STREAM = "mail:dead"
+CONSUMER_GROUP = "mailers"
+
+# Move retries that are due back onto the outbox stream.
+# KEYS[1] retry zset, KEYS[2] outbox stream; ARGV: now, limit
+_PROMOTE_DUE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, payload in ipairs(due) do
+    redis.call('ZREM', KEYS[1], payload)
+    local fields = {}
+    for key, value in pairs(cjson.decode(payload)) do
+        table.insert(fields, key)
+        table.insert(fields, tostring(value))
+    end
+    redis.call('XADD', KEYS[2], '*', unpack(fields))
+end
+return #due
+"""
+
+
+class MailQueue:
+    def __init__(self, sender, batch_size: int = 50, max_attempts: int = 5, base_backoff: float = 30.0,
+                 claim_idle_ms: int = 60000, max_stream_length: int = 100000):
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.claim_idle_ms = claim_idle_ms
+        self.max_stream_length = max_stream_length
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.redis = None
+        self._promote = None
+        self._counts = {"enqueued": 0, "sent": 0, "retried": 0, "dead_lettered": 0, "batches": 0}
+
+    def bind(self, redis_client):
+        self.redis = redis_client
+        self._promote = redis_client.register_script(_PROMOTE_DUE) if redis_client else None
+
+    async def enqueue(self, to: str, subject: str, body: str, html: Optional[str] = None, kind: str = "mail") -> str:
+        """Queue a message for delivery; returns the stream entry ID."""
+        fields = {"to": to, "subject": subject, "body": body, "kind": kind, "attempts": "0"}
+        if html:
+            fields["html"] = html
+        message_id = await self.redis.xadd(OUTBOX_STREAM, fields, maxlen=self.max_stream_length, approximate=True)
+        self._counts["enqueued"] += 1
+        return message_id
+
+    async def _ensure_group(self):
+        try:
+            await self.redis.xgroup_create(OUTBOX_STREAM, CONSUMER_GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _next_batch(self) -> List[Tuple[str, Dict[str, str]]]:
+        # Reclaim entries a dead worker read but never acknowledged
+        claimed = await self.redis.xautoclaim(
+            OUTBOX_STREAM, CONSUMER_GROUP, self.consumer,
+            min_idle_time=self.claim_idle_ms, start_id="0-0", count=self.batch_size
+        )
+        entries = [entry for entry in claimed[1] if entry[1]]
+        if entries:
+            return entries
+
+        response = await self.redis.xreadgroup(
+            CONSUMER_GROUP, self.consumer, {OUTBOX_STREAM: ">"}, count=self.batch_size, block=5000
+        )
+        return response[0][1] if response else []
+
+    async def _settle(self, entries: List[Tuple[str, Dict[str, str]]], results: List[Optional[str]]):
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for (entry_id, fields), error in zip(entries, results):
+                if error is None:
+                    self._counts["sent"] += 1
+                else:
+                    attempts = int(fields.get("attempts", "0")) + 1
+                    failed = {**fields, "attempts": str(attempts), "last_error": error[:500]}
+                    if attempts >= self.max_attempts:
+                        logger.error(f"Mail to {fields.get('to')} dead-lettered after {attempts} attempts: {error}")
+                        pipe.xadd(DEAD_STREAM, failed, maxlen=self.max_stream_length, approximate=True)
+                        self._counts["dead_lettered"] += 1
+                    else:
+                        delay = self.base_backoff * (2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                        pipe.zadd(RETRY_SET, {json.dumps(failed, sort_keys=True): now + delay})
+                        self._counts["retried"] += 1
+                pipe.xack(OUTBOX_STREAM, CONSUMER_GROUP, entry_id)
+                pipe.xdel(OUTBOX_STREAM, entry_id)
+            await pipe.execute()
+
+    async def process_batch(self) -> int:
+        """Promote due retries, then deliver and settle one batch; returns its size."""
+        await self._promote(keys=[RETRY_SET, OUTBOX_STREAM], args=[time.time(), self.batch_size])
+        entries = await self._next_batch()
+        if not entries:
+            return 0
+        results = await self.sender.send_batch([fields for _, fields in entries])
+        await self._settle(entries, results)
+        self._counts["batches"] += 1
+        return len(entries)
+
+    async def run(self):
+        """Deliver queued mail until cancelled."""
+        await self._ensure_group()
+        logger.info(f"✅ Mail worker {self.consumer} started")
+        try:
+            while True:
+                try:
+                    await self.process_batch()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Mail worker error: {e}")
+                    await asyncio.sleep(1)
+        finally:
+            await self.sender.close()
+
+    async def stats(self) -> Dict[str, Any]:
+        backlog: Dict[str, Any] = {}
+        if self.redis:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.xlen(OUTBOX_STREAM)
+                    pipe.zcard(RETRY_SET)
+                    pipe.xlen(DEAD_STREAM)
+                    outbox, retry, dead = await pipe.execute()
+                backlog = {"outbox": outbox, "retry": retry, "dead": dead}
+            except Exception as e:
+                backlog = {"error": str(e)}
+        return {
+            "consumer": self.consumer,
+            "smtp_connections_opened": self.sender.connections_opened,
+            "backlog": backlog,
+            **self._counts,
+        }
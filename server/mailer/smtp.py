@@ -0,0 +1,118 @@
+"""SMTP delivery that sends a whole batch over one reused connection.
+
+smtplib is blocking, so every call runs on a dedicated single thread; that
+also keeps the connection confined to one thread between batches. For local
+testing point SMTP_HOST/SMTP_PORT at an aiosmtpd sink:
+
+    python -m aiosmtpd -n -l localhost:8025
+"""
+import asyncio
+import logging
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def build_message(from_address: str, fields: Dict[str, str]) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = from_address
+    message["To"] = fields["to"]
+    message["Subject"] = fields["subject"]
+    message.set_content(fields.get("body", ""))
+    if fields.get("html"):
+        message.add_alternative(fields["html"], subtype="html")
+    return message
+
+
+class SMTPSender:
+    def __init__(self, host: str, port: int = 587, from_address: str = "no-reply@localhost",
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 starttls: bool = False, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.from_address = from_address
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._connection: Optional[smtplib.SMTP] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+        self.connections_opened = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password or "")
+        self.connections_opened += 1
+        return connection
+
+    def _live_connection(self) -> smtplib.SMTP:
+        if self._connection is not None:
+            try:
+                if self._connection.noop()[0] == 250:
+                    return self._connection
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close()
+        self._connection = self._connect()
+        return self._connection
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._connection = None
+
+    def _send_batch(self, batch: List[Dict[str, str]]) -> List[Optional[str]]:
+        """Send each message, returning None or an error string per message."""
+        try:
+            connection = self._live_connection()
+        except (smtplib.SMTPException, OSError) as e:
+            return [f"connect failed: {e}"] * len(batch)
+
+        results: List[Optional[str]] = []
+        for fields in batch:
+            try:
+                connection.send_message(build_message(self.from_address, fields))
+                results.append(None)
+            except smtplib.SMTPRecipientsRefused as e:
+                results.append(f"recipient refused: {e}")
+            except (smtplib.SMTPException, OSError) as e:
+                # The connection is unusable; fail the rest of the batch so
+                # it is retried on a fresh connection.
+                self._close()
+                results.extend([f"send failed: {e}"] * (len(batch) - len(results)))
+                break
+        return results
+
+    async def send_batch(self, batch: List[Dict[str, str]]) -> List[Optional[str]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._send_batch, batch)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=False)
+
+
+class LoggingSender:
+    """Stand-in used when no SMTP_HOST is configured; logs instead of sending."""
+
+    connections_opened = 0
+
+    async def send_batch(self, batch: List[Dict[str, str]]) -> List[Optional[str]]:
+        for fields in batch:
+            logger.info(f"📧 [{fields.get('kind', 'mail')}] to {fields['to']}: {fields['subject']}")
+        return [None] * len(batch)
+
+    async def close(self):
+        pass
@@ -5,21 +5,40 @@ from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import JSONResponse
 from fastapi.openapi.utils import get_openapi
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
 import asyncpg
 import redis.asyncio as redis
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import os
+import asyncio
+import secrets
+import time
 from dotenv import load_dotenv
 import logging
 from contextlib import asynccontextmanager
 
+from auth.hash_policy import build_crypt_context
+from auth.password_hasher import PasswordHasher, PasswordHasherBusy
+from auth.principal_cache import PrincipalCache
+from auth.sessions import SessionStore, new_session_id
+from auth.token_cache import InvalidToken, VerifiedTokenCache, load_jwt_backend
+from cart.pricing import DiscountRuleCache
+from cart.snapshots import CartSnapshotCache
+from cart.summary import CartSummaryCounters
+from cart.sweeper import AbandonedCartSweeper
+from cart.store import CartStore, CartUnsupported
+from database.write_behind import UserTouchBuffer
+from events.buffer import EventBuffer
+from events.partitions import EventPartitions
+from events.rollups import HourlyRollups
+from inventory.reservations import InventoryReservations
+from mailer.queue import MailQueue
+from promos.active import ActivePromoCache
+from promos.badges import PromoBadgeIndex
+from promos.usage import DiscountUsageCounters
+from mailer.smtp import LoggingSender, SMTPSender
+from ratelimit.limiter import RateLimiter
+
 # Load environment variables
 load_dotenv()
 
@@ -29,20 +48,163 @@ logger = logging.getLogger(__name__)
 
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = build_crypt_context()
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_queue=int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+)
 
-# Rate limiting
-limiter = Limiter(key_func=get_remote_address)
+# Rate limiting (shared by every router; Redis-backed once the client is bound)
+limiter = RateLimiter(lease_fraction=float(os.getenv("RATE_LIMIT_LEASE_FRACTION", "0.1")))
 
 # JWT settings
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+JWT_BACKEND, jwt_encode, jwt_decode = load_jwt_backend(os.getenv("JWT_BACKEND", "jose"))
+
+# Verified access tokens are cached by digest until they expire
+token_cache = VerifiedTokenCache(
+    jwt_decode,
+    SECRET_KEY,
+    [ALGORITHM],
+    max_entries=int(os.getenv("JWT_CACHE_MAX_ENTRIES", "50000")),
+    max_token_lifetime=REFRESH_TOKEN_EXPIRE_DAYS * 86400
+)
+
+# Refresh-token sessions, one entry per device
+session_store = SessionStore(
+    session_ttl=REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+    max_sessions=int(os.getenv("SESSION_MAX_PER_USER", "10"))
+)
+
+# Principal resolution. With AUTH_TRUST_TOKEN_CLAIMS the profile fields are
+# signed into the access token and get_current_user skips the lookup entirely;
+# those claims can lag a profile change by up to ACCESS_TOKEN_EXPIRE_MINUTES.
+TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() == "true"
+PRINCIPAL_CLAIMS = ("email", "first_name", "last_name", "email_verified")
+principal_cache = PrincipalCache(
+    local_ttl=float(os.getenv("PRINCIPAL_CACHE_LOCAL_TTL", "15")),
+    redis_ttl=int(os.getenv("PRINCIPAL_CACHE_REDIS_TTL", "300")),
+    max_entries=int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+)
+
+# Buffered last_login (and similar) updates, flushed in batches
+user_touch_buffer = UserTouchBuffer(
+    flush_interval=float(os.getenv("USER_TOUCH_FLUSH_INTERVAL", "5")),
+    max_pending=int(os.getenv("USER_TOUCH_MAX_PENDING", "5000"))
+)
+
+# Analytics events from POST /api/events, buffered and written with COPY
+event_buffer = EventBuffer(
+    batch_size=int(os.getenv("EVENTS_BATCH_SIZE", "5000")),
+    flush_interval=float(os.getenv("EVENTS_FLUSH_INTERVAL", "1")),
+    max_pending=int(os.getenv("EVENTS_MAX_PENDING", "100000"))
+)
+
+# Hourly event counts for dashboards, folded in from new events only
+event_rollups = HourlyRollups(
+    interval=float(os.getenv("ANALYTICS_ROLLUP_INTERVAL", "60")),
+    batch_size=int(os.getenv("ANALYTICS_ROLLUP_BATCH_SIZE", "100000"))
+)
+ANALYTICS_ROLLUPS_ENABLED = os.getenv("ANALYTICS_ROLLUPS_ENABLED", "true").lower() == "true"
+
+# Daily analytics_events partitions, created ahead and dropped (once rolled
+# up) after the retention period
+event_partitions = EventPartitions(
+    days_ahead=int(os.getenv("ANALYTICS_PARTITION_DAYS_AHEAD", "7")),
+    retention_days=int(os.getenv("ANALYTICS_RETENTION_DAYS", "90")),
+    interval=float(os.getenv("ANALYTICS_PARTITION_INTERVAL", "3600"))
+)
+
+# Outbound email (queued on a Redis stream, delivered by a worker loop)
+if os.getenv("SMTP_HOST"):
+    mail_sender = SMTPSender(
+        host=os.getenv("SMTP_HOST"),
+        port=int(os.getenv("SMTP_PORT", "587")),
+        from_address=os.getenv("MAIL_FROM", "no-reply@betterbeing.co.za"),
+        username=os.getenv("SMTP_USERNAME"),
+        password=os.getenv("SMTP_PASSWORD"),
+        starttls=os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+    )
+else:
+    mail_sender = LoggingSender()
+mail_queue = MailQueue(
+    mail_sender,
+    batch_size=int(os.getenv("MAIL_BATCH_SIZE", "50")),
+    max_attempts=int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+)
+MAIL_WORKER_ENABLED = os.getenv("MAIL_WORKER_ENABLED", "true").lower() == "true"
+
+# Carts: CART_STORE=redis serves them from Redis hashes and writes cart_items
+# behind; the default keeps Postgres as the only store.
+cart_store = CartStore(
+    mode=os.getenv("CART_STORE", "postgres").lower(),
+    key_ttl=int(os.getenv("CART_REDIS_TTL_DAYS", "30")) * 86400,
+    flush_interval=float(os.getenv("CART_FLUSH_INTERVAL", "2")),
+    batch_size=int(os.getenv("CART_FLUSH_BATCH_SIZE", "500")),
+    checkout_lock_ttl=float(os.getenv("CART_CHECKOUT_LOCK_TTL", "60"))
+)
+
+# In-process discount code index, refreshed by discount_codes triggers
+discount_rules = DiscountRuleCache(
+    ttl=float(os.getenv("DISCOUNT_RULE_CACHE_TTL", "30")),
+    max_entries=int(os.getenv("DISCOUNT_RULE_CACHE_MAX_ENTRIES", "1000"))
+)
+
+# Discount usage limits taken atomically in Redis at checkout; used_count is
+# flushed in batches. Off by default: checkout then locks the discount row.
+discount_usage = DiscountUsageCounters(
+    enabled=os.getenv("DISCOUNT_USAGE_COUNTERS", "false").lower() == "true",
+    reservation_ttl=int(os.getenv("DISCOUNT_RESERVATION_TTL", "300")),
+    flush_interval=float(os.getenv("DISCOUNT_USAGE_FLUSH_INTERVAL", "5"))
+)
+
+# GET /api/promos/active results, kept until the next promotion starts or ends
+active_promos = ActivePromoCache(
+    discount_rules,
+    ttl=float(os.getenv("ACTIVE_PROMOS_CACHE_TTL", "300")),
+    fallback_ttl=discount_rules.rules.ttl,
+    max_entries=int(os.getenv("ACTIVE_PROMOS_CACHE_MAX_ENTRIES", "5000"))
+)
+
+# Live promotions by product and category for POST /api/promos/badges
+promo_badges = PromoBadgeIndex(discount_rules, fallback_ttl=discount_rules.rules.ttl)
+
+# Serialized GET /api/cart responses, keyed by a per-user cart version
+cart_snapshots = CartSnapshotCache(
+    ttl=float(os.getenv("CART_SNAPSHOT_TTL", "60")),
+    max_entries=int(os.getenv("CART_SNAPSHOT_MAX_ENTRIES", "20000"))
+)
+
+# Cart badge counters (item count and subtotal) in Redis
+cart_summary = CartSummaryCounters(
+    ttl=int(os.getenv("CART_SUMMARY_TTL", "600"))
+)
+
+# Abandoned carts are removed (with a cart_abandoned analytics event) by a
+# paced background sweep; off unless CART_SWEEP_ENABLED=true
+cart_sweeper = AbandonedCartSweeper(
+    idle_days=float(os.getenv("CART_ABANDONED_AFTER_DAYS", "30")),
+    interval=float(os.getenv("CART_SWEEP_INTERVAL", "3600")),
+    batch_size=int(os.getenv("CART_SWEEP_BATCH_SIZE", "500")),
+    max_rows_per_second=float(os.getenv("CART_SWEEP_MAX_ROWS_PER_SECOND", "2000"))
+)
+CART_SWEEP_ENABLED = os.getenv("CART_SWEEP_ENABLED", "false").lower() == "true"
+
+# Short Redis holds on stock for items in carts; checkout stays authoritative
+stock_reservations = InventoryReservations(
+    enabled=os.getenv("INVENTORY_RESERVATIONS", "false").lower() == "true",
+    hold_ttl=int(os.getenv("INVENTORY_HOLD_TTL", "900")),
+    reconcile_interval=float(os.getenv("INVENTORY_RECONCILE_INTERVAL", "10"))
+)
 
 # Database and Redis connections
 pool = None
 redis_client = None
+lifespan_tasks = []
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -77,10 +239,71 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ Failed to initialize Redis: {e}")
         redis_client = None
+
+    principal_cache.bind(redis_client)
+    token_cache.bind(redis_client)
+    session_store.bind(redis_client)
+    limiter.bind(redis_client)
+    user_touch_buffer.bind(pool)
+    event_buffer.bind(pool)
+    event_rollups.bind(pool)
+    event_partitions.bind(pool, event_rollups if ANALYTICS_ROLLUPS_ENABLED else None)
+    if pool:
+        lifespan_tasks.append(asyncio.create_task(user_touch_buffer.run()))
+        lifespan_tasks.append(asyncio.create_task(event_buffer.run()))
+        lifespan_tasks.append(asyncio.create_task(event_partitions.run()))
+        if ANALYTICS_ROLLUPS_ENABLED:
+            lifespan_tasks.append(asyncio.create_task(event_rollups.run()))
+    mail_queue.bind(redis_client)
+    cart_store.bind(redis_client, pool)
+    cart_snapshots.bind(redis_client)
+    cart_summary.bind(redis_client, pool)
+    discount_rules.bind(pool)
+    discount_usage.bind(redis_client, pool)
+    if discount_usage.enabled:
+        lifespan_tasks.append(asyncio.create_task(discount_usage.run()))
+    stock_reservations.bind(redis_client, pool)
+    cart_sweeper.bind(pool, cart_store, cart_summary, cart_snapshots)
+    if pool and CART_SWEEP_ENABLED:
+        lifespan_tasks.append(asyncio.create_task(cart_sweeper.run()))
+    if stock_reservations.enabled:
+        lifespan_tasks.append(asyncio.create_task(stock_reservations.run()))
+    if pool:
+        lifespan_tasks.append(asyncio.create_task(discount_rules.listen_for_changes()))
+    if cart_store.enabled:
+        lifespan_tasks.append(asyncio.create_task(cart_store.run()))
+    if redis_client:
+        lifespan_tasks.append(asyncio.create_task(principal_cache.listen_for_invalidations()))
+        lifespan_tasks.append(asyncio.create_task(token_cache.listen_for_revocations()))
+        if pool:
+            lifespan_tasks.append(asyncio.create_task(cart_summary.listen_for_product_changes()))
+        if MAIL_WORKER_ENABLED:
+            lifespan_tasks.append(asyncio.create_task(mail_queue.run()))
     
     yield
     
     # Shutdown
+    for task in lifespan_tasks:
+        task.cancel()
+    await asyncio.gather(*lifespan_tasks, return_exceptions=True)
+    lifespan_tasks.clear()
+
+    # Drain write-behind buffers while the pool is still open
+    await user_touch_buffer.flush()
+    try:
+        await event_buffer.flush()
+    except Exception as e:
+        logger.error(f"❌ Final analytics event flush failed: {e}")
+    try:
+        await cart_store.flush()
+    except Exception as e:
+        logger.error(f"❌ Final cart flush failed: {e}")
+    if discount_usage.enabled:
+        try:
+            await discount_usage.flush()
+        except Exception as e:
+            logger.error(f"❌ Final discount usage flush failed: {e}")
+
     if pool:
         await pool.close()
         logger.info("✅ Database pool closed")
@@ -89,6 +312,8 @@ async def lifespan(app: FastAPI):
         await redis_client.close()
         logger.info("✅ Redis client closed")
 
+    password_hasher.shutdown()
+
 # Create FastAPI app
 app = FastAPI(
     title="BetterBeingWEB API",
@@ -97,11 +322,6 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# Add rate limiting middleware
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-app.add_middleware(SlowAPIMiddleware)
-
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -120,6 +340,15 @@ app.add_middleware(
 # Compression middleware
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
+@app.exception_handler(CartUnsupported)
+async def cart_unsupported_handler(request: Request, exc: CartUnsupported):
+    # Raised wherever a cart is loaded from the Redis store, so mapped once here
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": "This cart has product variant lines, which the cart service cannot load. "
+                           "Clear the cart to continue."},
+    )
+
 # Routers (mounted after middleware)
 try:
     from routers import auth as legacy_auth  # optional legacy router with prefix inside
@@ -141,6 +370,16 @@ try:
 except Exception:
     promos_router = None
 
+try:
+    from orders.orders_router import orders_router
+except Exception:
+    orders_router = None
+
+try:
+    from events.events_router import events_router
+except Exception:
+    events_router = None
+
 if legacy_auth is not None:
     try:
         app.include_router(legacy_auth.router)  # has its own /api/auth prefix
@@ -165,6 +404,18 @@ if promos_router is not None:
     except Exception:
         pass
 
+if orders_router is not None:
+    try:
+        app.include_router(orders_router, prefix="/api/orders", tags=["orders"])
+    except Exception:
+        pass
+
+if events_router is not None:
+    try:
+        app.include_router(events_router, prefix="/api/events", tags=["events"])
+    except Exception:
+        pass
+
 # Dependency for database connection
 async def get_db():
     if not pool:
@@ -184,12 +435,44 @@ async def get_redis():
         )
     return redis_client
 
-# Password utilities
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Password utilities (bcrypt runs in the hasher pool, never on the event loop)
+def _hasher_busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication service busy, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy_exception()
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _hasher_busy_exception()
+
+async def rehash_password_if_needed(user_id: int, plain_password: str, hashed_password: str, column: str = "password_hash"):
+    """Upgrade a hash made under an older policy. Run after a successful login."""
+    if column not in ("password_hash", "password") or not pwd_context.needs_update(hashed_password):
+        return
+    try:
+        new_hash = await password_hasher.hash(plain_password)
+    except PasswordHasherBusy:
+        return  # Try again on the next login
+    if not pool:
+        return
+    try:
+        async with pool.acquire() as connection:
+            await connection.execute(
+                f"UPDATE users SET {column} = $1 WHERE id = $2 AND {column} = $3",
+                new_hash, user_id, hashed_password
+            )
+    except Exception as e:
+        logger.error(f"Password rehash failed for user {user_id}: {e}")
 
 # JWT utilities
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -198,21 +481,63 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # Sub-second iat, so a token_cache.revoke_user cutoff is exact
+    to_encode.update({"exp": expire, "iat": time.time()})
+    encoded_jwt = jwt_encode(to_encode, SECRET_KEY, ALGORITHM)
     return encoded_jwt
 
+def principal_claims(user) -> dict:
+    """Access-token claims for a user row; embeds the profile when claims are trusted."""
+    claims = {"sub": str(user["id"])}
+    if TRUST_TOKEN_CLAIMS:
+        claims.update({claim: user[claim] for claim in PRINCIPAL_CLAIMS})
+    return claims
+
 def create_refresh_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire, "type": "refresh"})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # A unique jti, so a token rotated within the same second is still a new token
+    to_encode.update({"exp": expire, "iat": datetime.utcnow(), "type": "refresh", "jti": secrets.token_urlsafe(16)})
+    encoded_jwt = jwt_encode(to_encode, SECRET_KEY, ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db=Depends(get_db)
-):
+async def issue_session_tokens(user, request: Request) -> Tuple[str, str]:
+    """Create an access/refresh token pair bound to a new device session."""
+    await get_redis()
+    session_id = new_session_id()
+    access_token = create_access_token(data={**principal_claims(user), "sid": session_id})
+    refresh_token = create_refresh_token(data={"sub": str(user["id"]), "sid": session_id})
+    await session_store.create(
+        user["id"],
+        session_id,
+        refresh_token,
+        user_agent=request.headers.get("user-agent"),
+        ip_address=request.client.host if request.client else None
+    )
+    return access_token, refresh_token
+
+async def _fetch_principal(user_id: int) -> Optional[Dict[str, Any]]:
+    if not pool:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not available"
+        )
+    async with pool.acquire() as connection:
+        user = await connection.fetchrow(
+            "SELECT id, email, first_name, last_name, email_verified FROM users WHERE id = $1",
+            user_id
+        )
+    if user is None:
+        return None
+    return {
+        "id": user["id"],
+        "email": user["email"],
+        "first_name": user["first_name"],
+        "last_name": user["last_name"],
+        "email_verified": user["email_verified"]
+    }
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -220,29 +545,36 @@ async def get_current_user(
     )
     
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = await token_cache.decode(credentials.credentials)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+    except InvalidToken:
         raise credentials_exception
+
+    if TRUST_TOKEN_CLAIMS and all(claim in payload for claim in PRINCIPAL_CLAIMS):
+        return {"id": int(user_id), **{claim: payload[claim] for claim in PRINCIPAL_CLAIMS}}
     
-    # Fetch user from database
-    user = await db.fetchrow(
-        "SELECT id, email, first_name, last_name, email_verified FROM users WHERE id = $1",
-        int(user_id)
-    )
+    # Resolve the user through the principal cache (DB only on a miss)
+    user = await principal_cache.load(int(user_id), _fetch_principal)
     
     if user is None:
         raise credentials_exception
     
-    return {
-        "id": user["id"],
-        "email": user["email"],
-        "first_name": user["first_name"],
-        "last_name": user["last_name"],
-        "email_verified": user["email_verified"]
-    }
+    return user
+
+optional_security = HTTPBearer(auto_error=False)
+
+async def get_optional_user_id(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Optional[int]:
+    """The caller's user ID if a valid access token was sent, else None. Never queries the database."""
+    if credentials is None:
+        return None
+    try:
+        return int((await token_cache.decode(credentials.credentials)).get("sub"))
+    except (InvalidToken, TypeError, ValueError):
+        return None
 
 # Health endpoints (do not hard-depend on DB/Redis)
 @app.get("/api/health")
@@ -278,6 +610,31 @@ async def health_check():
         "timestamp": datetime.utcnow().isoformat(),
     }
 
+# Runtime metrics for in-process subsystems
+@app.get("/api/metrics")
+async def runtime_metrics():
+    return {
+        "password_hasher": password_hasher.stats(),
+        "principal_cache": principal_cache.stats(),
+        "token_cache": {"backend": JWT_BACKEND, **token_cache.stats()},
+        "rate_limits": limiter.stats(),
+        "user_touch_buffer": user_touch_buffer.stats(),
+        "event_buffer": event_buffer.stats(),
+        "event_partitions": event_partitions.stats(),
+        "event_rollups": event_rollups.stats(),
+        "mail_queue": await mail_queue.stats(),
+        "cart_store": await cart_store.stats(),
+        "discount_rules": discount_rules.stats(),
+        "active_promos": active_promos.stats(),
+        "promo_badges": promo_badges.stats(),
+        "discount_usage": await discount_usage.stats(),
+        "cart_snapshots": cart_snapshots.stats(),
+        "cart_summary": cart_summary.stats(),
+        "stock_reservations": await stock_reservations.stats(),
+        "cart_sweeper": cart_sweeper.stats(),
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
 # Custom OpenAPI schema
 def custom_openapi():
     if app.openapi_schema:
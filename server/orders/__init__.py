@@ -0,0 +1 @@
+"""Checkout and order placement."""
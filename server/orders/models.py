@@ -0,0 +1,56 @@
+from pydantic import BaseModel, Field, validator
+from typing import List, Optional
+from decimal import Decimal
+from datetime import datetime
+
+# Lengths match the orders and payments columns in database/schema.sql, so
+# over-long input is a 422 instead of a failed insert inside checkout
+class OrderAddress(BaseModel):
+    first_name: str = Field(max_length=100)
+    last_name: str = Field(max_length=100)
+    company: Optional[str] = Field(None, max_length=255)
+    address_line_1: str = Field(max_length=255)
+    address_line_2: Optional[str] = Field(None, max_length=255)
+    city: str = Field(max_length=100)
+    province: Optional[str] = Field(None, max_length=100)
+    postal_code: str = Field(max_length=20)
+    country: str = 'ZA'
+    phone: Optional[str] = Field(None, max_length=20)
+
+    @validator('country')
+    def validate_country(cls, v):
+        if len(v) != 2:
+            raise ValueError('Country must be a two-letter ISO code')
+        return v.upper()
+
+class CheckoutRequest(BaseModel):
+    shipping_address: OrderAddress
+    billing_address: Optional[OrderAddress] = None  # defaults to the shipping address
+    shipping_method: Optional[str] = Field(None, max_length=100)
+    payment_method: str = Field('card', max_length=50)
+    notes: Optional[str] = None
+    # Total the customer was shown; checkout fails instead of charging a different amount
+    expected_total: Optional[Decimal] = None
+
+class OrderItem(BaseModel):
+    product_id: int
+    product_name: str
+    product_sku: str
+    quantity: int
+    unit_price: Decimal
+    total_price: Decimal
+
+class Order(BaseModel):
+    id: int
+    order_number: str
+    status: str
+    payment_status: str
+    currency: str
+    subtotal: Decimal
+    tax_amount: Decimal
+    shipping_amount: Decimal
+    discount_amount: Decimal
+    total_amount: Decimal
+    discount_code: Optional[str] = None
+    items: List[OrderItem]
+    created_at: datetime
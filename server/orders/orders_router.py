@@ -0,0 +1,354 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+import hashlib
+import logging
+import secrets
+import string
+import time
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, List, Optional
+
+from cart.cart_router import load_cart, record_cart_change
+from cart.pricing import DISCOUNT_CODE_QUERY, DiscountRule, price_cart
+from orders.models import CheckoutRequest, Order, OrderItem
+from promos.usage import UsageReservation
+from main import get_db, get_current_user, get_redis, limiter, cart_store, discount_usage, stock_reservations
+
+logger = logging.getLogger(__name__)
+
+orders_router = APIRouter()
+
+CENT = Decimal('0.01')
+
+# Retries of a checkout with the same Idempotency-Key serialize on this row:
+# a concurrent insert waits for the first transaction, then finds its order.
+CLAIM_IDEMPOTENCY_KEY_QUERY = """
+    INSERT INTO order_idempotency_keys (user_id, idempotency_key, request_hash)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (user_id, idempotency_key) DO NOTHING
+    RETURNING user_id
+"""
+
+# Products are always locked in id order, so concurrent checkouts sharing
+# products queue up on the first shared row instead of deadlocking.
+LOCK_PRODUCTS_QUERY = """
+    SELECT id, name, sku, price, category_id, stock_quantity, track_stock, is_active
+    FROM products
+    WHERE id = ANY($1::int[])
+    ORDER BY id
+    FOR UPDATE
+"""
+
+LOCK_DISCOUNT_CODE_QUERY = DISCOUNT_CODE_QUERY + "    FOR UPDATE\n"
+
+INSERT_ORDER_ITEMS_QUERY = """
+    INSERT INTO order_items (order_id, product_id, product_name, product_sku, quantity, unit_price, total_price)
+    SELECT $1, v.product_id, v.product_name, v.product_sku, v.quantity, v.unit_price, v.total_price
+    FROM unnest($2::int[], $3::text[], $4::text[], $5::int[], $6::numeric[], $7::numeric[])
+        AS v(product_id, product_name, product_sku, quantity, unit_price, total_price)
+"""
+
+# Stock was checked under the row locks above; one statement decrements it
+# and records the movement with the resulting level (returned for the Redis
+# stock mirror).
+DECREMENT_STOCK_QUERY = """
+    WITH sold AS (
+        UPDATE products p
+        SET stock_quantity = p.stock_quantity - v.quantity
+        FROM unnest($1::int[], $2::int[]) AS v(product_id, quantity)
+        WHERE p.id = v.product_id AND p.track_stock
+        RETURNING p.id, v.quantity, p.stock_quantity
+    )
+    INSERT INTO inventory_movements (product_id, movement_type, quantity_change, quantity_after, reference_type, reference_id)
+    SELECT id, 'sale', -quantity, stock_quantity, 'order', $3
+    FROM sold
+    RETURNING id, product_id, quantity_after
+"""
+
+ORDER_QUERY = """
+    SELECT
+        o.id, o.order_number, o.status, o.payment_status, o.currency, o.subtotal, o.tax_amount,
+        o.shipping_amount, o.discount_amount, o.total_amount, o.created_at,
+        (SELECT dc.code FROM discount_code_uses u JOIN discount_codes dc ON dc.id = u.discount_code_id
+         WHERE u.order_id = o.id LIMIT 1) as discount_code
+    FROM orders o
+    WHERE o.id = $1
+"""
+
+ORDER_ITEMS_QUERY = """
+    SELECT product_id, product_name, product_sku, quantity, unit_price, total_price
+    FROM order_items
+    WHERE order_id = $1
+    ORDER BY id
+"""
+
+_ORDER_NUMBER_ALPHABET = string.ascii_uppercase + string.digits
+
+
+def _order_number() -> str:
+    # Same shape as the Node service (BB + last six digits of the ms clock), with a longer random tail
+    suffix = ''.join(secrets.choice(_ORDER_NUMBER_ALPHABET) for _ in range(5))
+    return f"BB{int(time.time() * 1000) % 1000000:06d}{suffix}"
+
+
+async def _load_order(db, order_id: int) -> Order:
+    order = await db.fetchrow(ORDER_QUERY, order_id)
+    items = await db.fetch(ORDER_ITEMS_QUERY, order_id)
+    return Order(**dict(order), items=[OrderItem(**dict(item)) for item in items])
+
+
+async def _claim_idempotency_key(db, user_id: int, key: str, request_hash: str) -> Optional[int]:
+    """Claim ``key`` for this checkout; returns the order of an earlier identical checkout, if any."""
+    if await db.fetchval(CLAIM_IDEMPOTENCY_KEY_QUERY, user_id, key, request_hash):
+        return None
+    existing = await db.fetchrow(
+        "SELECT request_hash, order_id FROM order_idempotency_keys WHERE user_id = $1 AND idempotency_key = $2",
+        user_id, key
+    )
+    if existing['request_hash'] != request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used for a different checkout request"
+        )
+    return existing['order_id']
+
+
+async def _lock_store_cart(user_id: int) -> str:
+    """Take the Redis cart's checkout lock, so a concurrent checkout cannot order the same lines."""
+    try:
+        token = await cart_store.lock_checkout(user_id)
+    except Exception as e:
+        logger.error(f"Checkout lock unavailable: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Cart service unavailable"
+        )
+    if token is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A checkout for this cart is already in progress"
+        )
+    return token
+
+
+async def _unlock_store_cart(user_id: int, token: str):
+    try:
+        await cart_store.unlock_checkout(user_id, token)
+    except Exception as e:
+        # The lock expires on its own after checkout_lock_ttl
+        logger.warning(f"Checkout lock not released: {e}")
+
+
+def _order_columns(payload: CheckoutRequest) -> Dict[str, Any]:
+    columns: Dict[str, Any] = {
+        "shipping_method": payload.shipping_method,
+        "notes": payload.notes,
+    }
+    billing = payload.billing_address or payload.shipping_address
+    for prefix, address in (("shipping", payload.shipping_address), ("billing", billing)):
+        for field, value in address.model_dump().items():
+            columns[f"{prefix}_{field}"] = value
+    return columns
+
+
+@orders_router.post("/checkout", response_model=Order, status_code=status.HTTP_201_CREATED)
+@limiter.limit("10/minute")
+async def checkout(
+    payload: CheckoutRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    user=Depends(get_current_user),
+    db=Depends(get_db),
+    redis=Depends(get_redis)
+):
+    """Place an order for everything in the cart.
+
+    Stock, prices and the applied promo code are re-checked under row locks
+    and the order, its items, inventory movements, the discount use and a
+    pending payment are written in one transaction. Retrying with the same
+    ``Idempotency-Key`` header returns the original order instead of placing
+    another one.
+    """
+    request_hash = hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+    applied_code: Optional[str] = None
+    try:
+        applied_code = await redis.get(f"cart:promo:{user['id']}")
+    except Exception:
+        applied_code = None
+
+    reservation: Optional[UsageReservation] = None
+    cart_lock: Optional[str] = None
+    try:
+        async with db.transaction():
+            if idempotency_key:
+                order_id = await _claim_idempotency_key(db, user['id'], idempotency_key, request_hash)
+                if order_id is not None:
+                    response.status_code = status.HTTP_200_OK
+                    response.headers["Idempotent-Replayed"] = "true"
+                    return await _load_order(db, order_id)
+
+            if not cart_store.enabled:
+                # A second checkout of the same cart waits here, then finds it empty
+                await db.execute("SELECT id FROM cart_items WHERE user_id = $1 FOR UPDATE", user['id'])
+            else:
+                # Held until the ordered lines are removed from the Redis cart below
+                cart_lock = await _lock_store_cart(user['id'])
+            cart_version, lines = await load_cart(db, user['id'])
+            if not lines:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Cart is empty"
+                )
+
+            quantities: Dict[int, int] = {}
+            for line in lines:
+                quantities[line['product_id']] = quantities.get(line['product_id'], 0) + line['quantity']
+            products = {row['id']: row for row in await db.fetch(LOCK_PRODUCTS_QUERY, sorted(quantities))}
+
+            problems: List[Dict[str, Any]] = []
+            for product_id, quantity in quantities.items():
+                product = products.get(product_id)
+                if product is None or not product['is_active']:
+                    problems.append({"product_id": product_id, "reason": "unavailable"})
+                elif product['track_stock'] and product['stock_quantity'] < quantity:
+                    problems.append({"product_id": product_id, "reason": "insufficient_stock",
+                                     "available": max(product['stock_quantity'], 0)})
+            if problems:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail={"message": "Some items in your cart are no longer available", "items": problems}
+                )
+
+            # Price from the locked rows, not from whatever the cart last displayed
+            priced = [
+                {
+                    "product_id": product_id,
+                    "category_id": products[product_id]['category_id'],
+                    "quantity": quantity,
+                    "subtotal": quantity * products[product_id]['price'],
+                }
+                for product_id, quantity in quantities.items()
+            ]
+
+            now = datetime.now(timezone.utc)
+            rule: Optional[DiscountRule] = None
+            customer_uses = 0
+            if applied_code:
+                # With usage counters the limits are taken atomically in Redis below, so the row is not locked
+                row = await db.fetchrow(DISCOUNT_CODE_QUERY if discount_usage.enabled else LOCK_DISCOUNT_CODE_QUERY, applied_code)
+                rule = DiscountRule(row) if row else None
+                if rule is not None and rule.limits_per_customer and not discount_usage.enabled:
+                    customer_uses = await db.fetchval(
+                        "SELECT COUNT(*) FROM discount_code_uses WHERE discount_code_id = $1 AND user_id = $2",
+                        rule.id, user['id']
+                    ) or 0
+                if rule is None or not rule.is_available(now, customer_uses):
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail=f"Promo code {applied_code} can no longer be applied"
+                    )
+            pricing = price_cart(priced, applied_code, rule, customer_uses, now)
+
+            tax = pricing.estimated_tax.quantize(CENT, rounding=ROUND_HALF_UP)
+            total = max(pricing.subtotal + tax + pricing.estimated_shipping - pricing.discount_total, Decimal('0.00'))
+            if payload.expected_total is not None and payload.expected_total.quantize(CENT) != total:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail={"message": "Your cart total has changed", "total": str(total)}
+                )
+
+            columns = {
+                "order_number": _order_number(),
+                "user_id": user['id'],
+                "subtotal": pricing.subtotal,
+                "tax_amount": tax,
+                "shipping_amount": pricing.estimated_shipping,
+                "discount_amount": pricing.discount_total,
+                "total_amount": total,
+                **_order_columns(payload),
+            }
+            placeholders = ", ".join(f"${n}" for n in range(1, len(columns) + 1))
+            order_id = await db.fetchval(
+                f"INSERT INTO orders ({', '.join(columns)}) VALUES ({placeholders}) RETURNING id",
+                *columns.values()
+            )
+
+            product_ids = list(quantities)
+            await db.execute(
+                INSERT_ORDER_ITEMS_QUERY,
+                order_id,
+                product_ids,
+                [products[product_id]['name'] for product_id in product_ids],
+                [products[product_id]['sku'] for product_id in product_ids],
+                [quantities[product_id] for product_id in product_ids],
+                [products[product_id]['price'] for product_id in product_ids],
+                [quantities[product_id] * products[product_id]['price'] for product_id in product_ids]
+            )
+            movements = await db.fetch(
+                DECREMENT_STOCK_QUERY, product_ids, [quantities[product_id] for product_id in product_ids], order_id
+            )
+
+            if rule is not None and pricing.discount_total > 0:
+                if discount_usage.enabled:
+                    reservation = await discount_usage.reserve(db, rule, user['id'])
+                    if reservation is None:
+                        raise HTTPException(
+                            status_code=status.HTTP_409_CONFLICT,
+                            detail=f"Promo code {applied_code} can no longer be applied"
+                        )
+                await db.execute(
+                    "INSERT INTO discount_code_uses (discount_code_id, order_id, user_id, discount_amount) VALUES ($1, $2, $3, $4)",
+                    rule.id, order_id, user['id'], pricing.discount_total
+                )
+                if not discount_usage.enabled:
+                    await db.execute("UPDATE discount_codes SET used_count = used_count + 1 WHERE id = $1", rule.id)
+
+            await db.execute(
+                "INSERT INTO payments (order_id, payment_method, amount) VALUES ($1, $2, $3)",
+                order_id, payload.payment_method, total
+            )
+            await db.execute("DELETE FROM cart_items WHERE user_id = $1", user['id'])
+            if idempotency_key:
+                await db.execute(
+                    "UPDATE order_idempotency_keys SET order_id = $3 WHERE user_id = $1 AND idempotency_key = $2",
+                    user['id'], idempotency_key, order_id
+                )
+            order = await _load_order(db, order_id)
+
+    except BaseException:
+        if reservation is not None:
+            try:
+                await discount_usage.release(reservation)
+            except Exception as e:
+                logger.warning(f"Discount reservation not released: {e}")
+        if cart_lock is not None:
+            await _unlock_store_cart(user['id'], cart_lock)
+        raise
+
+    # The order is committed; a failure below only leaves a stale cart view
+    if reservation is not None:
+        try:
+            await discount_usage.commit(reservation)
+        except Exception as e:
+            # The reservation expires and reconcile reports the missing use
+            logger.warning(f"Discount use not committed after order {order.order_number}: {e}")
+    if cart_lock is not None:
+        try:
+            await cart_store.clear_ordered(user['id'], cart_version, quantities)
+        except Exception as e:
+            logger.warning(f"Cart not cleared after order {order.order_number}: {e}")
+        finally:
+            await _unlock_store_cart(user['id'], cart_lock)
+    if stock_reservations.enabled:
+        try:
+            levels = {row['product_id']: (row['quantity_after'], row['id']) for row in movements}
+            await stock_reservations.commit(user['id'], quantities, levels)
+        except Exception as e:
+            # Reconciliation picks the sale up from inventory_movements
+            logger.warning(f"Stock holds not committed after order {order.order_number}: {e}")
+    try:
+        await redis.delete(f"cart:promo:{user['id']}")
+    except Exception:
+        pass
+    await record_cart_change(user['id'], op="reset")
+    return order
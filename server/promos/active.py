@@ -0,0 +1,52 @@
+"""Cache for the ``GET /api/promos/active`` badge lookups.
+
+Entries are keyed by ``(scope, product_id, category_id)`` and expire at the
+next ``starts_at``/``ends_at`` among the promotions the lookup matched, so
+a cached list never shows a promotion past its end or misses one that has
+just started. Any change to ``discount_codes`` (tracked through
+``DiscountRuleCache.generation``) empties the cache. While the discount
+index is not kept current by its listener, entries live at most
+``fallback_ttl`` seconds so writes from other processes still show up.
+"""
+import time
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional
+
+from cache.ttl_lru import TTLCache
+
+
+class ActivePromoCache:
+    def __init__(self, rules, ttl: float = 300.0, fallback_ttl: float = 30.0, max_entries: int = 5000):
+        self.rules = rules
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self.entries = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._generation = rules.generation
+        self._counts = {"invalidations": 0, "stale_sets": 0}
+
+    @property
+    def generation(self) -> int:
+        return self.rules.generation
+
+    def get(self, key: Hashable) -> Optional[List[Dict[str, Any]]]:
+        if self.rules.generation != self._generation:
+            self.entries.clear()
+            self._generation = self.rules.generation
+            self._counts["invalidations"] += 1
+        return self.entries.get(key)
+
+    def set(self, key: Hashable, promotions: List[Dict[str, Any]], next_boundary: Optional[datetime],
+            generation: int):
+        """Cache a lookup made at ``generation``, until ``next_boundary`` at the latest."""
+        if generation != self.rules.generation:
+            # discount_codes changed while the lookup ran
+            self._counts["stale_sets"] += 1
+            return
+        ttl = self.ttl if self.rules.index is not None else self.fallback_ttl
+        expires_at = time.time() + ttl
+        if next_boundary is not None:
+            expires_at = min(expires_at, next_boundary.timestamp())
+        self.entries.set(key, promotions, expires_at=expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ttl_s": self.ttl, **self.entries.stats(), **self._counts}
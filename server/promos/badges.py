@@ -0,0 +1,117 @@
+"""Promotion badges for product listings, resolved from a precomputed map.
+
+The map holds every promotion that is live right now: site-wide ones, and
+the rest indexed by product ID and by category ID, so a whole page of
+product cards is resolved with dictionary lookups (plus one primary-key
+query for the products' categories when category-wide promotions exist).
+It is rebuilt from ``discount_codes`` on the first lookup after a change
+(``DiscountRuleCache.generation``) or after the next ``starts_at``/``ends_at``
+among the promotions it read. While the discount index listener is down it
+is also rebuilt every ``fallback_ttl`` seconds.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_PROMOTIONS_QUERY = """
+    SELECT code, name, type, value, minimum_order_amount, maximum_discount_amount, applies_to,
+           applicable_product_ids, applicable_category_ids, starts_at, ends_at
+    FROM discount_codes
+    WHERE is_active = true AND (ends_at IS NULL OR ends_at >= $1)
+    ORDER BY starts_at NULLS FIRST, name
+"""
+
+_PRODUCT_CATEGORIES_QUERY = "SELECT id, category_id FROM products WHERE id = ANY($1::int[])"
+
+
+class PromoBadgeIndex:
+    def __init__(self, rules, ttl: float = 3600.0, fallback_ttl: float = 30.0):
+        self.rules = rules
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self.promotions: Dict[str, Dict[str, Any]] = {}
+        self.sitewide: List[str] = []
+        self.by_product: Dict[int, List[str]] = {}
+        self.by_category: Dict[int, List[str]] = {}
+        self._rank: Dict[str, int] = {}
+        self._generation: Optional[int] = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self._counts = {"builds": 0, "lookups": 0, "products_resolved": 0}
+
+    def _current(self) -> bool:
+        return self._generation == self.rules.generation and time.time() < self._expires_at
+
+    async def _build(self, db):
+        generation = self.rules.generation
+        now = datetime.now(timezone.utc)
+        promotions: Dict[str, Dict[str, Any]] = {}
+        sitewide: List[str] = []
+        by_product: Dict[int, List[str]] = {}
+        by_category: Dict[int, List[str]] = {}
+        next_boundary: Optional[datetime] = None
+        for row in await db.fetch(_PROMOTIONS_QUERY, now):
+            if row['starts_at'] is not None and row['starts_at'] > now:
+                boundary = row['starts_at']
+            else:
+                boundary = row['ends_at']
+                promotion = dict(row)
+                code = promotion['code']
+                promotions[code] = promotion
+                applies_to = (promotion['applies_to'] or 'all').lower()
+                if applies_to == 'all':
+                    sitewide.append(code)
+                elif applies_to == 'specific_products':
+                    for product_id in promotion['applicable_product_ids'] or ():
+                        by_product.setdefault(product_id, []).append(code)
+                elif applies_to == 'specific_categories':
+                    for category_id in promotion['applicable_category_ids'] or ():
+                        by_category.setdefault(category_id, []).append(code)
+            if boundary is not None and (next_boundary is None or boundary < next_boundary):
+                next_boundary = boundary
+
+        self.promotions, self.sitewide = promotions, sitewide
+        self.by_product, self.by_category = by_product, by_category
+        self._rank = {code: rank for rank, code in enumerate(promotions)}
+        expires_at = time.time() + (self.ttl if self.rules.index is not None else self.fallback_ttl)
+        if next_boundary is not None:
+            expires_at = min(expires_at, next_boundary.timestamp())
+        # A change that landed while building leaves the old generation, so the next lookup rebuilds
+        self._generation, self._expires_at = generation, expires_at
+        self._counts["builds"] += 1
+
+    async def resolve(self, db, product_ids: Iterable[int]) -> Tuple[Dict[str, Dict[str, Any]], Dict[int, List[str]]]:
+        """``(promotions by code, {product_id: [codes]})`` for the given products."""
+        if not self._current():
+            async with self._lock:
+                if not self._current():
+                    await self._build(db)
+        product_ids = list(dict.fromkeys(product_ids))
+        # Read the maps once; a concurrent rebuild swaps them rather than mutating them
+        promotions, sitewide, by_product, by_category, rank = (
+            self.promotions, self.sitewide, self.by_product, self.by_category, self._rank
+        )
+        categories: Dict[int, Optional[int]] = {}
+        if by_category:
+            categories = {row['id']: row['category_id'] for row in await db.fetch(_PRODUCT_CATEGORIES_QUERY, product_ids)}
+
+        badges: Dict[int, List[str]] = {}
+        used = set()
+        for product_id in product_ids:
+            codes = set(sitewide)
+            codes.update(by_product.get(product_id, ()))
+            codes.update(by_category.get(categories.get(product_id), ()))
+            badges[product_id] = sorted(codes, key=rank.__getitem__)
+            used.update(codes)
+        self._counts["lookups"] += 1
+        self._counts["products_resolved"] += len(product_ids)
+        return {code: promotions[code] for code in promotions if code in used}, badges
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "promotions": len(self.promotions),
+            "indexed_products": len(self.by_product),
+            "indexed_categories": len(self.by_category),
+            **self._counts,
+        }
@@ -0,0 +1,18 @@
+from pydantic import BaseModel, validator
+from typing import Any, Dict, List
+
+class PromoBadgeRequest(BaseModel):
+    product_ids: List[int]
+
+    @validator('product_ids')
+    def validate_product_ids(cls, v):
+        if not v:
+            raise ValueError('At least one product ID is required')
+        if len(v) > 100:
+            raise ValueError('Cannot resolve badges for more than 100 products at once')
+        return v
+
+class PromoBadgeResponse(BaseModel):
+    # Each promotion once, keyed by code; badges maps product IDs to codes
+    promotions: Dict[str, Dict[str, Any]]
+    badges: Dict[int, List[str]]
@@ -1,30 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
 from typing import Dict, Any, Optional
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timezone
 
-from main import get_db, get_current_user, get_redis, limiter
-from cart.cart_router import build_cart_response
+from main import (
+    get_db, get_current_user, get_redis, limiter, cart_store, cart_snapshots, discount_rules, discount_usage,
+    active_promos, promo_badges,
+)
+from cart.cart_router import build_cart_response, load_cart_lines
+from promos.models import PromoBadgeRequest, PromoBadgeResponse
 
 promos_router = APIRouter(prefix="/api")
 
 
-async def _fetch_discount_code(db, code: str) -> Optional[Dict[str, Any]]:
-    row = await db.fetchrow(
-        """
-        SELECT id, code, name, type, value, minimum_order_amount, maximum_discount_amount,
-               usage_limit, usage_limit_per_customer, used_count, applies_to,
-               applicable_product_ids, applicable_category_ids,
-               starts_at, ends_at, is_active
-        FROM discount_codes
-        WHERE LOWER(code) = LOWER($1)
-        """,
-        code
-    )
-    return dict(row) if row else None
-
-
 async def _cart_subtotal(db, user_id: int) -> Decimal:
+    if cart_store.enabled:
+        lines = await load_cart_lines(db, user_id)
+        return sum((line['subtotal'] for line in lines), Decimal('0.00'))
+
     subtotal = await db.fetchval(
         """
         SELECT COALESCE(SUM(ci.quantity * p.price), 0)
@@ -49,37 +42,40 @@ async def apply_promo(
     if not code:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Code is required")
 
-    discount = await _fetch_discount_code(db, code)
+    # From the in-process discount code index; no query once it is loaded
+    discount = await discount_rules.get(db, code)
     if not discount:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or unknown code")
 
     # Validate active and time window
-    now = datetime.utcnow()
-    if not discount["is_active"]:
+    now = datetime.now(timezone.utc)
+    if not discount.is_active:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Code is inactive")
-    if discount["starts_at"] and now < discount["starts_at"]:
+    if discount.starts_at and now < discount.starts_at:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Code not active yet")
-    if discount["ends_at"] and now > discount["ends_at"]:
+    if discount.ends_at and now > discount.ends_at:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Code has expired")
-    if discount["usage_limit"] is not None and discount["used_count"] >= discount["usage_limit"]:
+    if discount_usage.enabled:
+        # Live counters, including uses reserved by checkouts in flight
+        if not await discount_usage.available(db, discount, user['id']):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Code usage limit reached")
+    elif discount.usage_limit is not None and discount.used_count >= discount.usage_limit:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Code usage limit reached")
 
     # Enforce per-customer prior uses
-    if discount["usage_limit_per_customer"] is not None and discount["usage_limit_per_customer"] > 0:
-        used_by_customer = await db.fetchval(
-            "SELECT COUNT(*) FROM discount_code_uses WHERE discount_code_id = $1 AND user_id = $2",
-            discount["id"], user['id']
-        )
-        if used_by_customer and used_by_customer >= discount["usage_limit_per_customer"]:
+    if discount.limits_per_customer and not discount_usage.enabled:
+        used_by_customer = await discount_rules.uses_by_customer(db, discount, user['id'])
+        if used_by_customer >= discount.usage_limit_per_customer:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="You have already used this code")
 
     # Min order amount check against current cart subtotal
     subtotal = await _cart_subtotal(db, user['id'])
-    if discount["minimum_order_amount"] is not None and subtotal < discount["minimum_order_amount"]:
+    if discount.minimum_order_amount is not None and subtotal < discount.minimum_order_amount:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cart does not meet minimum order amount")
 
     # Persist applied code in Redis (7 days)
-    await redis.setex(f"cart:promo:{user['id']}", 7 * 24 * 3600, discount["code"])
+    await redis.setex(f"cart:promo:{user['id']}", 7 * 24 * 3600, discount.code)
+    await cart_snapshots.bump(user['id'])
 
     # Return updated cart snapshot
     cart = await build_cart_response(user, db, redis)
@@ -93,6 +89,7 @@ async def remove_promo(
     redis=Depends(get_redis)
 ):
     await redis.delete(f"cart:promo:{user['id']}")
+    await cart_snapshots.bump(user['id'])
     cart = await build_cart_response(user, db, redis)
     return {"cart": cart.model_dump()}
 
@@ -105,19 +102,58 @@ async def list_active_promos(
     db=Depends(get_db)
 ):
     """List public, active promotions. Optionally filter by product/category for badges."""
-    where = ["is_active = true", "(starts_at IS NULL OR NOW() >= starts_at)", "(ends_at IS NULL OR NOW() <= ends_at)"]
-    params = []
+    # Filters that do not change the query share one cache entry
+    if scope != 'product':
+        key = (scope, None, None)
+    elif productId is not None:
+        key = (scope, productId, None)
+    else:
+        key = (scope, None, categoryId)
+    cached = active_promos.get(key)
+    if cached is not None:
+        return {"promotions": cached}
+
+    generation = active_promos.generation
+    now = datetime.now(timezone.utc)
+    # Promotions that have not started yet are fetched too: their start is when this answer expires
+    where = ["is_active = true", "(ends_at IS NULL OR ends_at >= $1)"]
+    params = [now]
 
     if scope == 'product':
         # Limit to promos that apply to all or specific target matching provided filters
         if productId is not None:
-            where.append("(applies_to = 'all' OR (applies_to = 'specific_products' AND $1 = ANY(applicable_product_ids)))")
+            where.append("(applies_to = 'all' OR (applies_to = 'specific_products' AND $2 = ANY(applicable_product_ids)))")
             params.append(productId)
         elif categoryId is not None:
-            where.append("(applies_to = 'all' OR (applies_to = 'specific_categories' AND $1 = ANY(applicable_category_ids)))")
+            where.append("(applies_to = 'all' OR (applies_to = 'specific_categories' AND $2 = ANY(applicable_category_ids)))")
             params.append(categoryId)
 
     query = f"SELECT code, name, type, value, minimum_order_amount, maximum_discount_amount, applies_to, applicable_product_ids, applicable_category_ids, starts_at, ends_at FROM discount_codes WHERE {' AND '.join(where)} ORDER BY starts_at NULLS FIRST, name"
     rows = await db.fetch(query, *params)
-    return {"promotions": [dict(r) for r in rows]}
 
+    promotions = []
+    next_boundary: Optional[datetime] = None
+    for row in rows:
+        if row['starts_at'] is not None and row['starts_at'] > now:
+            boundary = row['starts_at']
+        else:
+            promotions.append(dict(row))
+            boundary = row['ends_at']
+        if boundary is not None and (next_boundary is None or boundary < next_boundary):
+            next_boundary = boundary
+    active_promos.set(key, promotions, next_boundary, generation)
+    return {"promotions": promotions}
+
+
+@promos_router.post("/promos/badges", response_model=PromoBadgeResponse)
+async def resolve_promo_badges(
+    payload: PromoBadgeRequest,
+    db=Depends(get_db)
+):
+    """Live promotions for a page of product cards in one call.
+
+    Unlike ``/promos/active?productId=``, a product also gets the promotions
+    that target its category.
+    """
+    promotions, badges = await promo_badges.resolve(db, payload.product_ids)
+    return {"promotions": promotions, "badges": badges}
@@ -0,0 +1,359 @@
+"""Discount code usage limits enforced with Redis counters.
+
+Checkout reserves a use before writing the order, commits it once the
+order is committed and releases it if the order fails, so ``usage_limit``
+and ``usage_limit_per_customer`` are checked and taken in one atomic step
+and no checkout has to lock the ``discount_codes`` row:
+
+    promo:usage:{id}            hash: used (committed uses), reserved (in flight)
+    promo:usage:{id}:customers  hash user_id -> uses plus reservations
+    promo:reservations          zset "{id}:{user_id}:{token}:{counted}" -> expiry (ms)
+    promo:pending               hash id -> committed uses not yet added to used_count
+    promo:loaded                set of code IDs with counters in Redis
+
+Counters are seeded from ``discount_code_uses`` on first use. The order
+transaction still writes the ``discount_code_uses`` row (it carries the
+order and amount); ``used_count`` is brought up to date in one batched
+``UPDATE`` per flush instead of once per order. Reservations of a checkout
+that died are released after ``reservation_ttl``. ``reconcile`` compares
+the counters with ``discount_code_uses`` and reports (or repairs) drift.
+"""
+import asyncio
+import logging
+import secrets
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+RESERVATIONS_KEY = "promo:reservations"
+PENDING_KEY = "promo:pending"
+LOADED_KEY = "promo:loaded"
+
+# KEYS[1] usage hash, KEYS[2] customer hash, KEYS[3] reservations zset
+# ARGV: id, user_id, token, expires_at (ms), usage_limit, per-customer limit ('' for none), customer_ttl
+# Returns {status, counted}; status -1 usage not seeded, -2 customer not seeded, 0 limit reached, 1 reserved
+_RESERVE = """
+if redis.call('HEXISTS', KEYS[1], 'used') == 0 then
+    return {-1, 0}
+end
+local counted = redis.call('HEXISTS', KEYS[2], ARGV[2])
+if ARGV[6] ~= '' then
+    if counted == 0 then
+        return {-2, 0}
+    end
+    if tonumber(redis.call('HGET', KEYS[2], ARGV[2])) >= tonumber(ARGV[6]) then
+        return {0, 0}
+    end
+end
+if ARGV[5] ~= '' then
+    local taken = tonumber(redis.call('HGET', KEYS[1], 'used')) + tonumber(redis.call('HGET', KEYS[1], 'reserved') or '0')
+    if taken >= tonumber(ARGV[5]) then
+        return {0, 0}
+    end
+end
+redis.call('HINCRBY', KEYS[1], 'reserved', 1)
+if counted == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+    redis.call('EXPIRE', KEYS[2], ARGV[7])
+end
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1] .. ':' .. ARGV[2] .. ':' .. ARGV[3] .. ':' .. counted)
+return {1, counted}
+"""
+
+# KEYS[1] usage hash, KEYS[2] customer hash, KEYS[3] reservations zset
+# ARGV: member, user_id, counted, expired_before (ms; empty releases unconditionally)
+_RELEASE = """
+if ARGV[4] ~= '' then
+    local expires = redis.call('ZSCORE', KEYS[3], ARGV[1])
+    if expires and tonumber(expires) > tonumber(ARGV[4]) then
+        return 0
+    end
+end
+if redis.call('ZREM', KEYS[3], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'reserved', -1)
+if ARGV[3] == '1' and redis.call('HEXISTS', KEYS[2], ARGV[2]) == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[2], -1)
+end
+return 1
+"""
+
+# KEYS[1] usage hash, KEYS[2] customer hash, KEYS[3] reservations zset, KEYS[4] pending hash
+# ARGV: member, user_id, counted, id
+_COMMIT = """
+if redis.call('ZREM', KEYS[3], ARGV[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], 'reserved', -1)
+elseif ARGV[3] == '1' and redis.call('HEXISTS', KEYS[2], ARGV[2]) == 1 then
+    -- The reservation expired before the order committed; take the use again
+    redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+end
+if redis.call('HEXISTS', KEYS[1], 'used') == 1 then
+    redis.call('HINCRBY', KEYS[1], 'used', 1)
+end
+redis.call('HINCRBY', KEYS[4], ARGV[4], 1)
+return 1
+"""
+
+# KEYS[1] pending hash; returns its fields and clears it
+_DRAIN = """
+local pending = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return pending
+"""
+
+_FLUSH_SQL = """
+    UPDATE discount_codes dc
+    SET used_count = COALESCE(dc.used_count, 0) + v.uses
+    FROM unnest($1::int[], $2::int[]) AS v(id, uses)
+    WHERE dc.id = v.id
+"""
+
+_RECONCILE_SQL = """
+    SELECT dc.id, dc.code, COALESCE(dc.used_count, 0) AS used_count,
+           (SELECT COUNT(*) FROM discount_code_uses u WHERE u.discount_code_id = dc.id) AS uses
+    FROM discount_codes dc
+    WHERE dc.id = ANY($1::int[])
+    ORDER BY dc.id
+"""
+
+
+class UsageReservation(NamedTuple):
+    discount_id: int
+    user_id: int
+    member: str
+    counted: bool
+
+
+def _usage_key(discount_id) -> str:
+    return f"promo:usage:{discount_id}"
+
+
+def _customers_key(discount_id) -> str:
+    return f"promo:usage:{discount_id}:customers"
+
+
+class DiscountUsageCounters:
+    def __init__(self, enabled: bool = False, reservation_ttl: int = 300, flush_interval: float = 5.0,
+                 customer_ttl: int = 90 * 86400, batch_size: int = 500):
+        self.configured = enabled
+        self.reservation_ttl = reservation_ttl
+        self.flush_interval = flush_interval
+        self.customer_ttl = customer_ttl
+        self.batch_size = batch_size
+        self.redis = None
+        self.pool = None
+        self._reserve = self._release = self._commit = self._drain = None
+        self._counts = {
+            "reserved": 0, "rejected": 0, "committed": 0, "released": 0, "expired": 0,
+            "seeds": 0, "flushes": 0, "uses_flushed": 0, "flush_errors": 0,
+        }
+
+    def bind(self, redis_client, pool):
+        self.redis = redis_client
+        self.pool = pool
+        if redis_client:
+            self._reserve = redis_client.register_script(_RESERVE)
+            self._release = redis_client.register_script(_RELEASE)
+            self._commit = redis_client.register_script(_COMMIT)
+            self._drain = redis_client.register_script(_DRAIN)
+
+    @property
+    def enabled(self) -> bool:
+        return self.configured and self.redis is not None and self.pool is not None
+
+    async def _seed(self, db, discount_id: int, user_id: Optional[int] = None):
+        """Load committed uses of a code (or of a code by one customer) from ``discount_code_uses``."""
+        if user_id is None:
+            uses = await db.fetchval("SELECT COUNT(*) FROM discount_code_uses WHERE discount_code_id = $1", discount_id)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hsetnx(_usage_key(discount_id), "used", uses)
+                pipe.sadd(LOADED_KEY, discount_id)
+                await pipe.execute()
+        else:
+            uses = await db.fetchval(
+                "SELECT COUNT(*) FROM discount_code_uses WHERE discount_code_id = $1 AND user_id = $2",
+                discount_id, user_id
+            )
+            await self.redis.hsetnx(_customers_key(discount_id), user_id, uses)
+        self._counts["seeds"] += 1
+
+    async def reserve(self, db, rule, user_id: int) -> Optional[UsageReservation]:
+        """Take one use of ``rule`` for ``user_id``; None when a usage limit is reached."""
+        token = secrets.token_hex(6)
+        keys = [_usage_key(rule.id), _customers_key(rule.id), RESERVATIONS_KEY]
+        args = [
+            rule.id, user_id, token, int((time.time() + self.reservation_ttl) * 1000),
+            "" if rule.usage_limit is None else rule.usage_limit,
+            rule.usage_limit_per_customer if rule.limits_per_customer else "",
+            self.customer_ttl,
+        ]
+        # At most one seed each for the code and the customer
+        for _ in range(3):
+            status, counted = (int(value) for value in await self._reserve(keys=keys, args=args))
+            if status == -1:
+                await self._seed(db, rule.id)
+            elif status == -2:
+                await self._seed(db, rule.id, user_id)
+            else:
+                break
+        if status != 1:
+            self._counts["rejected"] += 1
+            return None
+        self._counts["reserved"] += 1
+        return UsageReservation(rule.id, user_id, f"{rule.id}:{user_id}:{token}:{counted}", bool(counted))
+
+    async def available(self, db, rule, user_id: int) -> bool:
+        """Whether ``user_id`` could use ``rule`` now, counting uses still in flight; reserves nothing."""
+        if rule.usage_limit is not None:
+            used, reserved = await self.redis.hmget(_usage_key(rule.id), "used", "reserved")
+            if used is None:
+                await self._seed(db, rule.id)
+                used, reserved = await self.redis.hmget(_usage_key(rule.id), "used", "reserved")
+            if int(used or 0) + int(reserved or 0) >= rule.usage_limit:
+                return False
+        if rule.limits_per_customer:
+            uses = await self.redis.hget(_customers_key(rule.id), user_id)
+            if uses is None:
+                await self._seed(db, rule.id, user_id)
+                uses = await self.redis.hget(_customers_key(rule.id), user_id)
+            if int(uses or 0) >= rule.usage_limit_per_customer:
+                return False
+        return True
+
+    async def commit(self, reservation: UsageReservation):
+        """Turn a reservation into a use once its order is committed."""
+        await self._commit(
+            keys=[_usage_key(reservation.discount_id), _customers_key(reservation.discount_id), RESERVATIONS_KEY, PENDING_KEY],
+            args=[reservation.member, reservation.user_id, int(reservation.counted), reservation.discount_id],
+        )
+        self._counts["committed"] += 1
+
+    async def release(self, reservation: UsageReservation):
+        """Give back a reservation whose order was not placed."""
+        released = await self._release(
+            keys=[_usage_key(reservation.discount_id), _customers_key(reservation.discount_id), RESERVATIONS_KEY],
+            args=[reservation.member, reservation.user_id, int(reservation.counted), ""],
+        )
+        self._counts["released"] += int(released)
+
+    async def release_expired(self) -> int:
+        """Release reservations left behind by checkouts that never finished."""
+        released = 0
+        while True:
+            now_ms = int(time.time() * 1000)
+            members = await self.redis.zrangebyscore(RESERVATIONS_KEY, "-inf", now_ms, start=0, num=self.batch_size)
+            if not members:
+                break
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for member in members:
+                    discount_id, user_id, _, counted = member.split(":")
+                    await self._release(
+                        keys=[_usage_key(discount_id), _customers_key(discount_id), RESERVATIONS_KEY],
+                        args=[member, user_id, counted, now_ms],
+                        client=pipe,
+                    )
+                results = await pipe.execute()
+            released += sum(int(result) for result in results)
+            if len(members) < self.batch_size:
+                break
+        self._counts["expired"] += released
+        return released
+
+    async def flush(self) -> int:
+        """Add committed uses to ``discount_codes.used_count``; returns the uses written."""
+        fields = await self._drain(keys=[PENDING_KEY])
+        pending = {int(fields[i]): int(fields[i + 1]) for i in range(0, len(fields), 2)}
+        if not pending:
+            return 0
+        try:
+            async with self.pool.acquire() as connection:
+                await connection.execute(_FLUSH_SQL, list(pending), list(pending.values()))
+        except Exception:
+            self._counts["flush_errors"] += 1
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for discount_id, uses in pending.items():
+                    pipe.hincrby(PENDING_KEY, discount_id, uses)
+                await pipe.execute()
+            raise
+        written = sum(pending.values())
+        self._counts["flushes"] += 1
+        self._counts["uses_flushed"] += written
+        return written
+
+    async def reconcile(self, repair: bool = False) -> List[Dict[str, Any]]:
+        """Compare the counters with ``discount_code_uses`` for every code loaded in Redis.
+
+        Returns one entry per code whose Redis ``used`` or ``used_count`` (plus
+        uses not yet flushed) disagrees with the recorded uses. With ``repair``
+        both are reset from ``discount_code_uses``; do that while checkouts are
+        quiet, as orders between the read and the write are not accounted for.
+        """
+        discount_ids = sorted(int(discount_id) for discount_id in await self.redis.smembers(LOADED_KEY))
+        if not discount_ids:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for discount_id in discount_ids:
+                pipe.hmget(_usage_key(discount_id), "used", "reserved")
+            pipe.hgetall(PENDING_KEY)
+            *counters, pending = await pipe.execute()
+        async with self.pool.acquire() as connection:
+            rows = {row["id"]: row for row in await connection.fetch(_RECONCILE_SQL, discount_ids)}
+
+        report = []
+        for discount_id, (used, reserved) in zip(discount_ids, counters):
+            row = rows.get(discount_id)
+            if row is None or used is None:
+                continue
+            unflushed = int(pending.get(str(discount_id), 0))
+            entry = {
+                "id": discount_id,
+                "code": row["code"],
+                "uses": row["uses"],
+                "redis_used": int(used),
+                "reserved": int(reserved or 0),
+                "used_count": row["used_count"],
+                "unflushed": unflushed,
+            }
+            if entry["redis_used"] != row["uses"] or row["used_count"] + unflushed != row["uses"]:
+                report.append(entry)
+
+        if repair and report:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for entry in report:
+                    pipe.hset(_usage_key(entry["id"]), "used", entry["uses"])
+                    pipe.delete(_customers_key(entry["id"]))  # Re-seeded per customer on next use
+                await pipe.execute()
+            async with self.pool.acquire() as connection:
+                await connection.execute(
+                    "UPDATE discount_codes dc SET used_count = v.used_count FROM unnest($1::int[], $2::int[]) AS v(id, used_count) "
+                    "WHERE dc.id = v.id",
+                    [entry["id"] for entry in report],
+                    [entry["uses"] - entry["unflushed"] for entry in report]
+                )
+        return report
+
+    async def run(self):
+        """Flush used counts and expire reservations every ``flush_interval`` seconds until cancelled."""
+        while True:
+            try:
+                await self.release_expired()
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Discount usage loop error: {e}")
+            await asyncio.sleep(self.flush_interval)
+
+    async def stats(self) -> Dict[str, Any]:
+        in_flight: Any = None
+        if self.enabled:
+            try:
+                in_flight = await self.redis.zcard(RESERVATIONS_KEY)
+            except Exception as e:
+                in_flight = {"error": str(e)}
+        return {
+            "enabled": self.enabled,
+            "reservations": in_flight,
+            "reservation_ttl_s": self.reservation_ttl,
+            **self._counts,
+        }
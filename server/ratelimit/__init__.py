@@ -0,0 +1 @@
+"""Shared request rate limiting for the API routers."""
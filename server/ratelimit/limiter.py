@@ -0,0 +1,208 @@
+"""Distributed rate limiter: Redis GCRA with local token leases.
+
+Limits are enforced globally with GCRA (generic cell rate algorithm) in a
+single Lua call per Redis round trip. To keep most allowed requests off
+Redis, a worker asks for a small lease of tokens at a time (a fraction of
+the limit) and spends it locally; the lease is already deducted from the
+shared budget, so workers can never jointly exceed a limit, only leave a few
+leased tokens unused. A rejection is also remembered locally until the
+retry-after time, so a flood from one client does not hammer Redis either.
+
+Without Redis the same algorithm runs in-process, which gives per-worker
+limits (the previous slowapi behaviour).
+"""
+import functools
+import inspect
+import logging
+import math
+import re
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+from cache.ttl_lru import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# KEYS[1] theoretical arrival time (ms)
+# ARGV: emission interval ms, burst tolerance ms, tokens requested
+# Returns {granted, retry_after_ms}
+_GCRA_LEASE = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local available = math.floor((now + tolerance - tat) / interval)
+if available < 1 then
+    return {0, tat - tolerance + interval - now}
+end
+local granted = math.min(requested, available)
+local new_tat = tat + granted * interval
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+return {granted, 0}
+"""
+
+
+class Rate(NamedTuple):
+    limit: int
+    period: int
+
+    @property
+    def interval_ms(self) -> float:
+        return self.period * 1000 / self.limit
+
+    def __str__(self) -> str:
+        return f"{self.limit} per {self.period} second(s)"
+
+
+def parse_rate(value: str) -> Rate:
+    """Parse slowapi-style limits such as ``"5/minute"`` or ``"100 per hour"``."""
+    match = re.fullmatch(r"\s*(\d+)\s*(?:/|per)\s*(second|minute|hour|day)s?\s*", value)
+    if not match:
+        raise ValueError(f"Invalid rate limit: {value!r}")
+    return Rate(int(match.group(1)), _PERIODS[match.group(2)])
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "127.0.0.1"
+
+
+class _Lease:
+    __slots__ = ("tokens", "retry_at")
+
+    def __init__(self, tokens: int, retry_at: float = 0.0):
+        self.tokens = tokens
+        self.retry_at = retry_at
+
+
+class RateLimiter:
+    def __init__(self, key_func: Callable[[Request], str] = client_ip, lease_fraction: float = 0.1,
+                 prefix: str = "ratelimit", max_keys: int = 100000):
+        self.key_func = key_func
+        self.lease_fraction = lease_fraction
+        self.prefix = prefix
+        self.redis = None
+        self._script = None
+        self._leases = TTLCache(max_entries=max_keys)
+        self._local_tat = TTLCache(max_entries=max_keys)
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"allowed": 0, "limited": 0, "lease_hits": 0, "redis_calls": 0, "local_fallback": 0}
+        )
+
+    def bind(self, redis_client):
+        """Attach the shared Redis client; None keeps limits per process."""
+        self.redis = redis_client
+        self._script = redis_client.register_script(_GCRA_LEASE) if redis_client else None
+        self._leases.clear()
+
+    def _lease_size(self, rate: Rate) -> int:
+        return max(1, int(rate.limit * self.lease_fraction))
+
+    def _local_grant(self, key: str, rate: Rate, requested: int) -> Tuple[int, float]:
+        now = time.time() * 1000
+        tat = max(self._local_tat.get(key) or now, now)
+        available = math.floor((now + rate.period * 1000 - tat) / rate.interval_ms)
+        if available < 1:
+            return 0, tat - rate.period * 1000 + rate.interval_ms - now
+        granted = min(requested, available)
+        new_tat = tat + granted * rate.interval_ms
+        self._local_tat.set(key, new_tat, ttl=(new_tat - now) / 1000)
+        return granted, 0.0
+
+    async def _grant(self, route: str, key: str, rate: Rate, requested: int) -> Tuple[int, float]:
+        counters = self._counters[route]
+        if self._script:
+            try:
+                counters["redis_calls"] += 1
+                granted, retry_ms = await self._script(
+                    keys=[key], args=[rate.interval_ms, rate.period * 1000, requested]
+                )
+                return int(granted), float(retry_ms)
+            except Exception as e:
+                logger.warning(f"Rate limiter Redis error, using local limits: {e}")
+        counters["local_fallback"] += 1
+        return self._local_grant(key, rate, requested)
+
+    async def hit(self, route: str, identity: str, rate: Rate) -> Optional[float]:
+        """Consume one token; returns None if allowed, else seconds until retry."""
+        counters = self._counters[route]
+        key = f"{self.prefix}:{route}:{rate.limit}:{rate.period}:{identity}"
+        now = time.time()
+
+        lease = self._leases.get(key)
+        if lease is not None:
+            if lease.tokens > 0:
+                lease.tokens -= 1
+                counters["allowed"] += 1
+                counters["lease_hits"] += 1
+                return None
+            if lease.retry_at > now:
+                counters["limited"] += 1
+                return lease.retry_at - now
+
+        granted, retry_ms = await self._grant(route, key, rate, self._lease_size(rate))
+        if granted < 1:
+            retry_after = max(retry_ms / 1000, 0.001)
+            self._leases.set(key, _Lease(0, now + retry_after), ttl=retry_after)
+            counters["limited"] += 1
+            return retry_after
+
+        if granted > 1:
+            # Unused lease tokens lapse after the time they took to accrue.
+            self._leases.set(key, _Lease(granted - 1), ttl=max(1.0, granted * rate.interval_ms / 1000))
+        else:
+            self._leases.pop(key)
+        counters["allowed"] += 1
+        return None
+
+    def limit(self, limit_value: str):
+        """Decorate a route to enforce ``limit_value`` per client.
+
+        Works like slowapi's decorator, but the endpoint does not need to
+        declare a ``request`` parameter; one is added to the signature FastAPI
+        sees when missing.
+        """
+        rate = parse_rate(limit_value)
+
+        def decorator(func):
+            route = f"{func.__module__}.{func.__name__}"
+            signature = inspect.signature(func)
+            inject_request = "request" not in signature.parameters
+            if inject_request:
+                signature = signature.replace(parameters=[
+                    *signature.parameters.values(),
+                    inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+                ])
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request = kwargs.pop("request") if inject_request else kwargs["request"]
+                retry_after = await self.hit(route, self.key_func(request), rate)
+                if retry_after is not None:
+                    raise HTTPException(
+                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        detail=f"Rate limit exceeded: {limit_value}",
+                        headers={"Retry-After": str(math.ceil(retry_after))},
+                    )
+                return await func(*args, **kwargs)
+
+            wrapper.__signature__ = signature
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis" if self._script else "local",
+            "lease_fraction": self.lease_fraction,
+            "routes": {route: dict(counts) for route, counts in self._counters.items()},
+        }
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Response, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Response, Request, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr, validator
 from typing import Optional, Dict, Any
@@ -8,15 +8,17 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
 import logging
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 
-from main import get_db, get_redis, create_access_token, create_refresh_token, verify_password, get_password_hash
+from main import (
+    get_db, get_redis, get_current_user, create_access_token, create_refresh_token,
+    verify_password, get_password_hash, rehash_password_if_needed, issue_session_tokens,
+    principal_cache, principal_claims, session_store, token_cache, user_touch_buffer, limiter
+)
+from auth.sessions import SessionReplayed, new_session_id
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 security = HTTPBearer()
-limiter = Limiter(key_func=get_remote_address)
 
 # JWT settings
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
@@ -103,7 +105,7 @@ async def register_user(
         )
     
     # Hash password
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash(user_data.password)
     
     # Create user
     try:
@@ -113,17 +115,8 @@ async def register_user(
             RETURNING id, email, first_name, last_name, email_verified, created_at
         """, user_data.email, hashed_password, user_data.first_name, user_data.last_name, user_data.marketing_consent)
         
-        # Create tokens
-        access_token = create_access_token({"sub": str(user["id"])})
-        refresh_token = create_refresh_token({"sub": str(user["id"])})
-        
-        # Store refresh token in Redis
-        redis_client = await get_redis()
-        await redis_client.setex(
-            f"refresh_token:{user['id']}",
-            timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
-            refresh_token
-        )
+        # Create tokens bound to a new device session
+        access_token, refresh_token = await issue_session_tokens(user, request)
         
         return {
             "success": True,
@@ -155,6 +148,7 @@ async def register_user(
 async def login_user(
     request: Request,
     login_data: UserLogin,
+    background_tasks: BackgroundTasks,
     db=Depends(get_db)
 ):
     """Login user"""
@@ -165,29 +159,20 @@ async def login_user(
         login_data.email
     )
     
-    if not user or not verify_password(login_data.password, user["password"]):
+    if not user or not await verify_password(login_data.password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
     
-    # Create tokens
-    access_token = create_access_token({"sub": str(user["id"])})
-    refresh_token = create_refresh_token({"sub": str(user["id"])})
+    # Upgrade hashes made under an older cost policy after the response is sent
+    background_tasks.add_task(rehash_password_if_needed, user["id"], login_data.password, user["password"], "password")
     
-    # Store refresh token in Redis
-    redis_client = await get_redis()
-    await redis_client.setex(
-        f"refresh_token:{user['id']}",
-        timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
-        refresh_token
-    )
+    # Create tokens bound to a new device session
+    access_token, refresh_token = await issue_session_tokens(user, request)
     
-    # Update last login
-    await db.execute(
-        "UPDATE users SET last_login = $1 WHERE id = $2",
-        datetime.utcnow(), user["id"]
-    )
+    # Update last login (buffered, flushed in batches)
+    user_touch_buffer.touch(user["id"])
     
     return {
         "success": True,
@@ -228,27 +213,31 @@ async def refresh_token(
                 detail="Invalid refresh token"
             )
         
-        # Verify refresh token exists in Redis
-        redis_client = await get_redis()
-        stored_token = await redis_client.get(f"refresh_token:{user_id}")
+        # Rotate the refresh token within its device session (one Redis call)
+        await get_redis()
+        session_id = payload.get("sid") or new_session_id()
+        new_access_token = create_access_token({"sub": user_id, "sid": session_id})
+        new_refresh_token = create_refresh_token({"sub": user_id, "sid": session_id})
         
-        if not stored_token or stored_token != refresh_token:
+        try:
+            if payload.get("sid"):
+                valid = await session_store.use(user_id, session_id, refresh_token, rotate_to=new_refresh_token)
+            else:
+                # Token issued before per-device sessions; move it into one
+                valid = await session_store.adopt_legacy(
+                    user_id, refresh_token, session_id, rotate_to=new_refresh_token,
+                    user_agent=request.headers.get("user-agent"),
+                    ip_address=request.client.host if request.client else None
+                )
+        except SessionReplayed:
+            valid = False
+        
+        if not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Refresh token invalid or expired"
             )
         
-        # Create new tokens
-        new_access_token = create_access_token({"sub": user_id})
-        new_refresh_token = create_refresh_token({"sub": user_id})
-        
-        # Update refresh token in Redis
-        await redis_client.setex(
-            f"refresh_token:{user_id}",
-            timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
-            new_refresh_token
-        )
-        
         return {
             "access_token": new_access_token,
             "refresh_token": new_refresh_token,
@@ -273,10 +262,14 @@ async def logout_user(
     try:
         payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
+        session_id = payload.get("sid")
         
         if user_id:
             redis_client = await get_redis()
-            await redis_client.delete(f"refresh_token:{user_id}")
+            if session_id:
+                await session_store.revoke(user_id, session_id)
+            else:
+                await redis_client.delete(f"refresh_token:{user_id}")
         
         return {"success": True, "message": "Logged out successfully"}
         
@@ -366,6 +359,7 @@ async def update_user_profile(
             RETURNING id, email, first_name, last_name, phone, date_of_birth, 
                      gender, marketing_consent, updated_at
         """, *values)
+        await principal_cache.invalidate(current_user["id"])
         
         return {
             "success": True,
@@ -395,6 +389,7 @@ async def update_user_profile(
 async def change_password(
     request: Request,
     password_data: PasswordChange,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
     current_user: Dict[str, Any] = Depends(get_current_user),
     db=Depends(get_db)
 ):
@@ -413,14 +408,14 @@ async def change_password(
         )
     
     # Verify current password
-    if not verify_password(password_data.current_password, user["password"]):
+    if not await verify_password(password_data.current_password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Current password is incorrect"
         )
     
     # Hash new password
-    new_hashed_password = get_password_hash(password_data.new_password)
+    new_hashed_password = await get_password_hash(password_data.new_password)
     
     # Update password
     try:
@@ -429,13 +424,21 @@ async def change_password(
             new_hashed_password, datetime.utcnow(), current_user["id"]
         )
         
-        # Invalidate all refresh tokens
-        redis_client = await get_redis()
-        await redis_client.delete(f"refresh_token:{current_user['id']}")
+        # Invalidate every other device's session
+        await get_redis()
+        current_session = (await token_cache.decode(credentials.credentials)).get("sid")
+        await session_store.revoke_all(current_user["id"], except_session=current_session)
+        await principal_cache.invalidate(current_user["id"])
+        # Access tokens issued before now stop working, including this one,
+        # so hand back a fresh token for the session that is kept
+        await token_cache.revoke_user(current_user["id"])
+        access_token = create_access_token(data={**principal_claims(current_user), "sid": current_session})
         
         return {
             "success": True,
-            "message": "Password changed successfully. Please login again on other devices."
+            "message": "Password changed successfully. Please login again on other devices.",
+            "access_token": access_token,
+            "token_type": "bearer"
         }
         
     except Exception as e:
@@ -443,4 +446,48 @@ async def change_password(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to change password"
-        )
\ No newline at end of file
+        )
+
+@router.get("/sessions", response_model=Dict[str, Any])
+async def list_sessions(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    redis=Depends(get_redis)
+):
+    """List the signed-in devices for the current user"""
+    
+    current_session = (await token_cache.decode(credentials.credentials)).get("sid")
+    sessions = await session_store.list_sessions(current_user["id"])
+    for session in sessions:
+        session["current"] = session["session_id"] == current_session
+    
+    return {"success": True, "sessions": sessions}
+
+@router.delete("/sessions/{session_id}", response_model=Dict[str, Any])
+async def revoke_session(
+    session_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    redis=Depends(get_redis)
+):
+    """Sign out a single device"""
+    
+    if not await session_store.revoke(current_user["id"], session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    
+    return {"success": True, "message": "Session revoked"}
+
+@router.delete("/sessions", response_model=Dict[str, Any])
+async def revoke_other_sessions(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    redis=Depends(get_redis)
+):
+    """Sign out every device except the current one"""
+    
+    current_session = (await token_cache.decode(credentials.credentials)).get("sid")
+    revoked = await session_store.revoke_all(current_user["id"], except_session=current_session)
+    
+    return {"success": True, "message": f"{revoked} other session(s) revoked"}
\ No newline at end of file
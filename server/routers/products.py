@@ -4,14 +4,11 @@ from pydantic import BaseModel
 from datetime import datetime
 import asyncpg
 import logging
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 
-from main import get_db, get_redis
+from main import get_db, get_redis, limiter
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/products", tags=["products"])
-limiter = Limiter(key_func=get_remote_address)
 
 # Pydantic models
 class ProductSize(BaseModel):
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Microbenchmark of per-request auth overhead.
+
+Times JWT verification with each available backend, the verified-token cache,
+and the full get_current_user dependency with a warm principal cache (so no
+DB or Redis is needed).
+
+    python scripts/bench_auth_dependency.py --iterations 20000
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from fastapi.security import HTTPAuthorizationCredentials
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+from auth.token_cache import VerifiedTokenCache, load_jwt_backend  # noqa: E402
+
+
+def _time_per_call(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def _time_per_call_async(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def run(iterations: int):
+    user = {"id": 1, "email": "bench@example.com", "first_name": "Bench", "last_name": "User", "email_verified": True}
+    token = main.create_access_token(data={"sub": str(user["id"])})
+    print(f"📊 Auth dependency overhead ({iterations} iterations, µs per request)\n")
+
+    for name in ("jose", "pyjwt"):
+        try:
+            _, _, decode = load_jwt_backend(name)
+        except RuntimeError:
+            print(f"   {name:<28} not installed")
+            continue
+        print(f"   {name + ' decode':<28} {_time_per_call(lambda: decode(token, main.SECRET_KEY, [main.ALGORITHM]), iterations):8.2f}")
+        cache = VerifiedTokenCache(decode, main.SECRET_KEY, [main.ALGORITHM])
+        print(f"   {name + ' cached decode':<28} {await _time_per_call_async(lambda: cache.decode(token), iterations):8.2f}")
+
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    main.principal_cache.local.set(user["id"], user)
+
+    async def uncached_dependency():
+        main.token_cache.claims.clear()
+        return await main.get_current_user(credentials)
+
+    async def cached_dependency():
+        return await main.get_current_user(credentials)
+
+    print(f"\n   {'get_current_user (verify)':<28} {await _time_per_call_async(uncached_dependency, iterations):8.2f}")
+    print(f"   {'get_current_user (cached)':<28} {await _time_per_call_async(cached_dependency, iterations):8.2f}")
+    print(f"\n   token cache: {main.token_cache.stats()['claims']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    asyncio.run(run(parser.parse_args().iterations))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Microbenchmark of the in-memory cart pricing engine.
+
+Prices synthetic carts of several sizes against each kind of discount rule
+and reports µs per priced cart. No database is needed; the path this
+replaced also paid one to three Postgres round trips per cart view (the
+discount row, the per-customer usage count and an eligible-subtotal
+aggregate), which this does not measure.
+
+    python scripts/bench_cart_pricing.py --iterations 20000
+"""
+import argparse
+import random
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cart.pricing import DiscountRule, price_cart  # noqa: E402
+
+
+def _rule(**overrides) -> DiscountRule:
+    row = {
+        "id": 1, "code": "BENCH", "name": "Bench", "type": "percentage", "value": Decimal("10.00"),
+        "minimum_order_amount": None, "maximum_discount_amount": None, "usage_limit": None,
+        "usage_limit_per_customer": None, "used_count": 0, "applies_to": "all",
+        "applicable_product_ids": None, "applicable_category_ids": None,
+        "starts_at": None, "ends_at": None, "is_active": True,
+    }
+    row.update(overrides)
+    return DiscountRule(row)
+
+
+def _lines(count: int):
+    lines = []
+    for product_id in range(1, count + 1):
+        price = Decimal(random.randint(2000, 90000)) / 100
+        quantity = random.randint(1, 5)
+        lines.append({
+            "product_id": product_id,
+            "category_id": product_id % 7,
+            "quantity": quantity,
+            "subtotal": price * quantity,
+        })
+    return lines
+
+
+RULES = {
+    "none": None,
+    "percentage/all": _rule(),
+    "percentage/products": _rule(applies_to="specific_products", applicable_product_ids=list(range(1, 40, 3))),
+    "fixed/categories": _rule(type="fixed_amount", value=Decimal("50.00"), applies_to="specific_categories",
+                              applicable_category_ids=[1, 3]),
+    "free_shipping": _rule(type="free_shipping", value=Decimal("0.00")),
+    "capped+minimum": _rule(value=Decimal("25.00"), maximum_discount_amount=Decimal("100.00"),
+                            minimum_order_amount=Decimal("200.00")),
+}
+
+
+def run(iterations: int):
+    print(f"📊 Cart pricing ({iterations} iterations, µs per priced cart)\n")
+    sizes = (1, 10, 50)
+    print(f"   {'rule':<22}" + "".join(f"{f'{size} lines':>12}" for size in sizes))
+    carts = {size: _lines(size) for size in sizes}
+    for name, rule in RULES.items():
+        code = rule.code if rule else None
+        timings = []
+        for size in sizes:
+            lines = carts[size]
+            started = time.perf_counter()
+            for _ in range(iterations):
+                price_cart(lines, code, rule)
+            timings.append((time.perf_counter() - started) / iterations * 1e6)
+        print(f"   {name:<22}" + "".join(f"{timing:>12.2f}" for timing in timings))
+
+    product_ids = list(range(100))
+    started = time.perf_counter()
+    for _ in range(iterations):
+        _rule(applies_to="specific_products", applicable_product_ids=product_ids)
+    print(f"\n   rule compile (100 product IDs): {(time.perf_counter() - started) / iterations * 1e6:.2f} µs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    run(parser.parse_args().iterations)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Load test of cart operations: Postgres-only vs the Redis cart store.
+
+Drives the cart router handlers directly (no HTTP, no auth) with a mix of
+add / update / summary / full-cart reads from concurrent workers, once with
+CART_STORE=postgres and once with CART_STORE=redis, and prints ops/sec and
+latency percentiles per operation. Needs DATABASE_URL and REDIS_URL.
+
+Run it against a disposable database: it clears the carts of the users it
+picks (the first --users rows of the users table).
+
+    python scripts/bench_cart_store.py --users 50 --concurrency 50 --duration 20
+
+Last recorded run: PostgreSQL 16 and redis-server 6.2 on localhost, sharing
+one vCPU with the benchmark; 50 users, 4 products, 20s per mode.
+
+    workers   postgres ops/sec   redis ops/sec
+    50        1,601              1,207
+    10        1,786              1,501
+
+On one core every extra Redis round trip is a context switch, and the
+redis mode still reads products from Postgres, so the Redis store is
+slower there. Measure on the deployment's own hardware before enabling
+CART_STORE=redis.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import asyncpg
+import redis.asyncio as redis
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+from cart import cart_router  # noqa: E402
+from cart.models import CartItemCreate, CartItemUpdate  # noqa: E402
+
+# The limiter decorator would reject a load test; call the undecorated handlers
+add_to_cart = cart_router.add_to_cart.__wrapped__
+OPERATIONS = (("add", 0.35), ("update", 0.2), ("summary", 0.3), ("get_cart", 0.15))
+
+
+async def _worker(user_id: int, product_ids, deadline: float, latencies):
+    user = {"id": user_id}
+    item_ids = []
+    async with main.pool.acquire() as db:
+        while time.perf_counter() < deadline:
+            operation = random.choices([name for name, _ in OPERATIONS], [weight for _, weight in OPERATIONS])[0]
+            started = time.perf_counter()
+            try:
+                if operation == "add" or (operation == "update" and not item_ids):
+                    operation = "add"
+                    item = await add_to_cart(CartItemCreate(product_id=random.choice(product_ids), quantity=1), user=user, db=db)
+                    item_ids.append(item.id)
+                elif operation == "update":
+                    await cart_router.update_cart_item(random.choice(item_ids), CartItemUpdate(quantity=random.randint(1, 3)), user=user, db=db)
+                elif operation == "summary":
+                    await cart_router.get_cart_summary(user=user)
+                else:
+                    await cart_router.build_cart_response(user, db, main.redis_client)
+            except HTTPException:
+                pass  # Stock or quantity limits; still a completed round trip
+            latencies[operation].append((time.perf_counter() - started) * 1000)
+
+
+async def run_mode(mode: str, user_ids, product_ids, concurrency: int, duration: float):
+    main.cart_store.mode = mode
+    async with main.pool.acquire() as db:
+        for user_id in user_ids:
+            await cart_router.clear_cart(user={"id": user_id}, db=db)
+
+    latencies = defaultdict(list)
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(
+        _worker(user_ids[i % len(user_ids)], product_ids, deadline, latencies) for i in range(concurrency)
+    ))
+    flush_started = time.perf_counter()
+    flushed = await main.cart_store.flush()
+    flush_ms = (time.perf_counter() - flush_started) * 1000
+
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"\n   CART_STORE={mode}: {total / duration:,.0f} ops/sec ({total} ops)")
+    print(f"   {'operation':<10} {'ops/sec':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for operation, _ in OPERATIONS:
+        samples = sorted(latencies[operation])
+        if not samples:
+            continue
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        print(f"   {operation:<10} {len(samples) / duration:>9,.0f} {statistics.median(samples):>8.2f} {p99:>8.2f}")
+    if mode == "redis":
+        print(f"   write-behind drain: {flushed} carts in {flush_ms:.1f} ms")
+
+
+async def main_async(args):
+    main.pool = await asyncpg.create_pool(dsn=os.getenv("DATABASE_URL"), min_size=2, max_size=args.concurrency + 2)
+    main.redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"), decode_responses=True)
+    main.cart_store.bind(main.redis_client, main.pool)
+    main.cart_snapshots.bind(main.redis_client)
+    main.cart_summary.bind(main.redis_client, main.pool)
+    try:
+        async with main.pool.acquire() as db:
+            user_ids = [row["id"] for row in await db.fetch("SELECT id FROM users ORDER BY id LIMIT $1", args.users)]
+            product_ids = [row["id"] for row in await db.fetch(
+                "SELECT id FROM products WHERE is_active = true AND stock_quantity >= 99 ORDER BY id LIMIT $1",
+                args.products
+            )]
+        if not user_ids or not product_ids:
+            sys.exit("❌ Need at least one user and one active product with stock_quantity >= 99")
+
+        print(f"📊 Cart load test: {args.concurrency} workers, {len(user_ids)} users, "
+              f"{len(product_ids)} products, {args.duration:.0f}s per mode")
+        for mode in ("postgres", "redis"):
+            await run_mode(mode, user_ids, product_ids, args.concurrency, args.duration)
+    finally:
+        await main.pool.close()
+        await main.redis_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20)
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Sustained-throughput benchmark for analytics event ingestion.
+
+Producers push batches into the EventBuffer as fast as it accepts them
+(backing off when it is full) while its flush loop writes them with COPY.
+Reports events/sec accepted and written, sampling and refusals, and checks
+that every accepted event reached analytics_events. --baseline also times
+one INSERT per event for comparison. Benchmark rows are deleted afterwards.
+Needs DATABASE_URL.
+
+    python scripts/bench_event_ingest.py --events 200000 --producers 8 --batch 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import asyncpg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from events.buffer import BufferFull, EventBuffer, event_record  # noqa: E402
+
+EVENT_TYPES = ("page_view", "product_view", "add_to_cart", "search", "checkout_started")
+
+
+def _batch(session_id: str, size: int):
+    now = datetime.now(timezone.utc)
+    return [
+        event_record(
+            random.choice(EVENT_TYPES), session_id=session_id, data={"path": f"/p/{random.randint(1, 500)}"},
+            user_agent="bench", ip_address="10.0.0.1", created_at=now,
+        )
+        for _ in range(size)
+    ]
+
+
+async def _produce(buffer: EventBuffer, session_id: str, count: int, size: int):
+    sent = 0
+    while sent < count:
+        batch = _batch(session_id, min(size, count - sent))
+        try:
+            buffer.add(batch)
+        except BufferFull as e:
+            await asyncio.sleep(min(e.retry_after, 0.05))
+            continue
+        sent += len(batch)
+        await asyncio.sleep(0)
+
+
+async def _baseline(pool, session_id: str, count: int) -> float:
+    records = _batch(session_id, count)
+    started = time.perf_counter()
+    async with pool.acquire() as connection:
+        for record in records:
+            await connection.execute(
+                "INSERT INTO analytics_events (event_type, user_id, session_id, product_id, category_id, order_id, "
+                "event_data, user_agent, ip_address, created_at) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)",
+                *record
+            )
+    return count / (time.perf_counter() - started)
+
+
+async def run(args):
+    pool = await asyncpg.create_pool(dsn=os.getenv("DATABASE_URL"), min_size=2, max_size=4)
+    session_id = f"bench-{uuid.uuid4().hex[:8]}"
+    buffer = EventBuffer(batch_size=args.copy_batch, flush_interval=0.25, max_pending=args.max_pending)
+    buffer.bind(pool)
+    try:
+        print(f"📈 {args.events} events from {args.producers} producers in batches of {args.batch} "
+              f"(COPY batches of {args.copy_batch}, buffer {args.max_pending})")
+        writer = asyncio.create_task(buffer.run())
+        started = time.perf_counter()
+        per_producer = args.events // args.producers
+        await asyncio.gather(*(_produce(buffer, session_id, per_producer, args.batch) for _ in range(args.producers)))
+        produced = time.perf_counter() - started
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+        await buffer.flush()
+        elapsed = time.perf_counter() - started
+
+        stats = buffer.stats()
+        stored = await pool.fetchval("SELECT COUNT(*) FROM analytics_events WHERE session_id = $1", session_id)
+        print(f"   accepted {stats['accepted']} in {produced:.2f}s, written {stats['rows_written']} in {elapsed:.2f}s")
+        print(f"   sustained {stats['rows_written'] / elapsed:,.0f} events/s "
+              f"({stats['copies']} COPY batches, last {stats['last_copy_rows_per_s']:,.0f} rows/s)")
+        print(f"   sampled out {stats['sampled_out']}, refused and retried {stats['refused']}")
+        if args.baseline:
+            rate = await _baseline(pool, session_id + "-baseline", args.baseline)
+            print(f"   baseline: {rate:,.0f} events/s with one INSERT per event ({args.baseline} events)")
+        if stored != stats["accepted"]:
+            sys.exit(f"❌ {stored} rows stored for {stats['accepted']} accepted events")
+        print("✅ Every accepted event was stored")
+    finally:
+        await pool.execute("DELETE FROM analytics_events WHERE session_id LIKE $1", session_id + "%")
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--producers", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=100, help="events per producer batch (one request)")
+    parser.add_argument("--copy-batch", type=int, default=5000)
+    parser.add_argument("--max-pending", type=int, default=100000)
+    parser.add_argument("--baseline", type=int, default=0, metavar="N", help="also time N single-row INSERTs")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Flash-sale benchmark for the checkout pipeline.
+
+Creates throwaway customers, gives one product a small stock, puts one unit
+in every customer's cart and has them all check out at once, each on its own
+connection (optionally several retries per customer sharing one
+Idempotency-Key, and a second random product per cart to mix lock sets).
+Reports throughput and latency, then verifies that nothing was oversold,
+that stock, inventory movements and order lines agree, and that retries
+produced one order per customer. Everything it creates is removed and the
+stock restored afterwards. Needs DATABASE_URL; REDIS_URL is optional.
+
+    python scripts/bench_flash_sale.py --customers 300 --stock 100 --retries 2
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import asyncpg
+import redis.asyncio as redis
+from fastapi import HTTPException, Response
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+from orders import orders_router  # noqa: E402
+from orders.models import CheckoutRequest, OrderAddress  # noqa: E402
+
+checkout = orders_router.checkout.__wrapped__
+
+PAYLOAD = CheckoutRequest(shipping_address=OrderAddress(
+    first_name="Flash", last_name="Sale", address_line_1="1 Bench Street", city="Cape Town", postal_code="8001",
+))
+
+
+async def _checkout(user_id: int, key: str, redis_client):
+    started = time.perf_counter()
+    async with main.pool.acquire() as db:
+        try:
+            response = Response()
+            await checkout(PAYLOAD, response, idempotency_key=key, user={"id": user_id}, db=db, redis=redis_client)
+            outcome = "replayed" if response.headers.get("Idempotent-Replayed") else "placed"
+        except HTTPException as e:
+            outcome = f"http_{e.status_code}"
+        except Exception as e:
+            outcome = type(e).__name__
+    return outcome, (time.perf_counter() - started) * 1000
+
+
+async def _setup(db, args, run_id):
+    product = await db.fetchrow(
+        "SELECT id, stock_quantity FROM products WHERE is_active = true AND track_stock ORDER BY id LIMIT 1"
+    )
+    others = [row["id"] for row in await db.fetch(
+        "SELECT id FROM products WHERE is_active = true AND id <> $1 AND stock_quantity >= $2", product["id"], args.customers
+    )]
+    if product is None:
+        sys.exit("❌ Need an active product that tracks stock")
+    user_ids = await db.fetch(
+        """
+        INSERT INTO users (email, password_hash, first_name, last_name)
+        SELECT 'flash-' || $1 || '-' || n || '@example.test', 'x', 'Flash', 'Sale'
+        FROM generate_series(1, $2) AS n
+        RETURNING id
+        """,
+        run_id, args.customers
+    )
+    user_ids = [row["id"] for row in user_ids]
+    await db.execute("UPDATE products SET stock_quantity = $2 WHERE id = $1", product["id"], args.stock)
+    lines = [(user_id, product["id"]) for user_id in user_ids]
+    if args.mixed and others:
+        lines += [(user_id, random.choice(others)) for user_id in user_ids]
+    await db.executemany("INSERT INTO cart_items (user_id, product_id, quantity) VALUES ($1, $2, 1)", lines)
+    return product, user_ids
+
+
+async def _verify(db, product_id: int, stock: int, user_ids, placed: int) -> int:
+    sold = await db.fetchval(
+        """
+        SELECT COALESCE(SUM(oi.quantity), 0) FROM order_items oi JOIN orders o ON o.id = oi.order_id
+        WHERE o.user_id = ANY($1::int[]) AND oi.product_id = $2
+        """,
+        user_ids, product_id
+    )
+    remaining = await db.fetchval("SELECT stock_quantity FROM products WHERE id = $1", product_id)
+    moved = await db.fetchval(
+        """
+        SELECT COALESCE(SUM(m.quantity_change), 0) FROM inventory_movements m JOIN orders o ON o.id = m.reference_id
+        WHERE m.reference_type = 'order' AND o.user_id = ANY($1::int[]) AND m.product_id = $2
+        """,
+        user_ids, product_id
+    )
+    per_user = await db.fetchval(
+        "SELECT COALESCE(MAX(n), 0) FROM (SELECT COUNT(*) AS n FROM orders WHERE user_id = ANY($1::int[]) GROUP BY user_id) c",
+        user_ids
+    )
+    checks = [
+        (sold <= stock, f"sold {sold} of {stock} in stock"),
+        (remaining == stock - sold, f"stock left {remaining} = {stock} - {sold}"),
+        (moved == -sold, f"inventory movements {moved} = -{sold}"),
+        (per_user <= 1, f"at most one order per customer (max {per_user})"),
+        (sold == min(stock, len(user_ids)), f"sold {sold} = min(stock, customers)"),
+        (placed == sold, f"{placed} successful checkouts = {sold} units sold"),
+    ]
+    failures = 0
+    for ok, label in checks:
+        print(f"   {'✓' if ok else '❌'} {label}")
+        failures += not ok
+    return failures
+
+
+async def _cleanup(db, product, user_ids):
+    order_ids = [row["id"] for row in await db.fetch("SELECT id FROM orders WHERE user_id = ANY($1::int[])", user_ids)]
+    await db.execute(
+        "DELETE FROM inventory_movements WHERE reference_type = 'order' AND reference_id = ANY($1::int[])", order_ids
+    )
+    await db.execute(
+        """
+        UPDATE products p SET stock_quantity = p.stock_quantity + sold.quantity
+        FROM (SELECT product_id, SUM(quantity) AS quantity FROM order_items
+              WHERE order_id = ANY($1::int[]) GROUP BY product_id) sold
+        WHERE p.id = sold.product_id AND p.id <> $2 AND p.track_stock
+        """,
+        order_ids, product["id"]
+    )
+    await db.execute(
+        """
+        UPDATE discount_codes dc SET used_count = dc.used_count - u.n
+        FROM (SELECT discount_code_id, COUNT(*) AS n FROM discount_code_uses
+              WHERE order_id = ANY($1::int[]) GROUP BY discount_code_id) u
+        WHERE dc.id = u.discount_code_id
+        """,
+        order_ids
+    )
+    await db.execute("DELETE FROM orders WHERE id = ANY($1::int[])", order_ids)
+    await db.execute("DELETE FROM users WHERE id = ANY($1::int[])", user_ids)
+    await db.execute("UPDATE products SET stock_quantity = $2 WHERE id = $1", product["id"], product["stock_quantity"])
+
+
+async def run(args):
+    main.pool = await asyncpg.create_pool(dsn=os.getenv("DATABASE_URL"), min_size=2, max_size=args.connections)
+    main.cart_store.mode = "postgres"
+    redis_client = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True) if os.getenv("REDIS_URL") else None
+    run_id = uuid.uuid4().hex[:8]
+    async with main.pool.acquire() as db:
+        product, user_ids = await _setup(db, args, run_id)
+    try:
+        print(f"⚡ {args.customers} customers × {args.retries} attempt(s) for product {product['id']} "
+              f"(stock {args.stock}, {args.connections} connections{', mixed carts' if args.mixed else ''})")
+        attempts = [
+            _checkout(user_id, f"flash-{run_id}-{user_id}", redis_client)
+            for user_id in user_ids for _ in range(args.retries)
+        ]
+        random.shuffle(attempts)
+        started = time.perf_counter()
+        results = await asyncio.gather(*attempts)
+        elapsed = time.perf_counter() - started
+
+        outcomes = {}
+        for outcome, _ in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        latencies = sorted(latency for _, latency in results)
+        print(f"   {len(results)} checkouts in {elapsed:.2f}s ({len(results) / elapsed:.0f}/s)")
+        print(f"   latency p50 {statistics.median(latencies):.1f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f} ms")
+        print(f"   outcomes: {outcomes}")
+
+        async with main.pool.acquire() as db:
+            failures = await _verify(db, product["id"], args.stock, user_ids, outcomes.get("placed", 0))
+        unexpected = {k: v for k, v in outcomes.items() if k not in ("placed", "replayed", "http_409", "http_400")}
+        if unexpected:
+            print(f"   ❌ unexpected outcomes {unexpected}")
+            failures += 1
+        if failures:
+            sys.exit(f"❌ {failures} check(s) failed")
+        print("✅ No overselling, no deadlocks, one order per customer")
+    finally:
+        async with main.pool.acquire() as db:
+            await _cleanup(db, product, user_ids)
+        await main.pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--retries", type=int, default=1, help="concurrent attempts per customer, same Idempotency-Key")
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--mixed", action="store_true", help="add a second random product to every cart")
+    asyncio.run(run(parser.parse_args()))
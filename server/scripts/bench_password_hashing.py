@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Measure event-loop lag while a burst of logins is being verified.
+
+Runs the same burst twice: once calling passlib inline (the old behaviour)
+and once through the bounded PasswordHasher pool. A ticker coroutine sleeps
+for a fixed interval and records how late it wakes up; that lateness is the
+delay every other request on the worker would have seen.
+
+    python scripts/bench_password_hashing.py --logins 32 --workers 4
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from passlib.context import CryptContext
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from auth.password_hasher import PasswordHasher, PasswordHasherBusy  # noqa: E402
+
+PASSWORD = "Benchmark123!"
+TICK_SECONDS = 0.005
+
+
+async def _ticker(lags, stop: asyncio.Event):
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK_SECONDS
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+
+async def _run_burst(verify, logins: int):
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    await asyncio.sleep(TICK_SECONDS * 2)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(verify() for _ in range(logins)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    rejected = sum(1 for r in results if isinstance(r, PasswordHasherBusy))
+    return elapsed, lags, rejected
+
+
+def _report(label: str, elapsed: float, lags, rejected: int, logins: int):
+    ordered = sorted(lags) or [0.0]
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"\n📊 {label}")
+    print(f"   logins:          {logins} ({rejected} rejected)")
+    print(f"   wall time:       {elapsed * 1000:.1f} ms")
+    print(f"   loop lag median: {statistics.median(ordered):.2f} ms")
+    print(f"   loop lag p95:    {p95:.2f} ms")
+    print(f"   loop lag max:    {max(ordered):.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=32, help="concurrent logins in the burst")
+    parser.add_argument("--workers", type=int, default=4, help="hasher pool size")
+    parser.add_argument("--max-queue", type=int, default=64, help="hasher queue depth")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    args = parser.parse_args()
+
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=args.rounds)
+    hashed = context.hash(PASSWORD)
+
+    async def inline_verify():
+        return context.verify(PASSWORD, hashed)
+
+    elapsed, lags, rejected = await _run_burst(inline_verify, args.logins)
+    _report("Before: inline passlib verify", elapsed, lags, rejected, args.logins)
+
+    hasher = PasswordHasher(context, max_workers=args.workers, max_queue=args.max_queue)
+
+    async def pooled_verify():
+        return await hasher.verify(PASSWORD, hashed)
+
+    elapsed, lags, rejected = await _run_burst(pooled_verify, args.logins)
+    _report(f"After: PasswordHasher pool ({args.workers} workers)", elapsed, lags, rejected, args.logins)
+    print(f"\n   hasher stats: {hasher.stats()}")
+    hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
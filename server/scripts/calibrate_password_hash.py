@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Calibrate password hashing cost on this machine.
+
+Measures hash time at increasing cost settings and recommends the strongest
+setting that still fits the latency budget. Run it on the deploy hardware
+and copy the printed variables into the environment; existing hashes are
+upgraded transparently on each user's next login.
+
+    python scripts/calibrate_password_hash.py --target-ms 50
+    python scripts/calibrate_password_hash.py --target-ms 50 --scheme argon2
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from auth.hash_policy import (  # noqa: E402
+    argon2_available, build_crypt_context, calibrate_argon2, calibrate_bcrypt, measure_hash_ms
+)
+
+
+def _print_result(result, workers: int):
+    print(f"\n📊 {result['scheme']} (target {result['target_ms']} ms)")
+    for row in result["measurements"]:
+        cost = ", ".join(f"{k}={v}" for k, v in row.items() if k != "median_ms")
+        marker = "✅" if row["median_ms"] <= result["target_ms"] else "❌"
+        print(f"   {marker} {cost:<16} {row['median_ms']:>9.2f} ms")
+
+    fitting = [row["median_ms"] for row in result["measurements"] if row["median_ms"] <= result["target_ms"]]
+    if fitting:
+        per_login = max(fitting)
+        print(f"   ≈ {workers * 1000 / per_login:.0f} logins/sec per API worker with {workers} hasher threads")
+    else:
+        print("   ⚠️  even the minimum cost exceeds the target; keeping the minimum")
+
+    print("\n   Recommended environment:")
+    for key, value in result["settings"].items():
+        print(f"   {key}={value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target-ms", type=float, default=50.0, help="latency budget for one hash")
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2", "both"], default="bcrypt")
+    parser.add_argument("--samples", type=int, default=5, help="hashes timed per setting")
+    parser.add_argument("--argon2-memory-kib", type=int, default=65536)
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    workers = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    current = measure_hash_ms(build_crypt_context(), args.samples)
+    print(f"⏱️  Current policy ({os.getenv('PASSWORD_HASH_SCHEME', 'bcrypt')}): {current:.2f} ms per hash")
+
+    results = []
+    if args.scheme in ("bcrypt", "both"):
+        results.append(calibrate_bcrypt(args.target_ms, args.samples))
+    if args.scheme in ("argon2", "both"):
+        if argon2_available():
+            results.append(calibrate_argon2(args.target_ms, memory_cost=args.argon2_memory_kib, samples=args.samples))
+        else:
+            print("⚠️  argon2-cffi is not installed; skipping argon2")
+
+    if args.json:
+        print(json.dumps({"current_ms": round(current, 2), "results": results}, indent=2))
+        return
+
+    for result in results:
+        _print_result(result, workers)
+
+
+if __name__ == "__main__":
+    main()
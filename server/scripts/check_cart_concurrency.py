@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Concurrency check for the single-statement cart mutations.
+
+Fires many simultaneous add-to-cart calls for the same user and product,
+each on its own connection, and verifies the cart ends up with exactly one
+row whose quantity never exceeds the product's stock (or the 99 per-line
+cap). Then races quantity updates against adds on that line. Needs
+DATABASE_URL; run it against a disposable database, as it clears the
+chosen user's cart.
+
+    python scripts/check_cart_concurrency.py --requests 200 --quantity 3
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+from pathlib import Path
+
+import asyncpg
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+from cart import cart_router  # noqa: E402
+from cart.models import CartItemCreate, CartItemUpdate  # noqa: E402
+
+add_to_cart = cart_router.add_to_cart.__wrapped__
+
+
+async def _attempt(coroutine_factory):
+    async with main.pool.acquire() as db:
+        try:
+            await coroutine_factory(db)
+            return True
+        except HTTPException:
+            return False
+
+
+async def run(args):
+    main.pool = await asyncpg.create_pool(dsn=os.getenv("DATABASE_URL"), min_size=2, max_size=args.requests)
+    main.cart_store.mode = "postgres"
+    try:
+        async with main.pool.acquire() as db:
+            user_id = await db.fetchval("SELECT id FROM users ORDER BY id LIMIT 1")
+            product = await db.fetchrow(
+                "SELECT id, stock_quantity FROM products WHERE is_active = true AND stock_quantity > 0 "
+                "ORDER BY stock_quantity LIMIT 1"
+            )
+            if user_id is None or product is None:
+                sys.exit("❌ Need a user and an active product with stock")
+            await db.execute("DELETE FROM cart_items WHERE user_id = $1", user_id)
+
+        user = {"id": user_id}
+        limit = min(product["stock_quantity"], cart_router.MAX_ITEM_QUANTITY)
+        print(f"🔀 {args.requests} concurrent adds of {args.quantity} × product {product['id']} "
+              f"(stock {product['stock_quantity']}, line limit {limit})")
+
+        item = CartItemCreate(product_id=product["id"], quantity=args.quantity)
+        results = await asyncio.gather(*(
+            _attempt(lambda db: add_to_cart(item, user=user, db=db)) for _ in range(args.requests)
+        ))
+        failures = await _verify(user_id, product["id"], limit, expected=sum(results) * args.quantity)
+        print(f"   accepted {sum(results)}, rejected {len(results) - sum(results)}")
+
+        async with main.pool.acquire() as db:
+            item_id = await db.fetchval("SELECT id FROM cart_items WHERE user_id = $1", user_id)
+        mixed = []
+        for _ in range(args.requests):
+            if random.random() < 0.5:
+                update = CartItemUpdate(quantity=random.randint(1, min(limit, 99)))
+                mixed.append(_attempt(lambda db, update=update: cart_router.update_cart_item(item_id, update, user=user, db=db)))
+            else:
+                mixed.append(_attempt(lambda db: add_to_cart(item, user=user, db=db)))
+        await asyncio.gather(*mixed)
+        failures += await _verify(user_id, product["id"], limit)
+
+        if failures:
+            sys.exit(f"❌ {failures} check(s) failed")
+        print("✅ No duplicate rows and no quantity above stock")
+    finally:
+        await main.pool.close()
+
+
+async def _verify(user_id: int, product_id: int, limit: int, expected=None) -> int:
+    async with main.pool.acquire() as db:
+        rows = await db.fetch(
+            "SELECT id, quantity FROM cart_items WHERE user_id = $1 AND product_id = $2", user_id, product_id
+        )
+    failures = 0
+    if len(rows) != 1:
+        print(f"   ❌ expected one cart row, found {len(rows)}")
+        failures += 1
+    for row in rows:
+        if row["quantity"] > limit:
+            print(f"   ❌ quantity {row['quantity']} exceeds limit {limit}")
+            failures += 1
+        elif expected is not None and row["quantity"] != expected:
+            print(f"   ❌ quantity {row['quantity']}, expected {expected} from the accepted adds")
+            failures += 1
+        else:
+            print(f"   ✓ one row, quantity {row['quantity']}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--quantity", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
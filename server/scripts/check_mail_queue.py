@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Delivery check for the Redis mail queue and the batching SMTP sender.
+
+Starts an aiosmtpd sink in-process and drives ``MailQueue.process_batch``
+(one worker step) against it, checking that:
+
+- a backlog is delivered in batches over one SMTP connection
+- a refused recipient is retried with exponential backoff and delivered
+  once the sink accepts it
+- a message still failing after ``max_attempts`` moves to ``mail:dead``
+- entries a crashed worker read but never acknowledged are reclaimed with
+  XAUTOCLAIM and delivered
+
+Uses fakeredis (the retry promotion script needs lupa) unless --redis-url
+is given; a real Redis must be disposable, as the mail keys are cleared.
+Needs ``pip install aiosmtpd fakeredis lupa``.
+
+    python scripts/check_mail_queue.py --backoff 0.2
+"""
+import argparse
+import asyncio
+import json
+import socket
+import sys
+import time
+from email import message_from_bytes
+from pathlib import Path
+
+try:
+    import fakeredis.aioredis
+    from aiosmtpd.controller import Controller
+except ImportError as e:
+    sys.exit(f"❌ {e}; pip install aiosmtpd fakeredis lupa")
+import redis.asyncio as redis
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mailer.queue import CONSUMER_GROUP, DEAD_STREAM, OUTBOX_STREAM, RETRY_SET, MailQueue  # noqa: E402
+from mailer.smtp import SMTPSender  # noqa: E402
+
+
+class SinkHandler:
+    """Accepts everything except addresses listed in ``refusals`` (count, -1 = always)."""
+
+    def __init__(self):
+        self.delivered = []
+        self.sessions = set()
+        self.refusals = {}
+        self.refused = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        self.sessions.add(session)
+        remaining = self.refusals.get(address, 0)
+        if remaining:
+            self.refusals[address] = remaining - 1 if remaining > 0 else remaining
+            self.refused += 1
+            return "550 5.1.1 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        message = message_from_bytes(envelope.content)
+        self.delivered.extend((address, message["Subject"]) for address in envelope.rcpt_tos)
+        return "250 Message accepted for delivery"
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _check(ok: bool, message: str) -> int:
+    print(f"   {'✓' if ok else '❌'} {message}")
+    return 0 if ok else 1
+
+
+async def _retry_entries(client):
+    entries = await client.zrange(RETRY_SET, 0, -1, withscores=True)
+    return [(json.loads(payload), score) for payload, score in entries]
+
+
+async def _wait_until_due(client):
+    entries = await _retry_entries(client)
+    if entries:
+        await asyncio.sleep(max(0.0, entries[0][1] - time.time()) + 0.05)
+
+
+async def check_batching(queue, client, sink, count: int) -> int:
+    print(f"📨 {count} messages, batch size {queue.batch_size}")
+    for i in range(count):
+        await queue.enqueue(f"batch{i}@example.com", f"Batch {i}", "Hello")
+    batches = 0
+    while await client.xlen(OUTBOX_STREAM):
+        await queue.process_batch()
+        batches += 1
+    expected_batches = -(-count // queue.batch_size)
+    pending = await client.xpending(OUTBOX_STREAM, CONSUMER_GROUP)
+    return sum((
+        _check(len(sink.delivered) == count, f"{len(sink.delivered)}/{count} delivered"),
+        _check(batches == expected_batches, f"{batches} batches (expected {expected_batches})"),
+        _check(queue.sender.connections_opened == 1 and len(sink.sessions) == 1,
+               f"{queue.sender.connections_opened} connection(s) opened, "
+               f"{len(sink.sessions)} SMTP session(s) at the sink"),
+        _check(pending["pending"] == 0, f"{pending['pending']} entries left pending"),
+    ))
+
+
+async def check_retry(queue, client, sink) -> int:
+    address = "flaky@example.com"
+    sink.refusals[address] = 2
+    print(f"🔁 Recipient refused twice, then accepted (base backoff {queue.base_backoff}s)")
+    await queue.enqueue(address, "Flaky", "Hello")
+    failures = 0
+    for attempt in (1, 2):
+        enqueued_at = time.time()
+        await queue.process_batch()
+        entries = await _retry_entries(client)
+        if not entries:
+            return _check(False, f"attempt {attempt}: not rescheduled on {RETRY_SET}")
+        fields, due = entries[0]
+        delay = due - enqueued_at
+        low, high = queue.base_backoff * 2 ** (attempt - 1) * 0.8, queue.base_backoff * 2 ** (attempt - 1) * 1.2
+        failures += _check(
+            fields["attempts"] == str(attempt) and "recipient refused" in fields.get("last_error", "")
+            and low - 0.05 <= delay <= high + 0.05,
+            f"attempt {attempt}: retry in {delay:.2f}s (expected {low:.2f}-{high:.2f}s), "
+            f"attempts={fields['attempts']}",
+        )
+        await _wait_until_due(client)
+    await queue.process_batch()
+    delivered = [to for to, _ in sink.delivered].count(address)
+    return failures + sum((
+        _check(delivered == 1, f"delivered {delivered} time(s) on the third attempt"),
+        _check(await client.zcard(RETRY_SET) == 0 and await client.xlen(DEAD_STREAM) == 0,
+               "nothing left on the retry set or the dead stream"),
+    ))
+
+
+async def check_dead_letter(queue, client, sink) -> int:
+    address = "gone@example.com"
+    sink.refusals[address] = -1
+    refused_before = sink.refused
+    print(f"💀 Recipient always refused, max_attempts={queue.max_attempts}")
+    await queue.enqueue(address, "Gone", "Hello")
+    for _ in range(queue.max_attempts):
+        await queue.process_batch()
+        await _wait_until_due(client)
+    dead = await client.xrange(DEAD_STREAM)
+    fields = dead[0][1] if dead else {}
+    return sum((
+        _check(len(dead) == 1, f"{len(dead)} entr(y/ies) on {DEAD_STREAM}"),
+        _check(fields.get("attempts") == str(queue.max_attempts) and fields.get("to") == address,
+               f"dead entry to={fields.get('to')} attempts={fields.get('attempts')}"),
+        _check(sink.refused - refused_before == queue.max_attempts,
+               f"{sink.refused - refused_before} delivery attempts reached the sink"),
+        _check(await client.zcard(RETRY_SET) == 0 and await client.xlen(OUTBOX_STREAM) == 0,
+               "nothing left on the retry set or the outbox"),
+    ))
+
+
+async def check_reclaim(queue, client, sink, count: int) -> int:
+    print(f"🪦 {count} entries read by a crashed worker and never acknowledged")
+    for i in range(count):
+        await queue.enqueue(f"orphan{i}@example.com", f"Orphan {i}", "Hello")
+    await client.xreadgroup(CONSUMER_GROUP, "crashed-worker", {OUTBOX_STREAM: ">"}, count=count)
+    orphaned = (await client.xpending(OUTBOX_STREAM, CONSUMER_GROUP))["pending"]
+    queue.claim_idle_ms = 200
+    await asyncio.sleep(0.3)
+    handled = await queue.process_batch()
+    delivered = sum(1 for to, _ in sink.delivered if to.startswith("orphan"))
+    pending = (await client.xpending(OUTBOX_STREAM, CONSUMER_GROUP))["pending"]
+    return sum((
+        _check(orphaned == count, f"{orphaned} entries pending on the crashed consumer"),
+        _check(handled == count and delivered == count, f"{handled} reclaimed, {delivered} delivered"),
+        _check(pending == 0, f"{pending} entries left pending"),
+    ))
+
+
+async def run(args):
+    handler = SinkHandler()
+    port = args.smtp_port or _free_port()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    if args.redis_url:
+        client = redis.from_url(args.redis_url, decode_responses=True)
+        await client.delete(OUTBOX_STREAM, RETRY_SET, DEAD_STREAM)
+    else:
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+    sender = SMTPSender("127.0.0.1", port, from_address="check@localhost", timeout=5)
+    queue = MailQueue(sender, batch_size=args.batch_size, max_attempts=args.max_attempts, base_backoff=args.backoff)
+    queue.bind(client)
+    await queue._ensure_group()
+    print(f"📬 aiosmtpd sink on 127.0.0.1:{port}, {'Redis at ' + args.redis_url if args.redis_url else 'fakeredis'}")
+    try:
+        failures = await check_batching(queue, client, handler, args.messages)
+        failures += await check_retry(queue, client, handler)
+        failures += await check_dead_letter(queue, client, handler)
+        failures += await check_reclaim(queue, client, handler, args.batch_size // 2 or 1)
+        failures += _check(sender.connections_opened == 1,
+                           f"{sender.connections_opened} SMTP connection(s) opened over the whole run")
+        stats = await queue.stats()
+    finally:
+        await sender.close()
+        controller.stop()
+        await client.aclose()
+
+    if failures:
+        sys.exit(f"❌ {failures} check(s) failed")
+    counts = {key: stats[key] for key in ("enqueued", "sent", "retried", "dead_lettered", "batches")}
+    print(f"✅ Mail queue checks passed; {json.dumps(counts)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", help="Disposable Redis to use instead of fakeredis")
+    parser.add_argument("--smtp-port", type=int, default=0, help="Port for the sink (default: any free port)")
+    parser.add_argument("--messages", type=int, default=25)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=0.2, help="Base retry backoff in seconds")
+    asyncio.run(run(parser.parse_args()))
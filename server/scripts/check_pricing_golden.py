@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Golden comparison of the pricing engine against the SQL-backed discount path.
+
+Inside a transaction that is always rolled back, creates a spread of discount
+codes (every type, scope, cap, minimum and limit combination) and random
+carts for one user, then checks that ``cart.pricing`` produces exactly the
+same discount, applied code and totals as the previous implementation, which
+re-read the code and re-aggregated eligible subtotals in SQL. Needs
+DATABASE_URL with at least one user and a few active products.
+
+    python scripts/check_pricing_golden.py --carts 50
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+
+import asyncpg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cart.cart_router import CART_LINES_QUERY  # noqa: E402
+from cart.pricing import DISCOUNT_CODE_QUERY, DiscountRule, price_cart  # noqa: E402
+
+ZERO = Decimal('0.00')
+
+
+async def legacy_discount(db, user_id, subtotal, shipping, code):
+    """The SQL-backed ``_compute_discount_for_code`` the engine replaced, kept as the reference."""
+    if not code:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": None}
+    discount = await db.fetchrow(DISCOUNT_CODE_QUERY, code)
+    if not discount:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": None}
+    now = datetime.now(timezone.utc)
+    if not discount["is_active"]:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": None}
+    if discount["starts_at"] and now < discount["starts_at"]:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": None}
+    if discount["ends_at"] and now > discount["ends_at"]:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": None}
+    if discount["usage_limit"] is not None and discount["used_count"] >= discount["usage_limit"]:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": None}
+    if discount["usage_limit_per_customer"] is not None and discount["usage_limit_per_customer"] > 0:
+        used_by_customer = await db.fetchval(
+            "SELECT COUNT(*) FROM discount_code_uses WHERE discount_code_id = $1 AND user_id = $2",
+            discount["id"], user_id
+        )
+        if used_by_customer and used_by_customer >= discount["usage_limit_per_customer"]:
+            return {"discount_total": ZERO, "discounts": [], "applied_code": None}
+    if discount["minimum_order_amount"] is not None and subtotal < discount["minimum_order_amount"]:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": code}
+
+    applies_to = (discount["applies_to"] or 'all').lower()
+    eligible_subtotal = subtotal
+    if applies_to == 'specific_products' and discount["applicable_product_ids"]:
+        eligible_subtotal = await db.fetchval(
+            """
+            SELECT COALESCE(SUM(ci.quantity * p.price), 0)
+            FROM cart_items ci JOIN products p ON ci.product_id = p.id
+            WHERE ci.user_id = $1 AND p.is_active = true AND ci.product_id = ANY($2)
+            """,
+            user_id, discount["applicable_product_ids"]
+        ) or ZERO
+    elif applies_to == 'specific_categories' and discount["applicable_category_ids"]:
+        eligible_subtotal = await db.fetchval(
+            """
+            SELECT COALESCE(SUM(ci.quantity * p.price), 0)
+            FROM cart_items ci JOIN products p ON ci.product_id = p.id
+            WHERE ci.user_id = $1 AND p.is_active = true AND p.category_id = ANY($2)
+            """,
+            user_id, discount["applicable_category_ids"]
+        ) or ZERO
+
+    amount = ZERO
+    dtype = (discount["type"] or '').lower()
+    if dtype == 'percentage':
+        amount = (eligible_subtotal * (Decimal(discount["value"]) / Decimal('100'))).quantize(Decimal('0.01'))
+    elif dtype == 'fixed_amount':
+        amount = min(Decimal(discount["value"]), eligible_subtotal)
+    elif dtype == 'free_shipping':
+        amount = (Decimal(shipping) if shipping else ZERO).quantize(Decimal('0.01'))
+    if discount["maximum_discount_amount"] is not None:
+        amount = min(amount, Decimal(discount["maximum_discount_amount"]))
+    if amount <= 0:
+        return {"discount_total": ZERO, "discounts": [], "applied_code": code}
+    return {
+        "discount_total": amount,
+        "discounts": [{"source": "promotion", "code": discount["code"],
+                       "description": discount["name"] or "Promotion", "amount": amount}],
+        "applied_code": discount["code"],
+    }
+
+
+async def _create_codes(db, products):
+    now = datetime.now(timezone.utc)
+    product_ids = [row["id"] for row in products]
+    category_ids = sorted({row["category_id"] for row in products if row["category_id"] is not None})
+    scopes = [("all", None, None), ("specific_products", product_ids[::2], None),
+              ("specific_categories", None, category_ids[:1]), ("specific_products", [], None)]
+    kinds = [("percentage", Decimal("12.50")), ("fixed_amount", Decimal("80.00")), ("free_shipping", Decimal("0.00"))]
+    extras = [
+        {},
+        {"maximum_discount_amount": Decimal("30.00")},
+        {"minimum_order_amount": Decimal("400.00")},
+        {"usage_limit": 5, "used_count": 5},
+        {"starts_at": now + timedelta(days=1)},
+        {"ends_at": now - timedelta(days=1)},
+        {"is_active": False},
+    ]
+    codes = []
+    for n, ((applies_to, pids, cids), (kind, value), extra) in enumerate(itertools.product(scopes, kinds, extras)):
+        code = f"GOLDEN{n}"
+        await db.execute(
+            """
+            INSERT INTO discount_codes (code, name, type, value, applies_to, applicable_product_ids,
+                applicable_category_ids, minimum_order_amount, maximum_discount_amount, usage_limit,
+                used_count, starts_at, ends_at, is_active)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
+            """,
+            code, f"Golden {n}", kind, value, applies_to, pids, cids,
+            extra.get("minimum_order_amount"), extra.get("maximum_discount_amount"), extra.get("usage_limit"),
+            extra.get("used_count", 0), extra.get("starts_at"), extra.get("ends_at"), extra.get("is_active", True)
+        )
+        codes.append(code)
+    return codes + ["golden0", "NO-SUCH-CODE", None]
+
+
+async def run(carts: int):
+    db = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    transaction = db.transaction()
+    await transaction.start()
+    try:
+        user_id = await db.fetchval("SELECT id FROM users ORDER BY id LIMIT 1")
+        products = await db.fetch("SELECT id, category_id FROM products WHERE is_active = true ORDER BY id LIMIT 20")
+        if user_id is None or not products:
+            sys.exit("❌ Need a user and some active products")
+        codes = await _create_codes(db, products)
+
+        checked = mismatches = 0
+        for _ in range(carts):
+            await db.execute("DELETE FROM cart_items WHERE user_id = $1", user_id)
+            for row in random.sample(list(products), random.randint(0, len(products))):
+                await db.execute(
+                    "INSERT INTO cart_items (user_id, product_id, quantity) VALUES ($1, $2, $3)",
+                    user_id, row["id"], random.randint(1, 12)
+                )
+            lines = [dict(row) for row in await db.fetch(CART_LINES_QUERY, user_id)]
+
+            for code in codes:
+                row = await db.fetchrow(DISCOUNT_CODE_QUERY, code) if code else None
+                pricing = price_cart(lines, code, DiscountRule(row) if row else None)
+                expected = await legacy_discount(db, user_id, pricing.subtotal, pricing.estimated_shipping, code)
+                actual = {"discount_total": pricing.discount_total, "discounts": pricing.discounts,
+                          "applied_code": pricing.applied_code}
+                checked += 1
+                if actual != expected:
+                    mismatches += 1
+                    print(f"   ❌ {code}: engine {actual} != SQL {expected}")
+
+        print(f"{'✅' if not mismatches else '❌'} {checked} cart/code combinations, {mismatches} mismatches")
+        if mismatches:
+            sys.exit(1)
+    finally:
+        await transaction.rollback()
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carts", type=int, default=50)
+    asyncio.run(run(parser.parse_args().carts))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Convert an unpartitioned analytics_events table to daily partitions.
+
+Runs in one transaction:
+1. Renames the table to analytics_events_unpartitioned.
+2. Creates the partitioned table from schema.sql: (id, created_at)
+   primary key, bigint ids on the same sequence, the same foreign keys and
+   indexes, and a default partition.
+3. Creates one partition per day from the oldest event to --days-ahead
+   days ahead, then copies every row across.
+4. Drops the old table unless --keep-old is given.
+
+Rows without created_at get the conversion time. Event writes wait
+while it runs; the API's event buffer holds them and retries. Partitions
+past the retention period are dropped later by the API, after the hourly
+rollups have counted them, so create analytics_hourly_rollups and
+analytics_rollup_state from schema.sql first. Needs DATABASE_URL.
+
+    python scripts/partition_analytics_events.py --dry-run
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import asyncpg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from events.buffer import COLUMNS  # noqa: E402
+from events.partitions import DEFAULT_PARTITION, PARENT, EventPartitions  # noqa: E402
+
+OLD_TABLE = "analytics_events_unpartitioned"
+INDEXES = {
+    "idx_analytics_events_event_type": "event_type",
+    "idx_analytics_events_created_at": "created_at",
+}
+
+
+async def _convert(connection, args):
+    await connection.execute(f"LOCK TABLE {PARENT} IN ACCESS EXCLUSIVE MODE")
+    sequence = await connection.fetchval(f"SELECT pg_get_serial_sequence('{PARENT}', 'id')")
+    foreign_keys = await connection.fetch(
+        "SELECT conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint "
+        "WHERE conrelid = $1::regclass AND contype = 'f' ORDER BY conname",
+        PARENT
+    )
+
+    # Free the names the new table takes over
+    await connection.execute(f"ALTER TABLE {PARENT} RENAME TO {OLD_TABLE}")
+    await connection.execute(f"ALTER TABLE {OLD_TABLE} RENAME CONSTRAINT {PARENT}_pkey TO {OLD_TABLE}_pkey")
+    for index in INDEXES:
+        await connection.execute(f"DROP INDEX IF EXISTS {index}")
+    for fk in foreign_keys:
+        await connection.execute(f"ALTER TABLE {OLD_TABLE} DROP CONSTRAINT {fk['conname']}")
+
+    await connection.execute(f"""
+        CREATE TABLE {PARENT} (LIKE {OLD_TABLE} INCLUDING DEFAULTS, PRIMARY KEY (id, created_at))
+        PARTITION BY RANGE (created_at)
+    """)
+    await connection.execute(f"ALTER TABLE {PARENT} ALTER COLUMN id TYPE BIGINT")
+    if sequence:
+        await connection.execute(f"ALTER SEQUENCE {sequence} AS BIGINT OWNED BY {PARENT}.id")
+    for fk in foreign_keys:
+        await connection.execute(f"ALTER TABLE {PARENT} ADD CONSTRAINT {fk['conname']} {fk['definition']}")
+    await connection.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT")
+    for index, column in INDEXES.items():
+        await connection.execute(f"CREATE INDEX {index} ON {PARENT}({column})")
+
+    today = datetime.now(timezone.utc).date()
+    oldest = await connection.fetchval(f"SELECT MIN(created_at) FROM {OLD_TABLE}")
+    first = min(oldest.astimezone(timezone.utc).date(), today) if oldest else today
+    partitions = EventPartitions(days_ahead=args.days_ahead)
+    created = await partitions.ensure_range(connection, first, today + timedelta(days=args.days_ahead))
+
+    columns = ", ".join(("id",) + COLUMNS)
+    selected = ", ".join(("id",) + COLUMNS[:-1] + ("COALESCE(created_at, CURRENT_TIMESTAMP)",))
+    copied = await connection.execute(f"INSERT INTO {PARENT} ({columns}) SELECT {selected} FROM {OLD_TABLE}")
+    if not args.keep_old:
+        await connection.execute(f"DROP TABLE {OLD_TABLE}")
+    return len(created), int(copied.split()[-1])
+
+
+async def run(args):
+    connection = await asyncpg.connect(dsn=os.getenv("DATABASE_URL"))
+    try:
+        relkind = await connection.fetchval(f"SELECT relkind::text FROM pg_class WHERE oid = to_regclass('{PARENT}')")
+        if relkind != "r":
+            sys.exit(f"❌ {PARENT} is {'already partitioned' if relkind == 'p' else 'missing'}")
+        rows, oldest = await connection.fetchrow(f"SELECT COUNT(*), MIN(created_at) FROM {PARENT}")
+        print(f"📦 {rows} events since {oldest or 'n/a'}")
+        if args.dry_run:
+            return
+
+        started = time.perf_counter()
+        async with connection.transaction():
+            partitions, copied = await _convert(connection, args)
+        print(f"✅ Copied {copied} events into {partitions} daily partitions in {time.perf_counter() - started:.1f}s"
+              + (f"; old table kept as {OLD_TABLE}" if args.keep_old else ""))
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days-ahead", type=int, default=7, help="partitions to create past today")
+    parser.add_argument("--keep-old", action="store_true", help=f"keep the old table as {OLD_TABLE}")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be converted")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Reconciliation report for the Redis discount usage counters.
+
+Flushes pending uses to discount_codes.used_count, then lists every code
+whose Redis count or used_count disagrees with discount_code_uses. With
+--repair both are reset from discount_code_uses; run that while checkouts
+are quiet. Needs DATABASE_URL and REDIS_URL.
+
+    python scripts/reconcile_discount_usage.py --repair
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import asyncpg
+import redis.asyncio as redis
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from promos.usage import DiscountUsageCounters  # noqa: E402
+
+
+async def run(args):
+    pool = await asyncpg.create_pool(dsn=os.getenv("DATABASE_URL"), min_size=1, max_size=2)
+    redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"), decode_responses=True)
+    counters = DiscountUsageCounters(enabled=True)
+    counters.bind(redis_client, pool)
+    try:
+        flushed = await counters.flush()
+        report = await counters.reconcile(repair=args.repair)
+        print(f"🎟️  Flushed {flushed} pending uses; {len(report)} code(s) drifted")
+        for entry in report:
+            print(f"   {entry['code']:<20} uses {entry['uses']:>6}  redis {entry['redis_used']:>6} "
+                  f"(+{entry['reserved']} reserved)  used_count {entry['used_count']:>6} (+{entry['unflushed']} unflushed)")
+        if report and args.repair:
+            print("✅ Counters reset from discount_code_uses")
+        elif report:
+            sys.exit(1)
+    finally:
+        await redis_client.close()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repair", action="store_true", help="reset drifted counters from discount_code_uses")
+    asyncio.run(run(parser.parse_args()))
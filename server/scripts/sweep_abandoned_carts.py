@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Run one abandoned-cart sweep now (the same job the server schedules).
+
+Removes carts idle for longer than --idle-days, writing a cart_abandoned
+analytics event for each, and reports carts, rows and rows per second.
+--dry-run only counts what would be swept. With CART_STORE=redis let the
+server run the sweep instead, so cached carts are evicted too. Needs
+DATABASE_URL.
+
+    python scripts/sweep_abandoned_carts.py --idle-days 30 --rate 5000
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import asyncpg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cart.sweeper import AbandonedCartSweeper  # noqa: E402
+
+COUNT_SQL = """
+    SELECT COUNT(DISTINCT ci.user_id) AS carts, COUNT(*) AS rows
+    FROM cart_items ci
+    WHERE NOT EXISTS (
+        SELECT 1 FROM cart_items recent WHERE recent.user_id = ci.user_id AND recent.updated_at >= $1
+    )
+"""
+
+
+async def run(args):
+    pool = await asyncpg.create_pool(dsn=os.getenv("DATABASE_URL"), min_size=1, max_size=2)
+    try:
+        if args.dry_run:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=args.idle_days)
+            row = await pool.fetchrow(COUNT_SQL, cutoff)
+            print(f"🧹 {row['carts']} carts ({row['rows']} rows) idle for more than {args.idle_days:g} days")
+            return
+        sweeper = AbandonedCartSweeper(
+            idle_days=args.idle_days, batch_size=args.batch_size, max_rows_per_second=args.rate
+        )
+        sweeper.bind(pool)
+        report = await sweeper.sweep()
+        if not report:
+            sys.exit("❌ Another sweep holds the lock")
+        print(f"🧹 Swept {report['carts']} carts ({report['rows']} rows) in {report['seconds']}s "
+              f"({report['rows_per_second']} rows/s)")
+        if sweeper.stats()["vacuums"]:
+            print("   cart_items vacuumed")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--idle-days", type=float, default=30)
+    parser.add_argument("--batch-size", type=int, default=500, help="carts per delete statement")
+    parser.add_argument("--rate", type=float, default=2000, help="max rows deleted per second")
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(run(parser.parse_args()))